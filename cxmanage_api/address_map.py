@@ -0,0 +1,216 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: address_map.py"""
+
+import re
+
+from cxmanage_api.cx_exceptions import IPDiscoveryError
+
+
+_MAC = r'[0-9a-fA-F]{1,2}(?::[0-9a-fA-F]{1,2}){5}'
+_DHCPD_LEASE_RE = re.compile(r'^[ \t]*lease[ \t]+(\S+)[ \t]*\{(.*?)\}',
+                             re.M | re.S)
+_DHCPD_HARDWARE_RE = re.compile(r'hardware[ \t]+ethernet[ \t]+(%s)' % _MAC)
+_DHCPD_STATE_RE = re.compile(r'^[ \t]*binding[ \t]+state[ \t]+(\w+)', re.M)
+_DNSMASQ_LEASE_RE = re.compile(
+    r'^[ \t]*\d+[ \t]+(%s)[ \t]+(\S+)' % _MAC, re.M
+)
+# ip neigh, arp -a, and arp -n or /proc/net/arp, in that order
+_NEIGHBOR_RE = re.compile(
+    r'^[ \t]*(\S+)[ \t][^\n]*?\blladdr[ \t]+(%s)'
+    r'|\((\S+)\)[ \t]+at[ \t]+(%s)'
+    r'|^[ \t]*([0-9a-fA-F.:]+)[ \t][^\n]*?(%s)' % (_MAC, _MAC, _MAC), re.M
+)
+
+
+def parse_leases(contents):
+    """Parse a DHCP server's lease file. Both ISC dhcpd (dhcpd.leases) and
+    dnsmasq (dnsmasq.leases) formats are understood.
+
+    >>> parse_leases('lease 192.168.100.100 {\\n' +
+    ...              '  binding state active;\\n' +
+    ...              '  hardware ethernet fc:2f:40:ab:cd:cc;\\n' +
+    ...              '}\\n')
+    {'fc:2f:40:ab:cd:cc': '192.168.100.100'}
+    >>> parse_leases('1384372342 fc:2f:40:ab:cd:cc 192.168.100.100 * *\\n')
+    {'fc:2f:40:ab:cd:cc': '192.168.100.100'}
+
+    .. note::
+        * dhcpd appends to its lease file, so later leases replace earlier
+          ones. Leases that are no longer bound are skipped.
+
+    :param contents: The lease file contents.
+    :type contents: string
+
+    :return: A map of mac_addresses->ip_addresses.
+    :rtype: dictionary
+
+    """
+    results = {}
+    for ip_address, body in _DHCPD_LEASE_RE.findall(contents):
+        hardware = _DHCPD_HARDWARE_RE.search(body)
+        if (hardware == None):
+            continue
+        mac_address = normalize_mac(hardware.group(1))
+        state = _DHCPD_STATE_RE.search(body)
+        if (state != None and state.group(1) != "active"):
+            if (results.get(mac_address) == ip_address):
+                del results[mac_address]
+            continue
+        results[mac_address] = ip_address
+
+    for mac_address, ip_address in _DNSMASQ_LEASE_RE.findall(contents):
+        results[normalize_mac(mac_address)] = ip_address
+
+    return results
+
+
+def parse_neighbors(contents, ipv6=False):
+    """Parse a dump of an ARP or neighbor table. The output of
+    "ip neigh", "arp -a", "arp -n" and /proc/net/arp are understood.
+
+    >>> parse_neighbors('192.168.100.100 dev eth0 lladdr fc:2f:40:ab:cd:cc '
+    ...                 'REACHABLE\\n' +
+    ...                 '? (192.168.100.101) at fc:2f:40:ab:cd:cd [ether] '
+    ...                 'on eth0\\n')
+    {'fc:2f:40:ab:cd:cc': '192.168.100.100',
+     'fc:2f:40:ab:cd:cd': '192.168.100.101'}
+
+    :param contents: The ARP or neighbor table.
+    :type contents: string
+    :param ipv6: Return IPv6 addresses instead of IPv4.
+    :type ipv6: boolean
+
+    :return: A map of mac_addresses->ip_addresses.
+    :rtype: dictionary
+
+    """
+    results = {}
+    for match in _NEIGHBOR_RE.findall(contents):
+        ip_address, mac_address = [x for x in match if x][:2]
+        mac_address = normalize_mac(mac_address)
+        if (mac_address == "00:00:00:00:00:00" or
+                (":" in ip_address) != ipv6):
+            continue
+        results[mac_address] = ip_address
+    return results
+
+
+def read_leases(path):
+    """Read a DHCP server's lease file. See parse_leases().
+
+    >>> read_leases('/var/lib/dhcp/dhcpd.leases')
+    {'fc:2f:40:ab:cd:cc': '192.168.100.100'}
+
+    :param path: Path to the lease file.
+    :type path: string
+
+    :return: A map of mac_addresses->ip_addresses.
+    :rtype: dictionary
+
+    """
+    with open(path) as lease_file:
+        return parse_leases(lease_file.read())
+
+
+def read_neighbors(path, ipv6=False):
+    """Read a dump of an ARP or neighbor table. See parse_neighbors().
+
+    >>> read_neighbors('/proc/net/arp')
+    {'fc:2f:40:ab:cd:cc': '192.168.100.100'}
+
+    :param path: Path to the table dump.
+    :type path: string
+    :param ipv6: Return IPv6 addresses instead of IPv4.
+    :type ipv6: boolean
+
+    :return: A map of mac_addresses->ip_addresses.
+    :rtype: dictionary
+
+    """
+    with open(path) as neighbor_file:
+        return parse_neighbors(neighbor_file.read(), ipv6)
+
+
+def find_server_ip(mac_addresses, address_map, port=None):
+    """Find the IP address for one of a node's MAC addresses.
+
+    >>> find_server_ip({0: ['fc:2f:40:ab:cd:cc'], 1: ['fc:2f:40:ab:cd:cd']},
+    ...                {'fc:2f:40:ab:cd:cd': '192.168.100.100'})
+    '192.168.100.100'
+
+    :param mac_addresses: A map of ports->mac_addresses for the node, as
+                          returned by Node.get_mac_addresses().
+    :type mac_addresses: dictionary
+    :param address_map: A map of mac_addresses->ip_addresses.
+    :type address_map: dictionary
+    :param port: Only look at this port's MAC addresses. By default, the
+                 first port with an address is used.
+    :type port: integer
+
+    :return: The server IP address.
+    :rtype: string
+
+    :raises IPDiscoveryError: If none of the MAC addresses have an address.
+
+    """
+    if (port != None):
+        ports = [port]
+    else:
+        ports = sorted(mac_addresses)
+
+    for each in ports:
+        for mac_address in mac_addresses.get(each, []):
+            ip_address = address_map.get(normalize_mac(mac_address))
+            if (ip_address != None):
+                return ip_address
+
+    raise IPDiscoveryError('No address found for MAC addresses %s' %
+        ', '.join(sum([mac_addresses.get(x, []) for x in ports], [])))
+
+
+def normalize_mac(mac_address):
+    """Put a MAC address in the lowercase, zero padded form used as keys.
+
+    >>> normalize_mac('FC:2F:40:AB:CD:C')
+    'fc:2f:40:ab:cd:0c'
+
+    :param mac_address: The MAC address.
+    :type mac_address: string
+
+    :return: The normalized MAC address.
+    :rtype: string
+
+    """
+    return ':'.join(x.zfill(2) for x in mac_address.lower().split(':'))
+
+
+# End of file: ./address_map.py
@@ -33,9 +33,10 @@
 import sys
 import time
 
-from cxmanage_api.tftp import InternalTftp, ExternalTftp
+from cxmanage_api.tftp import InternalTftp, InternalTftpPool, ExternalTftp
 from cxmanage_api.node import Node
 from cxmanage_api.tasks import TaskQueue
+from cxmanage_api.tftp_metrics import TransferLog
 from cxmanage_api.cx_exceptions import TftpException
 
 
@@ -58,19 +59,33 @@ COMPONENTS = [
 
 
 def get_tftp(args):
-    """Get a TFTP server"""
+    """Get a TFTP server, or a pool of them if more than one is asked for"""
+    count = args.tftp_servers
     if args.internal_tftp:
-        tftp_args = args.internal_tftp.split(':')
-        if len(tftp_args) == 1:
-            ip_address = tftp_args[0]
-            port = 0
-        elif len(tftp_args) == 2:
-            ip_address = tftp_args[0]
-            port = int(tftp_args[1])
-        else:
-            print ('ERROR: %s is not a valid argument for --internal-tftp'
-                    % args.internal_tftp)
-            sys.exit(1)
+        endpoints = []
+        for entry in args.internal_tftp.split(','):
+            tftp_args = entry.split(':')
+            if len(tftp_args) == 1:
+                ip_address = tftp_args[0]
+                port = 0
+            elif len(tftp_args) == 2:
+                ip_address = tftp_args[0]
+                port = int(tftp_args[1])
+            else:
+                print ('ERROR: %s is not a valid argument for --internal-tftp'
+                        % entry)
+                sys.exit(1)
+            endpoints.append((ip_address, port))
+
+        if len(endpoints) == 1 and count > 1:
+            ip_address, port = endpoints[0]
+            endpoints = [
+                (ip_address, port + x if port else 0) for x in range(count)
+            ]
+        if len(endpoints) > 1:
+            return InternalTftpPool(endpoints=endpoints, verbose=args.verbose)
+
+        ip_address, port = endpoints[0]
         return InternalTftp(ip_address=ip_address, port=port,
                 verbose=args.verbose)
 
@@ -89,6 +104,8 @@ def get_tftp(args):
         return ExternalTftp(ip_address=ip_address, port=port,
                 verbose=args.verbose)
 
+    if count > 1:
+        return InternalTftpPool(count=count, verbose=args.verbose)
     return InternalTftp(verbose=args.verbose)
 
 # pylint: disable=R0912
@@ -344,6 +361,32 @@ def parse_ip_range_entry(entry):
     return addresses
 
 
+def print_transfer_stats(transfer_log=None):
+    """ Print a summary of TFTP transfers, for each peer and direction """
+    if transfer_log == None:
+        transfer_log = TransferLog.default()
+
+    print "TFTP transfers:"
+    peers = transfer_log.get_peers()
+    if not peers:
+        print "  none"
+    for peer, direction in peers + [(None, None)]:
+        stats = transfer_log.get_stats(peer=peer, direction=direction)
+        name = "Total" if peer == None else "%s %s" % (peer, direction)
+        print "  %s: %s" % (name, _format_transfer_stats(stats))
+
+
+def _format_transfer_stats(stats):
+    """ Format the stats for some TFTP transfers """
+    if stats == None:
+        return "none"
+    return ("%i transfers, %i failed, %i bytes in %.2f seconds (%.1f KB/s), "
+            "%i retransmits, %i timeouts" % (
+                stats["count"], stats["failures"], stats["size"],
+                stats["elapsed"], stats["throughput"] / 1024,
+                stats["retransmits"], stats["timeouts"]))
+
+
 def _print_errors(args, nodes, errors):
     """ Print errors if they occured """
     if errors:
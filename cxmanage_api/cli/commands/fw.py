@@ -58,7 +58,7 @@ def fwupdate_command(args):
             print "Updating firmware..."
 
         _, errors = run_command(args, nodes, "update_firmware", package,
-            args.partition, args.priority)
+            args.partition, args.priority, args.delta)
         if errors:
             print "ERROR: Firmware update failed."
             return True
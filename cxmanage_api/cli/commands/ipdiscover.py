@@ -31,7 +31,13 @@
 # THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 # DAMAGE.
 
+from pyipmi import IpmiError
+from tftpy.TftpShared import TftpException
+
 from cxmanage_api.cli import get_tftp, get_nodes, get_node_strings, run_command
+from cxmanage_api.server_ip_cache import ServerIPCache
+from cxmanage_api.address_map import read_leases, read_neighbors
+from cxmanage_api.cx_exceptions import ParseError
 
 
 def ipdiscover_command(args):
@@ -42,9 +48,40 @@ def ipdiscover_command(args):
     if not args.quiet:
         print 'Getting server-side IP addresses...'
 
-    results, errors = run_command(
-        args, nodes, 'get_server_ip', args.interface, args.ipv6, args.aggressive
-    )
+    if args.leases or args.arp:
+        # Look the nodes' MAC addresses up instead of using SOL
+        address_map = {}
+        try:
+            for path in args.leases or []:
+                address_map.update(read_leases(path))
+            # ARP entries are more current than leases, so they win
+            for path in args.arp or []:
+                address_map.update(read_neighbors(path, args.ipv6))
+        except IOError as err:
+            print 'ERROR: %s' % err
+            return True
+
+        # Every node's MAC addresses come from the same fabric MAC table
+        results, errors = run_command(
+            args, nodes, 'get_server_ip_by_mac', address_map, None,
+            _get_mac_table(nodes)
+        )
+
+    else:
+        # Each node needs its own SOL session, so bound them with the threads
+        if args.threads == None or args.threads > args.max_sessions:
+            args.threads = args.max_sessions
+
+        cache = None
+        mac_table = None
+        if not args.no_cache:
+            cache = ServerIPCache.default()
+            mac_table = _get_mac_table(nodes)
+
+        results, errors = run_command(
+            args, nodes, 'get_server_ip', args.interface, args.ipv6,
+            args.aggressive, cache, None, mac_table
+        )
 
     if results:
         node_strings = get_node_strings(args, results, justify=True)
@@ -58,3 +95,21 @@ def ipdiscover_command(args):
         print 'Some errors occurred during the command.'
 
     return len(errors) > 0
+
+
+def _get_mac_table(nodes):
+    """Read the fabric MAC table once, from the first node, rather than once
+    per node. Returns None if it can't be read, or if some of the nodes
+    aren't in that node's fabric."""
+    if not nodes:
+        return None
+
+    try:
+        ip_addresses = nodes[0].get_fabric_ipinfo().values()
+        mac_table = nodes[0].get_fabric_macaddrs()
+    except (IpmiError, TftpException, ParseError):
+        return None
+
+    if any(node.ip_address not in ip_addresses for node in nodes):
+        return None
+    return mac_table
@@ -32,10 +32,18 @@
 # DAMAGE.
 
 
+import shlex
+
 from cxmanage_api.cli import get_tftp, get_nodes, get_node_strings, run_command
 
 def ipmitool_command(args):
     """run arbitrary ipmitool command"""
+    if args.batch:
+        return ipmitool_batch_command(args)
+    if not args.ipmitool_args:
+        print "ERROR: No ipmitool arguments given."
+        return True
+
     if args.lanplus:
         ipmitool_args = ['-I', 'lanplus'] + args.ipmitool_args
     else:
@@ -61,3 +69,47 @@ def ipmitool_command(args):
         print "Some errors occured during the command.\n"
 
     return len(errors) > 0
+
+
+def ipmitool_batch_command(args):
+    """run a file of ipmitool commands, one ipmitool process per node"""
+    commands = []
+    with open(args.batch) as batch_file:
+        for line in batch_file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                commands.append(shlex.split(line))
+    if args.ipmitool_args:
+        commands.append(args.ipmitool_args)
+
+    options = ['-I', 'lanplus'] if args.lanplus else []
+
+    tftp = get_tftp(args)
+    nodes = get_nodes(args, tftp)
+
+    if not args.quiet:
+        print "Running %i IPMItool commands..." % len(commands)
+    results, errors = run_command(args, nodes, "ipmitool_batch", commands,
+            options)
+
+    # Print results
+    failed = False
+    node_strings = get_node_strings(args, results, justify=False)
+    for node in nodes:
+        if not node in results:
+            continue
+        for command, (stdout, stderr, status) in zip(commands,
+                                                      results[node]):
+            output = (stdout + stderr).strip()
+            if status != 0:
+                failed = True
+            if output:
+                print "[ IPMItool output from %s: %s ]" % (node_strings[node],
+                        " ".join(command))
+                print output
+                print
+
+    if not args.quiet and (errors or failed):
+        print "Some errors occured during the command.\n"
+
+    return len(errors) > 0 or failed
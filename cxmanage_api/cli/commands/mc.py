@@ -32,7 +32,8 @@
 # DAMAGE.
 
 
-from cxmanage_api.cli import get_tftp, get_nodes, run_command
+from cxmanage_api.cli import get_tftp, get_nodes, get_node_strings, \
+        run_command
 
 
 def mcreset_command(args):
@@ -43,7 +44,15 @@ def mcreset_command(args):
     if not args.quiet:
         print 'Sending MC reset command...'
 
-    _, errors = run_command(args, nodes, 'mc_reset')
+    results, errors = run_command(args, nodes, 'mc_reset', args.wait)
+
+    if args.wait and not args.quiet and results:
+        node_strings = get_node_strings(args, results, justify=True)
+        for node in nodes:
+            if node in results:
+                print "%s: back up after %.1f seconds" % (node_strings[node],
+                                                         results[node])
+        print
 
     if not args.quiet and not errors:
         print 'Command completed successfully.\n'
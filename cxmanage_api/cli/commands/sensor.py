@@ -33,6 +33,7 @@
 
 
 from cxmanage_api.cli import get_tftp, get_nodes, get_node_strings, run_command
+from cxmanage_api.telemetry import parse_sensor_reading
 
 # pylint: disable=R0914
 def sensor_command(args):
@@ -52,13 +53,12 @@ def sensor_command(args):
                 if not sensor_name in sensors:
                     sensors[sensor_name] = []
 
-                reading = sensor.sensor_reading.replace("(+/- 0) ", "")
-                try:
-                    value = float(reading.split()[0])
-                    suffix = reading.lstrip("%f " % value)
-                    sensors[sensor_name].append((node, value, suffix))
-                except ValueError:
+                reading = sensor.sensor_reading
+                value, suffix = parse_sensor_reading(reading)
+                if value is None:
                     sensors[sensor_name].append((node, reading, ""))
+                else:
+                    sensors[sensor_name].append((node, value, suffix))
 
     node_strings = get_node_strings(args, results, justify=True)
     if node_strings:
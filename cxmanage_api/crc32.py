@@ -32,8 +32,17 @@
 """
 This is a python implementation of freebsd's ssh/crc32.c.
 Written in python for convenient use in the cxmanage script.
+
+The table-driven implementation is kept as a fallback. When zlib is available
+it does the work instead, which is much faster on large images.
 """
 
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+
 TABLE = [0x00000000, 0x77073096, 0xee0e612c, 0x990951ba,
         0x076dc419, 0x706af48f, 0xe963a535, 0x9e6495a3,
         0x0edb8832, 0x79dcb8a4, 0xe0d5e91e, 0x97d2d988,
@@ -116,6 +125,26 @@ def get_crc32(string, crc=0):
     :param crc: The XOR offset.
     :type crc: integer
 
+    """
+    if (zlib == None):
+        return get_crc32_table(string, crc)
+
+    # zlib inverts the crc before and after, which this crc32 doesn't.
+    return (zlib.crc32(string, crc ^ 0xFFFFFFFF) & 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+def get_crc32_table(string, crc=0):
+    """Computes the crc32 value of the given string, one byte at a time in
+    pure python. Same results as get_crc32(), but much slower.
+
+    >>> from cxmanage_api.crc32 import get_crc32_table
+    >>> get_crc32_table(string='Foo Bar Baz')
+    3901333286
+
+    :param string: The string to calculate the crc32 for.
+    :type string: string
+    :param crc: The XOR offset.
+    :type crc: integer
+
     """
     for char in string:
         byte = ord(char)
@@ -123,4 +152,36 @@ def get_crc32(string, crc=0):
     return crc
 
 
+class Crc32(object):
+    """Incremental crc32, for data that arrives in chunks.
+
+    >>> from cxmanage_api.crc32 import Crc32
+    >>> crc = Crc32()
+    >>> crc = crc.update('Foo ').update('Bar Baz')
+    >>> crc.crc
+    3901333286
+
+    :param crc: The XOR offset to start from.
+    :type crc: integer
+
+    """
+
+    def __init__(self, crc=0):
+        """Default constructor for the Crc32 class."""
+        self.crc = crc
+
+    def update(self, string):
+        """Add a chunk of data to the crc32.
+
+        :param string: The next chunk of data.
+        :type string: string
+
+        :returns: This Crc32 object, so updates can be chained.
+        :rtype: Crc32
+
+        """
+        self.crc = get_crc32(string, self.crc)
+        return self
+
+
 # End of file: ./crc32.py
@@ -39,12 +39,16 @@
 import time
 import re
 
-from cxmanage_api.tasks import DEFAULT_TASK_QUEUE
+from cxmanage_api.tasks import DEFAULT_TASK_QUEUE, TaskQueue
 from cxmanage_api.tftp import InternalTftp
 from cxmanage_api.node import Node as NODE
 from cxmanage_api.credentials import Credentials
+from cxmanage_api.ip_retriever import MAX_SOL_SESSIONS
+from cxmanage_api.server_ip_cache import ServerIPCache
+from cxmanage_api.address_map import find_server_ip
+from cxmanage_api.sel_log import SELIndex
 from cxmanage_api.cx_exceptions import CommandFailedError, IpmiError, \
-    TftpException, ParseError, TimeoutError
+    TftpException, ParseError, TimeoutError, IPDiscoveryError
 
 
 class Fabric(object):
@@ -564,8 +568,33 @@ class Fabric(object):
                       is returned or a Command object (can get status, etc.).
         :type async: boolean
 
+        :returns: If waiting, the number of seconds each node's reset took.
+        :rtype: dictionary
+
+        """
+        return self._run_on_all_nodes(async, "mc_reset", wait)
+
+    def wait_for_mc_reset(self, timeout=300, async=False):
+        """Waits for every node to come back up after an mc_reset.
+
+        Returns as soon as the last node answers. See
+        Node.wait_for_mc_reset().
+
+        >>> fabric.mc_reset()
+        >>> fabric.wait_for_mc_reset()
+        {0: 21.348, 1: 22.915, 2: 21.507, 3: 24.121}
+
+        :param timeout: Seconds after each node's reset to give up waiting.
+        :type timeout: float
+        :param async: Flag that determines if the command result (dictionary)
+                      is returned or a Command object (can get status, etc.).
+        :type async: boolean
+
+        :returns: The number of seconds each node's reset took.
+        :rtype: dictionary
+
         """
-        self._run_on_all_nodes(async, "mc_reset", wait)
+        return self._run_on_all_nodes(async, "wait_for_mc_reset", timeout)
 
     def get_sensors(self, search="", async=False):
         """Gets sensors from all nodes.
@@ -611,6 +640,48 @@ class Fabric(object):
         """
         return self._run_on_all_nodes(async, "get_sensors", search)
 
+    def get_sel(self, incremental=False, async=False):
+        """Gets the system event log from all nodes.
+
+        >>> fabric.get_sel()
+        {
+         0: ['1 | 06/21/2013 | 16:13:31 | System Event #0xf4 |', ...],
+         1: ['1 | 06/21/2013 | 16:13:32 | System Event #0xf4 |', ...],
+         2: ['1 | 06/21/2013 | 16:13:31 | System Event #0xf4 |', ...],
+         3: ['1 | 06/21/2013 | 16:13:33 | System Event #0xf4 |', ...]
+        }
+
+        :param incremental: Only fetch entries added since the last
+                            incremental call. See Node.get_sel().
+        :type incremental: boolean
+        :param async: Flag that determines if the command result (dictionary)
+                      is returned or a Command object (can get status, etc.).
+        :type async: boolean
+
+        """
+        return self._run_on_all_nodes(async, "get_sel", incremental)
+
+    def get_sel_index(self, incremental=False):
+        """Gets the system event log from all nodes as a searchable index.
+
+        >>> index = fabric.get_sel_index()
+        >>> index.query(sensor="watchdog", since=time.time() - 3600)
+        [<SELRecord node 2 #0x4: Watchdog 2 #0xfd | Hard reset | Asserted>]
+
+        :param incremental: Only fetch entries added since the last
+                            incremental call. See Node.get_sel().
+        :type incremental: boolean
+
+        :returns: Parsed SEL records of every node, indexed by node ID,
+                  timestamp, sensor and event.
+        :rtype: `SELIndex <sel_log.html>`_
+
+        """
+        index = SELIndex()
+        for node_id, entries in self.get_sel(incremental).iteritems():
+            index.add(entries, node_id)
+        return index
+
     def get_uplink_status(self):
         """Get the uplink status for this node
 
@@ -718,7 +789,7 @@ class Fabric(object):
                                       partition_arg, priority)
 
     def update_firmware(self, package, partition_arg="INACTIVE",
-                        priority=None, async=False):
+                        priority=None, delta=False, async=False):
         """Updates the firmware on all nodes.
 
         >>> fabric.update_firmware(package=fwpkg)
@@ -729,12 +800,14 @@ class Fabric(object):
         :type partition_arg: string
         :param priority: SIMG header Priority setting.
         :type priority: integer
+        :param delta: Skip images that the target partitions already hold.
+        :type delta: boolean
         :param async: Flag that determines if the command result (dictionary)
                       is returned or a Command object (can get status, etc.).
         :type async: boolean
         """
         self._run_on_all_nodes(async, "update_firmware", package,
-                               partition_arg, priority)
+                               partition_arg, priority, delta)
 
     def config_reset(self, async=False):
         """Resets the configuration on all nodes to factory defaults.
@@ -910,6 +983,37 @@ class Fabric(object):
         return self._run_on_all_nodes(asynchronous, "ipmitool_command",
                                       ipmitool_args)
 
+    def ipmitool_batch(self, commands, options=None, asynchronous=False):
+        """Run a batch of IPMItool commands on all nodes, with one ipmitool
+        process per node. See Node.ipmitool_batch().
+
+        >>> fabric.ipmitool_batch([['cxoem', 'fabric', 'get', 'macaddr',
+        ...                         'interface', '0'],
+        ...                        ['cxoem', 'fabric', 'get', 'macaddr',
+        ...                         'interface', '1']])
+        {
+         0: [('fc:2f:40:3b:ec:40\n', '', 0), ('fc:2f:40:3b:ec:41\n', '', 0)],
+         1: [('fc:2f:40:91:dc:40\n', '', 0), ('fc:2f:40:91:dc:41\n', '', 0)],
+         2: [('fc:2f:40:ab:f7:14\n', '', 0), ('fc:2f:40:ab:f7:15\n', '', 0)],
+         3: [('fc:2f:40:88:b3:6c\n', '', 0), ('fc:2f:40:88:b3:6d\n', '', 0)]
+        }
+
+        :param commands: ipmitool arguments for each command.
+        :type commands: list
+        :param options: ipmitool options to use for every command, such as
+                        ['-I', 'lanplus'].
+        :type options: list
+        :param async: Flag that determines if the command result (dictionary)
+                      is returned or a Task object (can get status, etc.).
+        :type async: boolean
+
+        :returns: (stdout, stderr, status) for each command, for each node.
+        :rtype: dictionary
+
+        """
+        return self._run_on_all_nodes(asynchronous, "ipmitool_batch",
+                                      commands, options)
+
     def get_ubootenv(self, async=False):
         """Gets the u-boot environment from all nodes.
 
@@ -931,11 +1035,18 @@ class Fabric(object):
         """
         return self._run_on_all_nodes(async, "get_ubootenv")
 
+    # pylint: disable=R0913
     def get_server_ip(self, interface=None, ipv6=False, aggressive=False,
-                      async=False):
+                      async=False, max_sessions=MAX_SOL_SESSIONS,
+                      cache=None, use_cache=True):
         """Get the server IP address from all nodes. The nodes must be powered
         on for this to work.
 
+        Discovery runs on its own task queue, so it doesn't wait behind other
+        commands, and at most max_sessions SOL sessions are open at once.
+        Addresses found before are taken from the cache instead, as long as
+        the MAC address they were found on is still in the fabric MAC table.
+
         >>> fabric.get_server_ip()
         {
          0: '192.168.100.100',
@@ -953,14 +1064,82 @@ class Fabric(object):
         :param async: Flag that determines if the command result (dictionary)
                       is returned or a Task object (can get status, etc.).
         :type async: boolean
+        :param max_sessions: Most SOL sessions to have active at once.
+        :type max_sessions: integer
+        :param cache: Cache of server IP addresses. Defaults to
+                      ServerIPCache.default().
+        :type cache: `ServerIPCache <server_ip_cache.html>`_
+        :param use_cache: Whether to use the cache at all.
+        :type use_cache: boolean
 
         :return: Server IP addresses for all nodes..
         :rtype: dictionary or `Task <command.html>`_
 
         """
-        return self._run_on_all_nodes(
-            async, "get_server_ip", interface, ipv6, aggressive
-        )
+        mac_table = {}
+        if (not use_cache):
+            cache = None
+        else:
+            if (cache == None):
+                cache = ServerIPCache.default()
+            try:
+                mac_table = self.get_mac_addresses()
+            except (IpmiError, TftpException, ParseError):
+                pass
+
+        task_queue = TaskQueue(threads=max_sessions,
+                               delay=self.task_queue.delay)
+        tasks = {}
+        for node_id, node in self.nodes.iteritems():
+            mac_addresses = None
+            if (node_id in mac_table):
+                mac_addresses = sum(mac_table[node_id].values(), [])
+            tasks[node_id] = task_queue.put(
+                node.get_server_ip, interface, ipv6, aggressive, cache,
+                mac_addresses
+            )
+        return self._join_tasks(async, tasks)
+
+    def get_server_ip_by_mac(self, address_map, port=None):
+        """Get the server IP address for all nodes by looking up their MAC
+        addresses in a map built from DHCP leases or an ARP table. The fabric
+        MAC table is read once, and no SOL sessions are used.
+
+        >>> from cxmanage_api.address_map import read_leases
+        >>> address_map = read_leases('/var/lib/dhcp/dhcpd.leases')
+        >>> fabric.get_server_ip_by_mac(address_map)
+        {
+         0: '192.168.100.100',
+         1: '192.168.100.101',
+         2: '192.168.100.102',
+         3: '192.168.100.103'
+        }
+
+        :param address_map: A map of mac_addresses->ip_addresses.
+        :type address_map: dictionary
+        :param port: Only look at this port's MAC addresses. By default, the
+                     first port with an address is used.
+        :type port: integer
+
+        :return: Server IP addresses for all nodes.
+        :rtype: dictionary
+
+        :raises CommandFailedError: If some nodes' addresses weren't found.
+
+        """
+        mac_table = self.get_mac_addresses()
+        results = {}
+        errors = {}
+        for node_id in self.nodes:
+            try:
+                results[node_id] = find_server_ip(
+                    mac_table.get(node_id, {}), address_map, port
+                )
+            except IPDiscoveryError as err:
+                errors[node_id] = err
+        if errors:
+            raise CommandFailedError(results, errors)
+        return results
 
     def get_ipsrc(self):
         """Return the ipsrc for the fabric.
@@ -1302,11 +1481,22 @@ class Fabric(object):
 
     def _run_on_all_nodes(self, async, name, *args, **kwargs):
         """Start a command on all nodes."""
+        return self._run_on_all_nodes_with(
+            self.task_queue, async, name, *args, **kwargs
+        )
+
+    def _run_on_all_nodes_with(self, task_queue, async, name, *args,
+                               **kwargs):
+        """Start a command on all nodes, using the given task queue."""
         tasks = {}
         for node_id, node in self.nodes.iteritems():
-            tasks[node_id] = self.task_queue.put(getattr(node, name), *args,
-                                                 **kwargs)
+            tasks[node_id] = task_queue.put(getattr(node, name), *args,
+                                            **kwargs)
+        return self._join_tasks(async, tasks)
 
+    @staticmethod
+    def _join_tasks(async, tasks):
+        """Return the tasks, or wait for them and return their results."""
         if async:
             return tasks
         else:
@@ -0,0 +1,264 @@
+"""Calxeda: fabric_parsers.py"""
+
+
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+
+
+import re
+import socket
+
+from cxmanage_api.cx_exceptions import ParseError
+
+
+# Each regex matches a whole line. Lines we don't understand are captured by
+# a trailing catch-all alternative so they can be reported in the same pass.
+_IPINFO_RE = re.compile(
+    r'^[ \t]*\S+[ \t]+(\S+?):?[ \t]+(\S+)[^\n]*$|^([^\n]*\S[^\n]*)$', re.M
+)
+_MACADDRS_RE = re.compile(
+    r'^[ \t]*\S+[ \t]+(\d+),?[ \t]+\S+[ \t]+(\d+):?[ \t]+'
+    r'([0-9a-fA-F]{1,2}(?::[0-9a-fA-F]{1,2}){5})(?:[ \t][^\n]*)?$'
+    r'|^([^\n]*\S[^\n]*)$', re.M
+)
+_UPLINK_INFO_RE = re.compile(
+    r'^[ \t]*Node[ \t]+(\d+):([^\n]*)$|^([^\n]*\S[^\n]*)$', re.M
+)
+_UPLINK_PAIR_RE = re.compile(r'([^\s,]+)[ \t]+(\d+)')
+_LINK_STATS_RE = re.compile(
+    r'^[ \t]*([^=\n]*?)[ \t]*=[ \t]*([^=\n]*?)[ \t]*(?:=[^\n]*)?$', re.M
+)
+_LINK_KEY_RE = re.compile(r'pFS_LCn|\(link\)')
+_LINKMAP_RE = re.compile(
+    r'^Link[ \t]+(\d+):?[ \t]+\S+[ \t]+(\d+)', re.M
+)
+_ROUTING_TABLE_RE = re.compile(
+    r'^Node[ \t]+(\d+):?[ \t]+\S+[ \t]+\S+[ \t]+(\d+(?:\.\d+)*)', re.M
+)
+_DEPTH_CHART_RE = re.compile(
+    r'^Node[ \t]+(\d+):?(?:[ \t]+\S+){2}[ \t]+(\d+)(?:[ \t]+\S+){3}'
+    r'[ \t]+(\d+):?(?:[ \t]+\S+){3}[ \t]*([^\n]*)$', re.M
+)
+_DEPTH_PAIR_RE = re.compile(r'(\d+)/(\d+)')
+
+
+def parse_ipinfo(contents, allow_errors=False):
+    """Parse the output of fabric_config_get_ip_info.
+
+    >>> parse_ipinfo('Node 0: 10.20.1.9\\nNode 1: 10.20.2.131\\n')
+    {0: '10.20.1.9', 1: '10.20.2.131'}
+
+    :param contents: The ipinfo file contents.
+    :type contents: string
+    :param allow_errors: Skip invalid IP addresses instead of failing.
+    :type allow_errors: boolean
+
+    :return: A map of node_ids->ip_addresses. Node IDs that aren't integers
+             (physical node IDs, such as "0.0") are left as strings.
+    :rtype: dictionary
+
+    :raises ParseError: If a line or IP address can't be parsed.
+
+    """
+    results = {}
+    for node_id, ip_address, garbage in _IPINFO_RE.findall(contents):
+        if garbage:
+            raise ParseError("Failed to parse ipinfo\n%s" % contents)
+
+        try:
+            socket.inet_aton(ip_address)  # IP validity check
+            valid = ip_address != "0.0.0.0"
+        except socket.error:
+            valid = False
+        if not valid:
+            if allow_errors:
+                continue
+            raise ParseError(
+                "Invalid IP address %s\n%s" % (ip_address, contents)
+            )
+
+        if node_id.isdigit():
+            node_id = int(node_id)
+        results[node_id] = ip_address
+
+    return results
+
+
+def parse_macaddrs(contents):
+    """Parse the output of fabric_config_get_mac_addresses.
+
+    >>> parse_macaddrs('Node 0, Port 0: fc:2f:40:ab:cd:cc\\n' +
+    ...                'Node 0, Port 1: fc:2f:40:ab:cd:cd\\n')
+    {0: {0: ['fc:2f:40:ab:cd:cc'], 1: ['fc:2f:40:ab:cd:cd']}}
+
+    :param contents: The macaddrs file contents.
+    :type contents: string
+
+    :return: A map of node_ids->ports->mac_addresses.
+    :rtype: dictionary
+
+    :raises ParseError: If a line or MAC address can't be parsed.
+
+    """
+    results = {}
+    for node_id, port, mac_address, garbage in \
+            _MACADDRS_RE.findall(contents):
+        if garbage:
+            raise ParseError("Failed to parse macaddrs\n%s" % contents)
+
+        ports = results.get(node_id)
+        if ports is None:
+            ports = results[node_id] = {}
+        macs = ports.get(port)
+        if macs is None:
+            macs = ports[port] = []
+        macs.append(mac_address)
+
+    return dict(
+        (int(node_id), dict((int(port), macs)
+                            for port, macs in ports.iteritems()))
+        for node_id, ports in results.iteritems()
+    )
+
+
+def parse_uplink_info(contents):
+    """Parse the output of fabric_config_get_uplink_info.
+
+    >>> parse_uplink_info('Node 12: eth0 0, eth1 0, mgmt 1\\n')
+    {12: {'eth0': 0, 'eth1': 0, 'mgmt': 1}}
+
+    :param contents: The uplink info file contents.
+    :type contents: string
+
+    :return: A map of {node_id : {interface : uplink}}
+    :rtype: dictionary
+
+    :raises ParseError: If a line can't be parsed.
+
+    """
+    results = {}
+    for node_id, uplinks, garbage in _UPLINK_INFO_RE.findall(contents):
+        if garbage:
+            raise ParseError("Failed to parse uplink info\n%s" % contents)
+        results[int(node_id)] = dict(
+            (iface, int(uplink))
+            for iface, uplink in _UPLINK_PAIR_RE.findall(uplinks)
+        )
+    return results
+
+
+def parse_link_stats(contents, link=0):
+    """Parse the output of fabric_get_linkstats.
+
+    >>> parse_link_stats('pFS_LCn_CFG_1 = 0x105f\\npFS_LCn_STATE = 0x1033\\n',
+    ...                  link=2)
+    {'FS_LC2_CFG_1': '0x105f', 'FS_LC2_STATE': '0x1033'}
+
+    :param contents: The linkstats file contents.
+    :type contents: string
+    :param link: The link the stats are for.
+    :type link: integer
+
+    :return: A map of register names->values.
+    :rtype: dictionary
+
+    """
+    name = 'FS_LC%s' % link
+    rename = lambda match: name if match.group(0) == 'pFS_LCn' else ''
+    return dict(
+        (_LINK_KEY_RE.sub(rename, key).strip(), value)
+        for key, value in _LINK_STATS_RE.findall(contents)
+    )
+
+
+def parse_linkmap(contents):
+    """Parse the output of fabric_info_get_link_map.
+
+    >>> parse_linkmap('Link 1: Node 2\\nLink 3: Node 1\\nLink 4: Node 3\\n')
+    {1: 2, 3: 1, 4: 3}
+
+    :param contents: The link map file contents.
+    :type contents: string
+
+    :return: A map of link_id->node_id.
+    :rtype: dictionary
+
+    """
+    return dict(
+        (int(link_id), int(node_id))
+        for link_id, node_id in _LINKMAP_RE.findall(contents)
+    )
+
+
+def parse_routing_table(contents):
+    """Parse the output of fabric_info_get_routing_table.
+
+    >>> parse_routing_table('Node 1: rt - 0.2.0.3.2\\n')
+    {1: [0, 2, 0, 3, 2]}
+
+    :param contents: The routing table file contents.
+    :type contents: string
+
+    :return: A map of node_id->rt_entries.
+    :rtype: dictionary
+
+    """
+    return dict(
+        (int(node_id), [int(x) for x in entries.split('.')])
+        for node_id, entries in _ROUTING_TABLE_RE.findall(contents)
+    )
+
+
+def parse_depth_chart(contents):
+    """Parse the output of fabric_info_get_depth_chart.
+
+    >>> parse_depth_chart('Node 2: Shortest Distance 0 hops via ' +
+    ...     'neighbor 0: other hops/neighbors - 1/3, 2/5\\n')
+    {2: {'others': [(3, 1), (5, 2)], 'shortest': (0, 0)}}
+
+    :param contents: The depth chart file contents.
+    :type contents: string
+
+    :return: A map of target->(neighbor, hops), [other (neighbors,hops)]
+    :rtype: dictionary
+
+    """
+    results = {}
+    for target, hops, neighbor, others in _DEPTH_CHART_RE.findall(contents):
+        entries = {'shortest': (int(neighbor), int(hops))}
+        other_hops = _DEPTH_PAIR_RE.findall(others)
+        if other_hops:
+            entries['others'] = [(int(x[1]), int(x[0])) for x in other_hops]
+        results[int(target)] = entries
+    return results
+
+
+# End of file: ./fabric_parsers.py
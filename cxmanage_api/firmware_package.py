@@ -33,13 +33,17 @@
 
 
 import os
+import hashlib
 import tarfile
 import ConfigParser
 import pkg_resources
+from StringIO import StringIO
+from threading import Lock
 
 import cxmanage_api
 from cxmanage_api import temp_dir
 from cxmanage_api.image import Image
+from cxmanage_api.cx_exceptions import InvalidImageError
 
 
 # pylint: disable=R0903
@@ -48,6 +52,10 @@ class FirmwarePackage(object):
 
     .. note::
         * Valid firmware packages are in tar.gz format.
+        * Packages are cached by the tarball's SHA-1, so opening the same
+          package again is cheap. Only the MANIFEST is read up front; each
+          image is extracted and validated the first time its file is used.
+          Each package gets its own image objects.
 
     >>> from cxmanage_api.firmware_package import FirmwarePackage
     >>> fwpkg = FirmwarePackage('/path/to/ECX-1000_update-v1.7.1-dirty.tar.gz')
@@ -59,27 +67,23 @@ class FirmwarePackage(object):
 
     """
 
-    # pylint: disable=R0912
+    # Extracted packages, by SHA-1, and SHA-1s by (path, size, mtime).
+    _cache = {}
+    _hashes = {}
+    _cache_lock = Lock()
+
     def __init__(self, filename=None):
         """Default constructor for the FirmwarePackage class."""
-        self.images = []
         self.version = None
         self.config = None
         self.required_socman_version = None
-        self.work_dir = temp_dir()
+        self._images = []
+        self._contents = None
 
         if filename:
-            # Extract files and read config
-            try:
-                tarfile.open(filename, "r").extractall(self.work_dir)
-            except (IOError, tarfile.ReadError):
-                raise ValueError("%s is not a valid tar.gz file"
-                        % os.path.basename(filename))
-            config = ConfigParser.SafeConfigParser()
-
-            if len(config.read(self.work_dir + "/MANIFEST")) == 0:
-                raise ValueError("%s is not a valid firmware package"
-                        % os.path.basename(filename))
+            self._contents = FirmwarePackage._get_contents(filename)
+            self.work_dir = self._contents.work_dir
+            config = self._contents.config
 
             if "package" in config.sections():
                 required_cxmanage_version = config.get(
@@ -101,28 +105,58 @@ class FirmwarePackage(object):
                 if config.has_option("package", "firmware_config"):
                     self.config = config.get("package", "firmware_config")
 
-            # Add all images from package
-            image_sections = [x for x in config.sections() if x != "package"]
-            for section in image_sections:
-                filename = "%s/%s" % (self.work_dir, section)
-                image_type = config.get(section, "type").upper()
-                simg = None
-                daddr = None
-                skip_crc32 = False
-                version = None
-
-                # Read image options from config
-                if config.has_option(section, "simg"):
-                    simg = config.getboolean(section, "simg")
-                if config.has_option(section, "daddr"):
-                    daddr = int(config.get(section, "daddr"), 16)
-                if config.has_option(section, "skip_crc32"):
-                    skip_crc32 = config.getboolean(section, "skip_crc32")
-                if config.has_option(section, "versionstr"):
-                    version = config.get(section, "versionstr")
-
-                self.images.append(Image(filename, image_type, simg, daddr,
-                        skip_crc32, version))
+            self._images = [_PackageImage(self._contents, x)
+                    for x in self._contents.get_sections()]
+        else:
+            self.work_dir = temp_dir()
+
+    @property
+    def images(self):
+        """Images in this package.
+
+        :returns: The package's images.
+        :rtype: list
+
+        """
+        return self._images
+
+    @images.setter
+    def images(self, images):
+        """Replace the images in this package."""
+        self._images = images
+
+    @staticmethod
+    def clear_cache():
+        """Forget every cached package."""
+        with FirmwarePackage._cache_lock:
+            FirmwarePackage._cache.clear()
+            FirmwarePackage._hashes.clear()
+
+    @staticmethod
+    def _get_contents(filename):
+        """Get the cached contents of a package file, reading its MANIFEST
+        if it hasn't been seen before.
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            raise ValueError("%s is not a valid tar.gz file"
+                    % os.path.basename(filename))
+        stat_key = (os.path.realpath(filename), stat.st_size, stat.st_mtime)
+
+        with FirmwarePackage._cache_lock:
+            sha1 = FirmwarePackage._hashes.get(stat_key)
+        if (sha1 == None):
+            sha1 = _get_sha1(filename)
+
+        with FirmwarePackage._cache_lock:
+            contents = FirmwarePackage._cache.get(sha1)
+        if (contents == None):
+            contents = _PackageContents(filename)
+
+        with FirmwarePackage._cache_lock:
+            FirmwarePackage._hashes[stat_key] = sha1
+            return FirmwarePackage._cache.setdefault(sha1, contents)
 
     def __str__(self):
         return self.version
@@ -148,8 +182,9 @@ class FirmwarePackage(object):
             config.add_section(section)
             config.set(section, "type", image.type)
             config.set(section, "simg", str(image.simg))
-            if image.priority != None:
-                config.set(section, "priority", str(image.priority))
+            priority = getattr(image, "priority", None)
+            if priority != None:
+                config.set(section, "priority", str(priority))
             if image.daddr != None:
                 config.set(section, "daddr", "%x" % image.daddr)
             if image.skip_crc32:
@@ -157,7 +192,10 @@ class FirmwarePackage(object):
             if image.version != None:
                 config.set(section, "versionstr", image.version)
 
-        manifest = open("%s/MANIFEST" % self.work_dir, "w")
+        # The work dir may be shared with other packages, so don't put the
+        # manifest there.
+        manifest_filename = "%s/MANIFEST" % temp_dir()
+        manifest = open(manifest_filename, "w")
         config.write(manifest)
         manifest.close()
 
@@ -169,10 +207,185 @@ class FirmwarePackage(object):
         else:
             tar = tarfile.open(filename, "w")
 
-        tar.add("%s/MANIFEST" % self.work_dir, "MANIFEST")
+        tar.add(manifest_filename, "MANIFEST")
         for image in self.images:
             tar.add(image.filename, os.path.basename(image.filename))
         tar.close()
 
 
+class _PackageContents(object):
+    """The MANIFEST and images of a package file, shared by every
+    FirmwarePackage opened from the same file contents.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.work_dir = temp_dir()
+        self.config = ConfigParser.SafeConfigParser()
+
+        self._images = {}
+        self._errors = {}
+        self._lock = Lock()
+
+        # Read the MANIFEST without extracting anything else
+        try:
+            tar = tarfile.open(filename, "r")
+            try:
+                manifest = None
+                for member in tar:
+                    if (member.name == "MANIFEST" and member.isfile()):
+                        manifest = tar.extractfile(member).read()
+                        break
+            finally:
+                tar.close()
+        except (IOError, tarfile.TarError):
+            raise ValueError("%s is not a valid tar.gz file"
+                    % os.path.basename(filename))
+
+        try:
+            if (manifest == None):
+                raise ConfigParser.Error()
+            self.config.readfp(StringIO(manifest))
+        except ConfigParser.Error:
+            raise ValueError("%s is not a valid firmware package"
+                    % os.path.basename(filename))
+
+    def get_sections(self):
+        """Get the MANIFEST sections that name images.
+
+        :returns: The image sections, in MANIFEST order.
+        :rtype: list
+
+        """
+        return [x for x in self.config.sections() if x != "package"]
+
+    def get_options(self, section):
+        """Read an image's options from the MANIFEST.
+
+        :returns: The Image type, simg, daddr, skip_crc32 and version.
+        :rtype: tuple
+
+        :raises ValueError: If an option is invalid.
+
+        """
+        config = self.config
+        image_type = config.get(section, "type").upper()
+        simg = None
+        daddr = None
+        skip_crc32 = False
+        version = None
+
+        if config.has_option(section, "simg"):
+            simg = config.getboolean(section, "simg")
+        if config.has_option(section, "daddr"):
+            daddr = int(config.get(section, "daddr"), 16)
+        if config.has_option(section, "skip_crc32"):
+            skip_crc32 = config.getboolean(section, "skip_crc32")
+        if config.has_option(section, "versionstr"):
+            version = config.get(section, "versionstr")
+        return image_type, simg, daddr, skip_crc32, version
+
+    def get_image(self, section):
+        """Extract, read and validate one image, the first time only. An
+        invalid image is remembered and reported again on later calls, but
+        other errors, like a full disk, are not.
+
+        :returns: The image for this MANIFEST section.
+        :rtype: Image
+
+        :raises InvalidImageError: If the image is invalid.
+        :raises ValueError: If the image is missing from the package.
+
+        """
+        with self._lock:
+            if (section in self._errors):
+                raise self._errors[section]
+            if (not section in self._images):
+                try:
+                    self._images[section] = self._read_image(section)
+                except (InvalidImageError, ValueError) as err:
+                    self._errors[section] = err
+                    raise
+            return self._images[section]
+
+    def _read_image(self, section):
+        """Extract a single image from the tarball, then read it."""
+        tar = tarfile.open(self.filename, "r")
+        try:
+            for member in tar:
+                if (os.path.normpath(member.name) == section):
+                    tar.extract(member, self.work_dir)
+                    break
+        finally:
+            tar.close()
+
+        filename = "%s/%s" % (self.work_dir, section)
+        return Image(filename, *self.get_options(section))
+
+
+class _PackageImage(Image):
+    """An image in a package file. The options come from the MANIFEST, and
+    the file is extracted and validated the first time it's used.
+    """
+
+    # pylint: disable=W0231
+    def __init__(self, contents, section):
+        self._contents = contents
+        self._section = section
+        self._filename = None
+        self._simg = None
+        self._sha1 = None
+        (self.type, simg, self.daddr, self.skip_crc32,
+                self.version) = contents.get_options(section)
+
+    def __str__(self):
+        return "Image %s (%s)" % (self._section, self.type)
+
+    def get_sha1(self):
+        """Get the SHA-1 hash of the image file's contents. Packages with
+        the same contents share the hash of the extracted file.
+
+        :returns: Hex digest of the image file.
+        :rtype: string
+
+        """
+        image = self._contents.get_image(self._section)
+        if (self.filename == image.filename):
+            return image.get_sha1()
+        return Image.get_sha1(self)
+
+    @property
+    def filename(self):
+        """Path to the extracted image."""
+        if (self._filename == None):
+            self._filename = self._contents.get_image(self._section).filename
+        return self._filename
+
+    @filename.setter
+    def filename(self, filename):
+        """Point this image at another file."""
+        self._filename = filename
+
+    @property
+    def simg(self):
+        """Whether the image file is already a SIMG."""
+        if (self._simg == None):
+            self._simg = self._contents.get_image(self._section).simg
+        return self._simg
+
+    @simg.setter
+    def simg(self, simg):
+        """Set whether the image file is already a SIMG."""
+        self._simg = simg
+
+
+def _get_sha1(filename):
+    """Get the SHA-1 hash of a file, reading it in chunks."""
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as file_:
+        for chunk in iter(lambda: file_.read(1024 * 1024), ""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
 # End of file: ./firmware_package.py
@@ -33,11 +33,15 @@
 
 
 import os
+import hashlib
 import subprocess
+from threading import Lock
 
 from cxmanage_api import temp_file
-from cxmanage_api.simg import create_simg, has_simg
-from cxmanage_api.simg import valid_simg, get_simg_contents
+from cxmanage_api.simg import create_simg_file, has_simg_file
+from cxmanage_api.simg import valid_simg_file, read_simg_contents
+from cxmanage_api.simg import get_simg_size, get_simg_crc32
+from cxmanage_api.simg import read_simg_header, SIMGHeader, ALIGNED_OFFSET
 from cxmanage_api.cx_exceptions import InvalidImageError
 
 
@@ -65,6 +69,12 @@ class Image(object):
 
     """
 
+    # Rendered SIMG files, shared by every Image in the process. Keyed by
+    # content hash and SIMG header parameters.
+    _render_cache = {}
+    _render_locks = {}
+    _render_cache_lock = Lock()
+
     # pylint: disable=R0913
     def __init__(self, filename, image_type, simg=None, daddr=None,
                   skip_crc32=False, version=None):
@@ -74,13 +84,13 @@ class Image(object):
         self.daddr = daddr
         self.skip_crc32 = skip_crc32
         self.version = version
+        self._sha1 = None
 
         if (not os.path.exists(filename)):
             raise ValueError("File %s does not exist" % filename)
 
         if (simg == None):
-            contents = open(filename).read()
-            self.simg = has_simg(contents)
+            self.simg = has_simg_file(filename)
         else:
             self.simg = simg
 
@@ -107,30 +117,116 @@ class Image(object):
 
         :raises InvalidImageError: If the SIMG image is not valid.
 
+        .. note::
+            * Rendered SIMGs are cached, so images with the same contents and
+              header parameters are only built and validated once. Treat the
+              returned file as read-only.
+
         """
+        if (self.simg):
+            key = (self.get_sha1(),)
+        else:
+            if (self.daddr != None):
+                daddr = self.daddr
+            align = (self.type in ["CDB", "BOOT_LOG"])
+            key = (self.get_sha1(), priority, daddr, self.skip_crc32, align,
+                   self.version)
+
+        with Image._render_cache_lock:
+            lock = Image._render_locks.setdefault(key, Lock())
+
+        with lock:
+            filename = Image._render_cache.get(key)
+            if (filename == None or not os.path.exists(filename)):
+                filename = self._render_to_simg(priority, daddr)
+                Image._render_cache[key] = filename
+            return filename
+
+    @staticmethod
+    def clear_render_cache():
+        """Forget all SIMGs cached by render_to_simg(), for every image."""
+        with Image._render_cache_lock:
+            Image._render_cache.clear()
+            Image._render_locks.clear()
+
+    def get_sha1(self):
+        """Get the SHA-1 hash of the image file's contents.
+
+        >>> img.get_sha1()
+        'b3c1a2b8b0a4ec6d3c3d7aa3a6f46c7a1a1e2c4f'
+
+        :returns: Hex digest of the image file.
+        :rtype: string
+
+        """
+        if (self._sha1 == None):
+            sha1 = hashlib.sha1()
+            with open(self.filename, "rb") as file_:
+                for chunk in iter(lambda: file_.read(1024 * 1024), ""):
+                    sha1.update(chunk)
+            self._sha1 = sha1.hexdigest()
+        return self._sha1
+
+    def _render_to_simg(self, priority, daddr):
+        """Create and validate a SIMG file, bypassing the render cache."""
         filename = self.filename
         # Create new image if necessary
         if (not self.simg):
-            contents = open(filename).read()
-            # Figure out daddr
-            if (self.daddr != None):
-                daddr = self.daddr
-            # Create simg
             align = (self.type in ["CDB", "BOOT_LOG"])
-            simg = create_simg(contents, priority=priority, daddr=daddr,
-                    skip_crc32=self.skip_crc32, align=align,
-                    version=self.version)
             filename = temp_file()
-            with open(filename, "w") as file_:
-                file_.write(simg)
+            create_simg_file(self.filename, filename, priority=priority,
+                    daddr=daddr, skip_crc32=self.skip_crc32, align=align,
+                    version=self.version)
 
         # Make sure the simg was built correctly
-        if (not valid_simg(open(filename).read())):
+        if (not valid_simg_file(filename)):
             raise InvalidImageError("%s is not a valid SIMG" %
                     os.path.basename(self.filename))
 
         return filename
 
+    def get_version(self):
+        """Get the version string that this image's SIMG header carries.
+
+        >>> img.get_version()
+        'v1.7.1'
+
+        :returns: The SIMG version string, or '' if there isn't one.
+        :rtype: string
+
+        """
+        if (self.simg):
+            return read_simg_header(self.filename).version.rstrip(chr(0))
+        return self.version or ''
+
+    def get_crc32(self, priority, daddr):
+        """Get the crc32 that render_to_simg() would give this image, without
+        rendering it. The crc32 is computed even if skip_crc32 is set.
+
+        >>> img.get_crc32(priority=1, daddr=0)
+        2451372925
+
+        :param priority: SIMG header priority value.
+        :type priority: integer
+        :param daddr: SIMG daddr field value.
+        :type daddr: integer
+
+        :returns: The crc32 of the rendered SIMG.
+        :rtype: integer
+
+        """
+        if (self.simg):
+            header = read_simg_header(self.filename)
+            return get_simg_crc32(header, self.filename)
+
+        header = SIMGHeader()
+        header.priority = priority
+        header.imglen = os.path.getsize(self.filename)
+        header.daddr = daddr if self.daddr == None else self.daddr
+        if (self.type in ["CDB", "BOOT_LOG"]):
+            header.imgoff = ALIGNED_OFFSET
+        return get_simg_crc32(header, self.filename, 0)
+
     def size(self):
         """Return the full size of this image (as an SIMG)
 
@@ -144,10 +240,8 @@ class Image(object):
         if (self.simg):
             return os.path.getsize(self.filename)
         else:
-            contents = open(self.filename).read()
             align = (self.type in ["CDB", "BOOT_LOG"])
-            simg = create_simg(contents, skip_crc32=True, align=align)
-            return len(simg)
+            return get_simg_size(os.path.getsize(self.filename), align)
 
     def verify(self):
         """Returns true if the image is valid, false otherwise.
@@ -174,10 +268,12 @@ class Image(object):
 
         if (self.type in ["CDB", "BOOT_LOG"]):
             # Look for "CDBH"
-            contents = open(self.filename).read()
             if (self.simg):
-                contents = get_simg_contents(contents)
-            if (contents[:4] != "CDBH"):
+                contents = read_simg_contents(self.filename, 4)
+            else:
+                with open(self.filename, "rb") as file_:
+                    contents = file_.read(4)
+            if (contents != "CDBH"):
                 return False
         return True
 
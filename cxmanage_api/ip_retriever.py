@@ -37,7 +37,7 @@ import re
 import json
 
 import threading
-from time import sleep
+from time import sleep, time
 
 from cxmanage_api.cx_exceptions import IPDiscoveryError
 
@@ -47,6 +47,12 @@ from pyipmi.server import Server
 from pyipmi.bmc import LanBMC
 
 
+# Most SOL payloads that we'll have active on one chassis at a time
+MAX_SOL_SESSIONS = 16
+
+_MAC_PATTERN = re.compile('HWaddr ((?:[0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2})')
+
+
 # pylint: disable=R0902
 class IPRetriever(threading.Thread):
     """The IPRetriever class takes an ECME address and when run will
@@ -58,12 +64,14 @@ class IPRetriever(threading.Thread):
     retry = None
     timeout = None
     interface = None
+    poll_interval = 0.5
 
     ecme_ip = None
     ecme_user = None
     ecme_password = None
 
     server_ip = None
+    server_mac = None
     server_user = None
     server_password = None
 
@@ -117,7 +125,7 @@ class IPRetriever(threading.Thread):
     def set_interface(self, interface=None, ipv6=False):
         """Sets the interface and IP Version that is looked for on the server.
            The interface must be acceptable by ifconfig. By default the first
-           interface given by ifconfig will be used.
+           interface given by ifconfig that has an address will be used.
         """
         self.interface = interface
 
@@ -168,16 +176,33 @@ class IPRetriever(threading.Thread):
         if cycle:
             self._log('Powering server off')
             server.power_off()
-            sleep(5)
+            if not self._wait_for_power(server, False):
+                self._log('Timed out waiting for the server to power off')
+                return False
 
         if not server.is_powered:
             self._log('Powering server on')
             server.power_on()
-            sleep(10)
+            if not self._wait_for_power(server, True):
+                self._log('Timed out waiting for the server to power on')
+                return False
 
         return server.is_powered
 
 
+    def _wait_for_power(self, server, state):
+        """Polls the power state until it matches the given state, instead
+           of sleeping for however long it usually takes. Returns True if it
+           got there before the timeout.
+        """
+        deadline = time() + self.timeout
+        while server.is_powered != state:
+            if time() >= deadline:
+                return False
+            sleep(self.poll_interval)
+        return True
+
+
     def sol_find_ip(self, session):
         """Uses ifconfig to get the IP address in an SOL session.
            Returns the ip address if it is found or None on failure.
@@ -190,25 +215,45 @@ class IPRetriever(threading.Thread):
         index = session.expect(['Link encap', 'error fetching interface',
                                TIMEOUT, EOF], timeout=2)
 
-        # ifconfig found the interface
-        if index == 0:
-            output = ''.join(session.readline() for line in range(3))
-            found_ip = self._inet_pattern.findall(output)
-
-            if found_ip:
-                return found_ip[0]
-            else:
-                self._bmc.deactivate_payload()
-                raise IPDiscoveryError('Interface %s does not have '
-                                   'given address' % self.interface)
-        elif index == 1:
+        if index == 1:
             self._bmc.deactivate_payload()
             raise IPDiscoveryError('Could not find interface %s'
                     % self.interface)
 
-        else:  # Failed to find interface. Returning None
+        elif index != 0:  # Failed to find interface. Returning None
             return None
 
+        # ifconfig found an interface. Each one's block starts at its
+        # 'Link encap' line, so take the address and MAC from the same
+        # block. Without a given interface, move on to the next block.
+        output = ''
+        while index == 0:
+            output += ''.join(session.readline() for line in range(3))
+            blocks = output.split('Link encap')
+            for block in blocks:
+                found_ip = self._inet_pattern.findall(block)
+                if found_ip:
+                    found_mac = _MAC_PATTERN.findall(block)
+                    if found_mac:
+                        self.server_mac = found_mac[0].lower()
+                    else:
+                        self.server_mac = None
+                    return found_ip[0]
+
+            if self.interface:
+                break
+            if len(blocks) > 1:
+                # We've read into the next block, so read the rest of it
+                output = blocks[-1]
+            else:
+                output = ''
+                index = session.expect(['Link encap', TIMEOUT, EOF],
+                                       timeout=2)
+
+        self._bmc.deactivate_payload()
+        raise IPDiscoveryError('Interface %s does not have '
+                               'given address' % self.interface)
+
 
     # pylint: disable=R0912, R0915
     def sol_try_command(self, command):
@@ -223,9 +268,10 @@ class IPRetriever(threading.Thread):
             self._log("Server is powered off. Can't proceed.")
             raise IPDiscoveryError("Server is powered off. Can't proceed.")
 
+        # No need to sleep after activating: the expect below waits for
+        # 'SOL Session operational' or whatever the console prints first.
         self._log('Activating SOL')
         session = self._bmc.activate_payload()
-        sleep(2)
 
         timeout = self.timeout
         attempt = 0
@@ -293,9 +339,10 @@ class IPRetriever(threading.Thread):
             elif index == 9:
                 self._log('Restarting SOL session')
                 self._bmc.deactivate_payload()
+                # Give the BMC a moment to tear down the old session, or
+                # activating may just find it still active.
                 sleep(2)
                 session = self._bmc.activate_payload()
-                sleep(2)
                 session.sendline()
                 timeout = 8
 
@@ -322,7 +369,6 @@ class IPRetriever(threading.Thread):
                     timeout = 2
 
                 elif not self.aggressive:
-                    sleep(2)
                     self._bmc.deactivate_payload()
                     raise IPDiscoveryError('Unable to obtain the server\'s '
                                            'IP address unintrusively')
@@ -347,13 +393,15 @@ class IPRetriever(threading.Thread):
                 elif attempt == 4:
                     self._log('Attempting reboot')
                     session.sendline('sudo reboot')
-                    sleep(1)
                     timeout = 4
                     login_attempted = False
 
                 # If all else fails: power cycle the server
                 elif attempt == 5:
-                    self._power_server(cycle=True)
+                    if not self._power_server(cycle=True):
+                        self._bmc.deactivate_payload()
+                        raise IPDiscoveryError('Unable to power cycle the '
+                                               'server')
                     timeout = self.timeout
                     login_attempted = False
 
@@ -35,9 +35,11 @@
 import os
 import re
 import time
+import random
 import tempfile
-import socket
 import subprocess
+from contextlib import closing
+from threading import Lock
 
 from pkg_resources import parse_version
 from pyipmi import make_bmc, IpmiError
@@ -45,11 +47,15 @@ from pyipmi.bmc import LanBMC as BMC
 from tftpy.TftpShared import TftpException
 
 from cxmanage_api import loggers
+from cxmanage_api import fabric_parsers
 from cxmanage_api import temp_file
-from cxmanage_api.tftp import InternalTftp, ExternalTftp
+from cxmanage_api.tftp import InternalTftp, InternalTftpPool, ExternalTftp
 from cxmanage_api.image import Image as IMAGE
 from cxmanage_api.ubootenv import UbootEnv as UBOOTENV
 from cxmanage_api.ip_retriever import IPRetriever as IPRETRIEVER
+from cxmanage_api.sel_log import SELLog
+from cxmanage_api.address_map import find_server_ip
+from cxmanage_api.tasks import TaskQueue
 from cxmanage_api.decorators import retry
 from cxmanage_api.credentials import Credentials
 from cxmanage_api.cx_exceptions import TimeoutError, NoSensorError, \
@@ -59,6 +65,55 @@ from cxmanage_api.cx_exceptions import TimeoutError, NoSensorError, \
         NodeMismatchError
 
 
+# How ipmitool starts the messages it prints when a command fails. Other
+# stderr output, such as warnings, doesn't mean the command failed.
+_IPMITOOL_ERROR_RE = re.compile(
+    r'^\s*(?:Error|Invalid|Unable to|Unknown|Failed|Could not|Not enough|'
+    r'Insufficient)\b', re.I | re.M
+)
+
+
+def _quote_ipmitool_arg(arg):
+    """Quote an argument for an ipmitool exec batch file, if needed.
+
+    :raises ValueError: If the argument can't be written in a batch file.
+
+    """
+    arg = str(arg)
+    if any(x in "\"\r\n" for x in arg):
+        raise ValueError("Can't pass %r to ipmitool in batch mode" % arg)
+    if not arg or any(x.isspace() or x in "'#" for x in arg):
+        return '"%s"' % arg
+    return arg
+
+
+def _split_batch_output(output, count):
+    """Split the output of an ipmitool_batch() run at the marker output.
+
+    The output starts with two copies of the marker output, and has one more
+    after each command, so we can find out what the marker output is without
+    depending on the exact text ipmitool prints.
+
+    :returns: The output of each command, or None if it can't be split.
+    :rtype: list
+
+    """
+    lines = output.splitlines(True)
+    for length in range(1, len(lines) / 2 + 1):
+        marker = "".join(lines[:length])
+        if output.startswith(marker * 2):
+            parts = output[len(marker) * 2:].split(marker)
+            if len(parts) == count + 1 and parts[-1] == "":
+                return parts[:-1]
+    return None
+
+
+# Largest uncached read_fru() that is done as a ranged read, and the number
+# of bytes to ask for in each Read FRU Data command.
+FRU_RANGE_MAX = 256
+FRU_RANGE_CHUNK = 32
+
+
 # pylint: disable=R0902, R0904
 class Node(object):
     """A node is a single instance of an ECME.
@@ -83,6 +138,9 @@ class Node(object):
     :type ubootenv: `UbootEnv <ubootenv.html>`_
 
     """
+    _fru_cache = {}
+    _fru_cache_lock = Lock()
+
     # pylint: disable=R0913
     def __init__(self, ip_address, credentials=None, tftp=None,
                  ecme_tftp_port=5001, verbose=False, bmc=None, image=None,
@@ -117,6 +175,9 @@ class Node(object):
 
         self._node_id = None
         self._guid = None
+        self._fru_ranged_reads = True
+        self._mc_reset_time = None
+        self.last_reset_duration = None
 
     def __eq__(self, other):
         return isinstance(other, Node) and self.ip_address == other.ip_address
@@ -127,6 +188,30 @@ class Node(object):
     def __str__(self):
         return 'Node %s (%s)' % (self.node_id, self.ip_address)
 
+    @property
+    def tftp(self):
+        """Returns the tftp server that this node is using.
+
+        >>> node.tftp
+        <cxmanage_api.tftp.InternalTftp(Thread-1, started daemon 140109)>
+
+        .. note::
+            * Setting this to an InternalTftpPool assigns this node one of
+              the pool's servers.
+
+        :returns: The tftp server.
+        :rtype: `Tftp <tftp.html>`_
+
+        """
+        return self._tftp
+
+    @tftp.setter
+    def tftp(self, value):
+        """ Set the tftp server, or get one from a pool """
+        if (isinstance(value, InternalTftpPool)):
+            value = value.assign(self.ip_address)
+        self._tftp = value
+
     @property
     def tftp_address(self):
         """Returns the tftp_address (ip:port) that this node is using.
@@ -325,34 +410,105 @@ communication.
         """Sends a Master Control reset command to the node.
 
         >>> node.mc_reset()
+        >>> node.mc_reset(wait=True)
+        23.702
 
         :param wait: Wait for the node to come back up.
         :type wait: boolean
 
-        :raises Exception: If the BMC command contains errors.
+        :returns: If waiting, the number of seconds the reset took.
+        :rtype: float
+
+        :raises TimeoutError: If the node doesn't come back up in time.
         :raises IPMIError: If there is an IPMI error communicating with the BMC.
 
         """
+        self._mc_reset_time = time.time()
         self.bmc.mc_reset("cold")
 
         if wait:
-            deadline = time.time() + 300.0
+            return self.wait_for_mc_reset()
 
-            # Wait for it to go down...
-            time.sleep(60)
+    # pylint: disable=R0913
+    def wait_for_mc_reset(self, timeout=300, down_timeout=30, interval=0.5,
+                          max_interval=5, down_probes=3):
+        """Wait for the node to go down after an mc_reset, and come back up.
+
+        The node is probed with get_info_basic until it stops answering
+        down_probes times in a row (so one dropped packet isn't mistaken for
+        the reset), then
+        probed again with exponential backoff (plus jitter, so that a whole
+        fabric doesn't probe in lockstep) until it answers. The time from the
+        reset command until the node answered is stored in
+        last_reset_duration.
 
-            # Now wait to come back up!
-            while time.time() < deadline:
-                time.sleep(1)
-                try:
-                    self.bmc.get_info_basic()
-                    break
-                except IpmiError:
-                    pass
+        >>> node.mc_reset()
+        >>> node.wait_for_mc_reset()
+        23.702
+
+        :param timeout: Seconds after the reset to give up waiting.
+        :type timeout: float
+        :param down_timeout: Seconds after the reset to wait for the node to
+                             go down. If it never stops answering, we assume
+                             the reset already finished.
+        :type down_timeout: float
+        :param interval: Initial number of seconds between probes.
+        :type interval: float
+        :param max_interval: Maximum number of seconds between probes.
+        :type max_interval: float
+        :param down_probes: Failed probes in a row that mean the node is down.
+        :type down_probes: integer
+
+        :returns: The number of seconds the reset took.
+        :rtype: float
+
+        :raises TimeoutError: If the node doesn't come back up in time.
+
+        """
+        # Only count from our own mc_reset if it's the one being waited for
+        start = self._mc_reset_time
+        self._mc_reset_time = None
+        if start is None or time.time() - start > down_timeout:
+            start = time.time()
+        deadline = start + timeout
+
+        # Wait for it to go down...
+        down_deadline = min(start + down_timeout, deadline)
+        failures = 0
+        while time.time() < down_deadline:
+            if self._probe_mc():
+                failures = 0
             else:
-                raise Exception("Reset timed out")
+                failures += 1
+                if failures >= down_probes:
+                    break
+            time.sleep(interval)
+        else:
+            if self._probe_mc():
+                self.last_reset_duration = time.time() - start
+                return self.last_reset_duration
+
+        # Now wait to come back up!
+        delay = interval
+        while time.time() < deadline:
+            time.sleep(min(random.uniform(delay / 2, delay),
+                           max(deadline - time.time(), 0)))
+            if self._probe_mc():
+                self.last_reset_duration = time.time() - start
+                return self.last_reset_duration
+            delay = min(delay * 2, max_interval)
+
+        raise TimeoutError("Reset timed out")
+
+    def _probe_mc(self):
+        """Check whether the management controller is answering."""
+        try:
+            self.bmc.get_info_basic()
+            return True
+        except IpmiError:
+            return False
 
-    def get_sel(self):
+    def get_sel(self, incremental=False):
         """Get the system event log for this node.
 
         >>> node.get_sel()
@@ -370,11 +526,59 @@ Initiated by power up | Asserted',
         >>> # Output trimmed for brevity
         >>> #
 
+        .. note::
+            * With incremental=True, only entries added since the last
+              incremental call are fetched from the node. They are merged
+              into a local log in ~/.cxmanage/sel, and the whole local log
+              is returned.
+
+        :param incremental: Whether to fetch only new entries.
+        :type incremental: boolean
+
         :returns: The node's system event log
-        :rtype: string
+        :rtype: list
         """
+        if incremental:
+            sel_log = SELLog(self.guid)
+            sel_log.update(self)
+            return sel_log.read()
         return self.bmc.sel_elist()
 
+    def get_new_sel_entries(self):
+        """Get the system event log entries added since the last call.
+
+        The entries are also merged into the local log used by
+        get_sel(incremental=True).
+
+        >>> node.get_new_sel_entries()
+        ['4 | 06/27/2013 | 21:14:52 | Watchdog 2 #0xfd | Hard reset | \
+Asserted']
+        >>> node.get_new_sel_entries()
+        []
+
+        :returns: New system event log entries
+        :rtype: list
+        """
+        return SELLog(self.guid).update(self)
+
+    def get_sel_tail(self, count):
+        """Get the last few entries of the system event log.
+
+        >>> node.get_sel_tail(1)
+        ['3 | 06/27/2013 | 21:01:13 | System Event #0xf4 |']
+
+        :param count: Number of entries to get.
+        :type count: integer
+
+        :returns: The last count entries of the system event log
+        :rtype: list
+
+        :raises IpmiError: If the IPMI command fails.
+
+        """
+        output = self.ipmitool_command(["sel", "elist", "last", str(count)])
+        return [x.strip() for x in output.splitlines() if x.strip()]
+
     def get_sensors(self, search=""):
         """Get a list of sensor objects that match search criteria.
 
@@ -655,7 +859,7 @@ communication.
 
     # pylint: disable=R0914, R0912, R0915
     def update_firmware(self, package, partition_arg="INACTIVE",
-                          priority=None):
+                          priority=None, delta=False):
         """ Update firmware on this target.
 
         >>> from cxmanage_api.firmware_package import FirmwarePackage
@@ -668,6 +872,11 @@ communication.
         :type package: `FirmwarePackage <firmware_package.html>`_
         :param partition_arg: Partition to upgrade to.
         :type partition_arg: string
+        :param priority: SIMG header priority to use.
+        :type priority: integer
+        :param delta: Skip images that the target partitions already hold,
+                      comparing the version string and the partition CRC.
+        :type delta: boolean
 
         :raises PriorityIncrementError: If the SIMG Header priority cannot be
                                         changed.
@@ -734,6 +943,7 @@ communication.
         )
 
         updated_partitions = []
+        uploads = []
 
         for image in package.images:
             if image.type == "UBOOTENV" and num_ubootenv_partitions >= 2:
@@ -742,9 +952,14 @@ communication.
                 factory_part = self._get_partition(fwinfo, image.type,
                         "SECOND")
 
+                # The running ubootenv is merged with the node's settings, so
+                # only the factory ubootenv can be compared.
+                if (delta and self._is_image_current(fwinfo, image,
+                        factory_part, logger, use_newest=False)):
+                    continue
+
                 # Update factory ubootenv
-                logger.info("Uploading %s to %s\n" % (image, factory_part))
-                self._upload_image(image, factory_part, priority)
+                uploads.append((image, factory_part))
 
                 # Update running ubootenv
                 logger.info("Downloading partition %s\n" % running_part)
@@ -771,12 +986,9 @@ communication.
                         filename, image.type, False, image.daddr,
                         image.skip_crc32, image.version
                     )
-
-                    logger.info("Uploading %s to %s\n" % (image, running_part))
-                    self._upload_image(ubootenv_image, running_part,
-                            priority)
+                    uploads.append((ubootenv_image, running_part))
                 except (ValueError, UbootenvError):
-                    self._upload_image(image, running_part, priority)
+                    uploads.append((image, running_part))
 
                 updated_partitions += [running_part, factory_part]
             else:
@@ -789,14 +1001,22 @@ communication.
                     partitions = [self._get_partition(fwinfo, image.type,
                             partition_arg)]
 
-                # Update the image
-                for partition in partitions:
-                    logger.info("Uploading %s to %s\n" % (image, partition))
-                    self._upload_image(image, partition, priority)
+                if (delta):
+                    use_newest = (partition_arg != "BOTH")
+                    partitions = [x for x in partitions if not
+                            self._is_image_current(fwinfo, image, x, logger,
+                                                   use_newest)]
 
+                uploads += [(image, x) for x in partitions]
                 updated_partitions += partitions
 
-            logger.info("Done uploading %s\n" % image)
+        # Upload the images. The next SIMG is rendered while the current one
+        # is transferred and checked.
+        with closing(self._render_images(uploads, priority)) as renders:
+            for image, partition, filename in renders:
+                logger.info("Uploading %s to %s\n" % (image, partition))
+                self._transfer_image(filename, partition, image.type)
+                logger.info("Done uploading %s\n" % image)
 
         if package.version:
             self.bmc.set_firmware_version(package.version)
@@ -1138,6 +1358,79 @@ communication.
 
         :raises IpmiError: If the IPMI command fails.
 
+        """
+        stdout, stderr, status = self._run_ipmitool(ipmitool_args)
+        if(status != 0):
+            raise IpmiError(stderr.strip())
+        return (stdout + stderr).strip()
+
+    def ipmitool_batch(self, commands, options=None):
+        """Run several raw ipmitool commands on the node in one ipmitool
+        process, using ipmitool's exec batch mode.
+
+        >>> node.ipmitool_batch([['cxoem', 'info', 'basic'],
+        ...                      ['raw', '0x06', '0x01']])
+        [('Calxeda SoC (0x0096CD)\n  Firmware Version: ECX-1000-v1.7.1\n...',
+          '', 0),
+         (' 00 81 01 07 02 bf cd 96 00 00 00 00 00 00 00\n', '', 0)]
+
+        .. note::
+            * Output is split between commands by running a marker command
+              before each one. If the output can't be split, the commands
+              are run one process at a time instead.
+            * exec mode doesn't report each command's exit status, so in
+              batch mode a command's status is 1 if it printed an ipmitool
+              error message (such as "Error: ..." or "Invalid command") to
+              stderr, and 0 otherwise. Warnings don't count.
+
+        :param commands: ipmitool arguments for each command.
+        :type commands: list
+        :param options: ipmitool options to use for every command, such as
+                        ['-I', 'lanplus'].
+        :type options: list
+
+        :returns: (stdout, stderr, status) for each command, in order.
+        :rtype: list
+
+        :raises ValueError: If an argument contains a double quote or a line
+                            break, which batch files have no way to express.
+
+        """
+        if options is None:
+            options = []
+        if not commands:
+            return []
+
+        # The stdout marker doesn't talk to the BMC. The stderr marker is an
+        # invalid command, which ipmitool reports and then carries on from.
+        markers = ["set hostname %s" % self.ip_address,
+                   "cxmanage-batch-marker"]
+        lines = markers * 2
+        for command in commands:
+            lines.append(" ".join(_quote_ipmitool_arg(x) for x in command))
+            lines.extend(markers)
+
+        with tempfile.NamedTemporaryFile(delete=True) as batch_file:
+            batch_file.write("".join("%s\n" % x for x in lines))
+            batch_file.flush()
+            stdout, stderr, _ = self._run_ipmitool(
+                options + ["exec", batch_file.name]
+            )
+
+        outputs = _split_batch_output(stdout, len(commands))
+        errors = _split_batch_output(stderr, len(commands))
+        if outputs is None or errors is None:
+            return [self._run_ipmitool(options + x) for x in commands]
+
+        return [(out, err, 1 if _IPMITOOL_ERROR_RE.search(err) else 0)
+                for out, err in zip(outputs, errors)]
+
+    def _run_ipmitool(self, ipmitool_args):
+        """Run ipmitool against this node.
+
+        :returns: stdout, stderr and the exit status.
+        :rtype: tuple
+
         """
         if ("IPMITOOL_PATH" in os.environ):
             command = [os.environ["IPMITOOL_PATH"]]
@@ -1157,9 +1450,7 @@ communication.
         process = subprocess.Popen(command, stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE)
         stdout, stderr = process.communicate()
-        if(process.returncode != 0):
-            raise IpmiError(stderr.strip())
-        return (stdout + stderr).strip()
+        return stdout, stderr, process.returncode
 
     def get_ubootenv(self):
         """Get the active u-boot environment.
@@ -1197,40 +1488,7 @@ communication.
         contents = self.run_fabric_tftp_command(
             function_name='fabric_config_get_ip_info'
         )
-
-        results = {}
-        for line in contents.splitlines():
-            if line.strip():
-                try:
-                    elements = line.split()
-                    node_id = elements[1].rstrip(":")
-                    try:
-                        node_id = int(node_id)
-                    except ValueError:
-                        pass  # may be a physical node ID, "0.0" for example
-                    ip_address = elements[2]
-                except IndexError:
-                    raise ParseError("Failed to parse ipinfo\n%s" % contents)
-
-                try:
-                    socket.inet_aton(ip_address)  # IP validity check
-                except socket.error:
-                    if allow_errors:
-                        continue
-                    raise ParseError(
-                        "Invalid IP address %s\n%s" % (ip_address, contents)
-                    )
-
-                if ip_address == "0.0.0.0":
-                    if allow_errors:
-                        continue
-                    raise ParseError(
-                        "Invalid IP address 0.0.0.0\n%s" % contents
-                    )
-
-                results[node_id] = ip_address
-
-        return results
+        return fabric_parsers.parse_ipinfo(contents, allow_errors)
 
     @retry(3, allowed_errors=(IpmiError, TftpException, ParseError))
     def get_fabric_macaddrs(self):
@@ -1261,70 +1519,30 @@ communication.
         contents = self.run_fabric_tftp_command(
             function_name='fabric_config_get_mac_addresses'
         )
-
-        results = {}
-        for line in contents.splitlines():
-            if line.strip():
-                elements = line.split()
-                try:
-                    node_id = int(elements[1].rstrip(","))
-                    port = int(elements[3].rstrip(":"))
-                    mac_address = elements[4]
-                    octets = [int(x, 16) for x in mac_address.split(":")]
-                except (IndexError, ValueError):
-                    raise ParseError("Failed to parse macaddrs\n%s" % contents)
-
-                # MAC address validity check
-                if len(octets) != 6:
-                    raise ParseError(
-                        "Invalid MAC address %s\n%s" % (mac_address, contents)
-                    )
-                elif not all(x <= 255 and x >= 0 for x in octets):
-                    raise ParseError(
-                        "Invalid MAC address %s\n%s" % (mac_address, contents)
-                    )
-
-                if not node_id in results:
-                    results[node_id] = {}
-                if not port in results[node_id]:
-                    results[node_id][port] = []
-                results[node_id][port].append(mac_address)
-
-        return results
+        return fabric_parsers.parse_macaddrs(contents)
 
     def get_fabric_uplink_info(self):
         """Gets what uplink information THIS node knows about the Fabric.
 
         >>> node.get_fabric_uplink_info()
-        {'0': {'eth0': '0', 'eth1': '0', 'mgmt': '0'},
-         '1': {'eth0': '0', 'eth1': '0', 'mgmt': '0'},
-         '2': {'eth0': '0', 'eth1': '0', 'mgmt': '0'},
-         '3': {'eth0': '0', 'eth1': '0', 'mgmt': '0'},
-         '4': {'eth0': '0', 'eth1': '0', 'mgmt': '0'}}
+        {0: {'eth0': 0, 'eth1': 0, 'mgmt': 0},
+         1: {'eth0': 0, 'eth1': 0, 'mgmt': 0},
+         2: {'eth0': 0, 'eth1': 0, 'mgmt': 0},
+         3: {'eth0': 0, 'eth1': 0, 'mgmt': 0},
+         4: {'eth0': 0, 'eth1': 0, 'mgmt': 0}}
 
         :return: Returns a map of {node_id : {interface : uplink}}
         :rtype: dictionary
 
         :raises IpmiError: If the IPMI command fails.
         :raises TftpException: If the TFTP transfer fails.
+        :raises ParseError: If we fail to parse uplink info
 
         """
         contents = self.run_fabric_tftp_command(
             function_name='fabric_config_get_uplink_info'
         )
-
-        # Parse addresses from ipinfo file
-        results = {}
-        for line in contents.splitlines():
-            node_id = int(line.replace('Node ', '')[0])
-            ul_info = line.replace('Node %s:' % node_id, '').strip().split(',')
-            node_data = {}
-            for ul_ in ul_info:
-                data = tuple(ul_.split())
-                node_data[data[0]] = int(data[1])
-            results[node_id] = node_data
-
-        return results
+        return fabric_parsers.parse_uplink_info(contents)
 
     def get_link_stats(self, link=0):
         """Gets the linkstats for the link specified.
@@ -1363,22 +1581,7 @@ communication.
             function_name='fabric_get_linkstats',
             link=link
         )
-        results = {}
-        for line in contents.splitlines():
-            if ('=' in line):
-                reg_value = line.strip().split('=')
-                if (len(reg_value) < 2):
-                    raise ValueError(
-                        'Register: %s has no value!' % reg_value[0]
-                    )
-                else:
-                    results[
-                        reg_value[0].replace(
-                            'pFS_LCn', 'FS_LC%s' % link
-                        ).replace('(link)', '').strip()
-                    ] = reg_value[1].strip()
-
-        return results
+        return fabric_parsers.parse_link_stats(contents, link)
 
     def get_linkmap(self):
         """Gets the src and destination of each link on a node.
@@ -1396,16 +1599,7 @@ communication.
         contents = self.run_fabric_tftp_command(
             function_name='fabric_info_get_link_map',
         )
-
-        results = {}
-        for line in contents.splitlines():
-            if (line.startswith("Link")):
-                elements = line.strip().split()
-                link_id = int(elements[1].rstrip(':'))
-                node_id = int(elements[3].strip())
-                results[link_id] = node_id
-
-        return results
+        return fabric_parsers.parse_linkmap(contents)
 
     def get_routing_table(self):
         """Gets the routing table as instantiated in the fabric switch.
@@ -1423,18 +1617,7 @@ communication.
         contents = self.run_fabric_tftp_command(
             function_name='fabric_info_get_routing_table',
         )
-
-        results = {}
-        for line in contents.splitlines():
-            if (line.startswith("Node")):
-                elements = line.strip().split()
-                node_id = int(elements[1].rstrip(':'))
-                rt_entries = []
-                for entry in elements[4].strip().split('.'):
-                    rt_entries.append(int(entry))
-                results[node_id] = rt_entries
-
-        return results
+        return fabric_parsers.parse_routing_table(contents)
 
     def get_depth_chart(self):
         """Gets a table indicating the distance from a given node to all other
@@ -1456,39 +1639,20 @@ communication.
         contents = self.run_fabric_tftp_command(
             function_name='fabric_info_get_depth_chart',
         )
+        return fabric_parsers.parse_depth_chart(contents)
 
-        results = {}
-        for line in contents.splitlines():
-            if (line.startswith("Node")):
-                elements = line.strip().split()
-                target = int(elements[1].rstrip(':'))
-                neighbor = int(elements[8].rstrip(':'))
-                hops = int(elements[4].strip())
-                dchrt_entries = {}
-                dchrt_entries['shortest'] = (neighbor, hops)
-                try:
-                    other_hops_neighbors = elements[12].strip().split(
-                        r'[,\s]+'
-                    )
-                    hops = []
-                    for entry in other_hops_neighbors:
-                        pair = entry.strip().split('/')
-                        hops.append((int(pair[1]), int(pair[0])))
-                    dchrt_entries['others'] = hops
-
-                except Exception:  # pylint: disable=W0703
-                    pass
-
-                results[target] = dchrt_entries
-
-        return results
-
-    def get_server_ip(self, interface=None, ipv6=False, aggressive=False):
+    # pylint: disable=R0913
+    def get_server_ip(self, interface=None, ipv6=False, aggressive=False,
+                      cache=None, mac_addresses=None, mac_table=None):
         """Get the IP address of the Linux server. The server must be powered
         on for this to work.
 
         >>> node.get_server_ip()
         '192.168.100.100'
+        >>> # Skip SOL if the address was found before ...
+        >>> from cxmanage_api.server_ip_cache import ServerIPCache
+        >>> node.get_server_ip(cache=ServerIPCache.default())
+        '192.168.100.100'
 
         :param interface: Network interface to check (e.g. eth0).
         :type interface: string
@@ -1496,6 +1660,17 @@ communication.
         :type ipv6: boolean
         :param aggressive: Discover the IP aggressively (may power cycle node).
         :type aggressive: boolean
+        :param cache: Cache to check before using SOL, and to store the
+                      address in after.
+        :type cache: `ServerIPCache <server_ip_cache.html>`_
+        :param mac_addresses: This node's MAC addresses, to validate a cached
+                              address against. Fetched if needed and not
+                              given.
+        :type mac_addresses: list
+        :param mac_table: The fabric MAC table, as returned by
+                          get_fabric_macaddrs(), to take this node's MAC
+                          addresses from instead of reading it again.
+        :type mac_table: dictionary
 
         :return: The IP address of the server.
         :rtype: string
@@ -1505,6 +1680,23 @@ communication.
 obtained.
 
         """
+        if (cache != None):
+            server_ip = cache.lookup(self.guid, interface, ipv6)
+            if (server_ip != None):
+                if (mac_addresses == None):
+                    try:
+                        if (mac_table == None):
+                            mac_table = self.get_fabric_macaddrs()
+                        mac_addresses = sum(
+                            mac_table[self.node_id].values(), []
+                        )
+                    except (IpmiError, TftpException, ParseError, KeyError):
+                        mac_addresses = []
+                server_ip = cache.lookup(self.guid, interface, ipv6,
+                                         mac_addresses)
+            if (server_ip != None):
+                return server_ip
+
         verbosity = 2 if self.verbose else 0
         retriever = self.ipretriever(
             self.ip_address, aggressive=aggressive, verbosity=verbosity,
@@ -1513,8 +1705,42 @@ obtained.
             interface=interface, ipv6=ipv6, bmc=self.bmc
         )
         retriever.run()
+        if (cache != None and retriever.server_ip != None):
+            cache.store(self.guid, retriever.server_ip, retriever.server_mac,
+                        interface, ipv6)
         return retriever.server_ip
 
+    def get_server_ip_by_mac(self, address_map, port=None, mac_table=None):
+        """Get the IP address of the Linux server by looking up this node's
+        MAC addresses in a map built from DHCP leases or an ARP table. No SOL
+        session is used, and the server doesn't need to be reachable.
+
+        >>> from cxmanage_api.address_map import read_leases
+        >>> address_map = read_leases('/var/lib/dhcp/dhcpd.leases')
+        >>> node.get_server_ip_by_mac(address_map)
+        '192.168.100.100'
+
+        :param address_map: A map of mac_addresses->ip_addresses.
+        :type address_map: dictionary
+        :param port: Only look at this port's MAC addresses. By default, the
+                     first port with an address is used.
+        :type port: integer
+        :param mac_table: The fabric MAC table, as returned by
+                          get_fabric_macaddrs(), to take this node's MAC
+                          addresses from instead of reading it again.
+        :type mac_table: dictionary
+
+        :return: The IP address of the server.
+        :rtype: string
+        :raises IPDiscoveryError: If none of this node's MAC addresses are in
+                                  the map.
+
+        """
+        if (mac_table == None):
+            mac_table = self.get_fabric_macaddrs()
+        return find_server_ip(mac_table.get(self.node_id, {}), address_map,
+                              port)
+
     def get_linkspeed(self, link=None, actual=False):
         """Get the linkspeed for the node.  This returns either
         the actual linkspeed based on phy controller register settings,
@@ -1605,25 +1831,97 @@ obtained.
 
         return results
 
-    def read_fru(self, fru_number, offset=0, bytes_to_read=-1):
+    def read_fru(self, fru_number, offset=0, bytes_to_read=-1,
+                 use_cache=True):
         """Read from node's fru starting at offset.
         This is equivalent to the ipmitool fru read command.
 
+        .. note::
+            * Whole FRU images are cached by (GUID, fru_number) for the rest
+              of the session, and later reads are served from the cache.
+            * Reads of up to FRU_RANGE_MAX bytes that aren't cached only
+              transfer the requested window, if the BMC supports it.
+
+        >>> node.read_fru(99, offset=516, bytes_to_read=3)
+        '0.0'
+
         :param fru_number: FRU image to read
         :type fru_number: integer
         :param offset: File offset
         :type offset: integer
         :param bytes_to_read: Number of bytes to read
         :type bytes_to_read: integer
+        :param use_cache: Whether to use the FRU cache. If False, the FRU is
+                          read from the node and the cache is refreshed.
+        :type use_cache: boolean
 
         :return: The data read from FRU
         :rtype: string
 
         """
+        key = (self.guid, fru_number)
+        if use_cache:
+            with Node._fru_cache_lock:
+                contents = Node._fru_cache.get(key)
+            if contents is not None:
+                return self._slice_fru(contents, offset, bytes_to_read)
+
+        if (0 <= bytes_to_read <= FRU_RANGE_MAX and
+                self._fru_ranged_reads):
+            try:
+                return self._read_fru_range(fru_number, offset,
+                                            bytes_to_read)
+            except (IpmiError, ParseError, OSError):
+                # Not supported by this BMC, don't try again
+                self._fru_ranged_reads = False
+
         with tempfile.NamedTemporaryFile(delete=True) as hexfile:
             self.bmc.fru_read(fru_number, hexfile.name)
-            hexfile.seek(offset)
-            return(hexfile.read(bytes_to_read))
+            contents = hexfile.read()
+
+        with Node._fru_cache_lock:
+            Node._fru_cache[key] = contents
+        return self._slice_fru(contents, offset, bytes_to_read)
+
+    @staticmethod
+    def clear_fru_cache():
+        """Forget all FRU contents cached by read_fru(), for every node."""
+        with Node._fru_cache_lock:
+            Node._fru_cache.clear()
+
+    def _read_fru_range(self, fru_number, offset, bytes_to_read):
+        """Read a window of a FRU with raw Read FRU Data commands."""
+        data = []
+        remaining = bytes_to_read
+        while remaining > 0:
+            count = min(remaining, FRU_RANGE_CHUNK)
+            output = self.ipmitool_command([
+                "raw", "0x0a", "0x11", str(fru_number),
+                "0x%02x" % (offset & 0xff), "0x%02x" % (offset >> 8),
+                str(count)
+            ])
+            try:
+                values = [int(x, 16) for x in output.split()]
+                returned = values[0]
+            except (ValueError, IndexError):
+                raise ParseError("Failed to parse FRU data\n%s" % output)
+            if returned != len(values) - 1 or returned > count:
+                raise ParseError("Failed to parse FRU data\n%s" % output)
+
+            data.append("".join(chr(x) for x in values[1:]))
+            if returned < count:
+                break  # end of the FRU
+            offset += returned
+            remaining -= returned
+
+        return "".join(data)
+
+    @staticmethod
+    def _slice_fru(contents, offset, bytes_to_read):
+        """Get the part of a FRU image that read_fru() was asked for."""
+        if bytes_to_read < 0:
+            return contents[offset:]
+        return contents[offset:offset + bytes_to_read]
 
     def run_fabric_tftp_command(self, function_name, **kwargs):
         """Run a fabric TFTP command and return the contents of the file.
@@ -1635,33 +1933,32 @@ obtained.
         :rtype: string
 
         """
-        filename = temp_file()
-        basename = os.path.basename(filename)
+        # Results are received straight into memory, so there's no local
+        # file to name this after.
+        basename = "%s-%s-%08x" % (function_name, self.ip_address,
+                                   random.getrandbits(32))
         try:
             getattr(self.bmc, function_name)(filename=basename, **kwargs)
-            self.ecme_tftp.get_file(basename, filename)
+            return self.ecme_tftp.read_file(basename)
 
         except (IpmiError, TftpException):
-            getattr(self.bmc, function_name)(
-                filename=basename,
-                tftp_addr=self.tftp_address,
-                **kwargs
-            )
+            self.tftp.expect_file(basename, in_memory=True)
+            try:
+                getattr(self.bmc, function_name)(
+                    filename=basename,
+                    tftp_addr=self.tftp_address,
+                    **kwargs
+                )
 
-            deadline = time.time() + 10
-            while (time.time() < deadline):
                 try:
-                    time.sleep(1)
-                    self.tftp.get_file(src=basename, dest=filename)
-                    if (os.path.getsize(filename) > 0):
-                        break
-                except (TftpException, IOError):
-                    pass
-
-            if os.path.getsize(filename) == 0:
-                raise TftpException("Node failed to reach TFTP server")
-
-        return open(filename, "rb").read()
+                    return self.tftp.wait_for_contents(basename, timeout=10)
+                except TftpException:
+                    # Maybe we gave it the wrong address for us
+                    self.tftp.invalidate_address(self.ip_address)
+                    raise TftpException("Node failed to reach TFTP server")
+            finally:
+                # Don't keep waiting for an upload that never happened
+                self.tftp.release_file(basename)
 
     @staticmethod
     def _get_partition(fwinfo, image_type, partition_arg):
@@ -1706,10 +2003,78 @@ obtained.
         else:
             raise ValueError("Invalid partition argument: %s" % partition_arg)
 
+    def _is_image_current(self, fwinfo, image, partition, logger,
+                          use_newest=True):
+        """Check whether a partition already holds this image, and log why or
+        why not. The partition must hold the same version string and
+        contents. It must also be the newest partition of its type, or the
+        newest must hold the image too, so that skipping it can't leave an
+        older image to boot.
+
+        If use_newest is set, the image is also current when the newest
+        partition holds it, even if this one doesn't. After an update and a
+        reboot, the INACTIVE partition holds the previous build, but the
+        node already boots the new one.
+        """
+        reason = self._compare_image(image, partition)
+        newest = self._get_partition(fwinfo, image.type, "NEWEST")
+        if (newest.partition != partition.partition):
+            if (reason == None):
+                if (self._compare_image(image, newest) != None):
+                    reason = "partition %i is newer" % int(newest.partition)
+            elif (use_newest and self._compare_image(image, newest) == None):
+                logger.info("Skipping %s, newest partition %i is up to date\n"
+                        % (image, int(newest.partition)))
+                return True
+
+        if (reason == None):
+            logger.info("Skipping %s, partition %i is up to date\n"
+                    % (image, int(partition.partition)))
+            return True
+
+        logger.info("Updating %s on partition %i: %s\n"
+                % (image, int(partition.partition), reason))
+        return False
+
+    def _compare_image(self, image, partition):
+        """Compare an image to what's stored in a partition.
+
+        :returns: None if they match, or the reason they don't.
+        :rtype: string
+
+        """
+        version = image.get_version()
+        if (partition.version.strip() != version.strip()):
+            return "version %s differs from %s" % (partition.version.strip(),
+                                                   version)
+
+        if (image.size() > int(partition.size, 16)):
+            return "image doesn't fit the partition"
+
+        try:
+            result = self.bmc.check_firmware(int(partition.partition))
+            if (getattr(result, "error", None)):
+                return "partition check failed (%s)" % result.error
+            actual = int(str(result.crc32), 16)
+        except (IpmiError, AttributeError, ValueError):
+            return "partition check failed"
+
+        expected = image.get_crc32(int(partition.priority, 16),
+                                   int(partition.daddr, 16))
+        if (actual != expected):
+            return "crc32 %08x differs from %08x" % (actual, expected)
+
+        return None
+
     def _upload_image(self, image, partition, priority=None):
         """Upload a single image. This includes uploading the image, performing
         the firmware update, crc32 check, and activation.
         """
+        filename = self._render_image(image, partition, priority)
+        self._transfer_image(filename, partition, image.type)
+
+    def _render_image(self, image, partition, priority=None):
+        """Render an image to an SIMG file for the given partition."""
         partition_id = int(partition.partition)
         if (priority == None):
             priority = int(partition.priority, 16)
@@ -1720,7 +2085,41 @@ obtained.
             raise ImageSizeError("%s image is too large for partition %i" %
                     (image.type, partition_id))
 
-        filename = image.render_to_simg(priority, daddr)
+        return image.render_to_simg(priority, daddr)
+
+    def _render_images(self, uploads, priority=None):
+        """Render a list of (image, partition) uploads, staying one image
+        ahead of the caller. Yields (image, partition, filename) tuples.
+        If the caller stops early, this waits for the render in progress
+        when it's closed, so nothing is left running in the background.
+        """
+        render_queue = TaskQueue(threads=1)
+        tasks = [render_queue.put(self._render_image, image, partition,
+                                  priority)
+                 for image, partition in uploads[:1]]
+
+        try:
+            for i, (image, partition) in enumerate(uploads):
+                if i + 1 < len(uploads):
+                    next_image, next_partition = uploads[i + 1]
+                    tasks.append(render_queue.put(
+                        self._render_image, next_image, next_partition,
+                        priority
+                    ))
+
+                tasks[i].join()
+                if tasks[i].status == "Failed":
+                    raise tasks[i].error
+                yield image, partition, tasks[i].result
+        finally:
+            for task in tasks:
+                task.join()
+
+    def _transfer_image(self, filename, partition, image_type):
+        """Transfer a rendered SIMG to a partition, then verify its crc32 and
+        activate it.
+        """
+        partition_id = int(partition.partition)
         basename = os.path.basename(filename)
 
         for _ in xrange(2):
@@ -1728,18 +2127,23 @@ obtained.
                 self.bmc.register_firmware_write(
                     basename,
                     partition_id,
-                    image.type
+                    image_type
                 )
                 self.ecme_tftp.put_file(filename, basename)
                 break
             except (IpmiError, TftpException):
                 pass
         else:
-            # Fall back and use TFTP server
-            self.tftp.put_file(filename, basename)
-            result = self.bmc.update_firmware(basename, partition_id,
-                    image.type, self.tftp_address)
-            self._wait_for_transfer(result.tftp_handle_id)
+            # Fall back and use TFTP server. Rendered images are shared, so
+            # give this transfer its own name on the server.
+            tftp_name = "%s-%s-%i" % (basename, self.ip_address, partition_id)
+            self.tftp.put_file(filename, tftp_name)
+            try:
+                result = self.bmc.update_firmware(tftp_name, partition_id,
+                        image_type, self.tftp_address)
+                self._wait_for_transfer(result.tftp_handle_id)
+            finally:
+                self.tftp.release_file(tftp_name)
 
         # Verify crc and activate
         self.bmc.check_firmware(partition_id)
@@ -1781,11 +2185,14 @@ obtained.
 
         while (result.status == "In progress"):
             if (time.time() >= deadline):
+                self.tftp.invalidate_address(self.ip_address)
                 raise TimeoutError("Transfer timed out after 3 minutes")
             time.sleep(1)
             result = self.bmc.get_firmware_status(handle)
 
         if (result.status != "Complete"):
+            # Maybe we gave it the wrong address for us
+            self.tftp.invalidate_address(self.ip_address)
             raise TransferFailure("Node reported TFTP transfer failure")
 
     def _check_firmware(self, package, partition_arg="INACTIVE", priority=None):
@@ -1855,9 +2262,28 @@ obtained.
                         "that's in use"
                     )
 
-        # Try a TFTP download. Would try an upload too, but nowhere to put it.
-        partition = self._get_partition(fwinfo, "SOC_ELF", "FIRST")
-        self._download_image(partition)
+        self._check_tftp(fwinfo)
+
+    def _check_tftp(self, fwinfo):
+        """Make sure this node can transfer files over TFTP.
+
+        A fabric TFTP command only moves a few bytes, but goes over the same
+        paths as a firmware transfer: the ECME's TFTP server, then the ECME
+        reaching our TFTP server. If the ECME doesn't support it, fall back
+        to downloading the smallest partition.
+
+        :raises NoPartitionError: If the fallback has no partition to
+                                  download.
+        """
+        try:
+            self.run_fabric_tftp_command("fabric_config_get_ip_info")
+        except IpmiError:
+            partitions = [x for x in fwinfo if int(x.size, 16) > 0]
+            if (not partitions):
+                raise NoPartitionError(
+                        "No partition found to test TFTP transfers with")
+            partition = min(partitions, key=lambda x: int(x.size, 16))
+            self._download_image(partition)
 
     @staticmethod
     def _get_next_priority(fwinfo, package):
@@ -0,0 +1,536 @@
+"""Calxeda: sel_log.py"""
+
+
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+
+
+import os
+import re
+import json
+import time
+from bisect import bisect_left, bisect_right
+
+
+DEFAULT_SEL_DIR = "~/.cxmanage/sel"
+
+_ENTRY_RE = re.compile(
+    r'^\s*([0-9a-fA-F]+)\s*\|\s*([^|]*?)\s*\|\s*([^|]*?)\s*\|'
+    r'\s*([^|]*?)\s*\|\s*([^|]*?)\s*(?:\|\s*([^|]*?)\s*)?$'
+)
+_DATE_RE = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})$')
+_TIME_RE = re.compile(r'^(\d{1,2}):(\d{2}):(\d{2})$')
+_DAY_CACHE = {}
+
+
+def get_record_id(entry):
+    """Get the record ID of an ipmitool "sel elist" entry.
+
+    >>> get_record_id('  1a | 06/21/2013 | 16:13:31 | System Event #0xf4 |')
+    26
+
+    :param entry: A single line of SEL output.
+    :type entry: string
+
+    :returns: The record ID, or None if the entry doesn't have one.
+    :rtype: integer
+
+    """
+    try:
+        return int(entry.split("|", 1)[0], 16)
+    except ValueError:
+        return None
+
+
+class SELRecord(object):
+    """A single parsed system event log entry.
+
+    >>> record = parse_sel_entry('1 | 06/27/2013 | 20:25:35 | ' +
+    ...                          'Watchdog 2 #0xfd | Hard reset | Asserted', 3)
+    >>> record
+    <SELRecord node 3 #0x1: Watchdog 2 #0xfd | Hard reset | Asserted>
+    >>> record.timestamp
+    1372379135.0
+
+    :param node_id: ID of the node the entry came from, if known.
+    :type node_id: integer
+    :param record_id: The SEL record ID.
+    :type record_id: integer
+    :param timestamp: Seconds since the epoch, or None for pre-init entries.
+    :type timestamp: float
+    :param sensor: The sensor column, e.g. "Watchdog 2 #0xfd".
+    :type sensor: string
+    :param event: The event description, e.g. "Hard reset".
+    :type event: string
+    :param direction: "Asserted", "Deasserted" or None.
+    :type direction: string
+
+    """
+
+    __slots__ = ("node_id", "record_id", "timestamp", "sensor", "event",
+                 "direction")
+
+    # pylint: disable=R0913
+    def __init__(self, node_id, record_id, timestamp, sensor, event,
+                 direction):
+        """Default constructor for the SELRecord class."""
+        self.node_id = node_id
+        self.record_id = record_id
+        self.timestamp = timestamp
+        self.sensor = sensor
+        self.event = event
+        self.direction = direction
+
+    def __eq__(self, other):
+        return isinstance(other, SELRecord) and all(
+            getattr(self, x) == getattr(other, x) for x in self.__slots__
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        fields = [self.sensor, self.event]
+        if self.direction:
+            fields.append(self.direction)
+        return "<SELRecord node %s #0x%x: %s>" % (self.node_id,
+                self.record_id, " | ".join(fields))
+
+
+def parse_sel_entry(entry, node_id=None):
+    """Parse one line of ipmitool "sel elist" output.
+
+    Timestamps are interpreted in local time. Strings that repeat across
+    entries (sensor names, events) are interned, so a large number of
+    records shares a small set of string objects.
+
+    :param entry: A single line of SEL output.
+    :type entry: string
+    :param node_id: ID of the node the entry came from.
+    :type node_id: integer
+
+    :returns: The parsed record, or None if the line isn't a SEL entry.
+    :rtype: SELRecord
+
+    """
+    match = _ENTRY_RE.match(entry)
+    if not match:
+        return None
+    record_id, date, clock, sensor, event, direction = match.groups()
+
+    # mktime() is slow, so only call it once per distinct date
+    day = _DAY_CACHE.get(date)
+    if day is None:
+        date_match = _DATE_RE.match(date)
+        if date_match:
+            month, mday, year = [int(x) for x in date_match.groups()]
+            day = time.mktime((year, month, mday, 0, 0, 0, 0, 0, -1))
+            _DAY_CACHE[date] = day
+
+    timestamp = None
+    if day is not None:
+        time_match = _TIME_RE.match(clock)
+        if time_match:
+            hours, minutes, seconds = [int(x) for x in time_match.groups()]
+            timestamp = day + hours * 3600 + minutes * 60 + seconds
+
+    return SELRecord(node_id, int(record_id, 16), timestamp, intern(sensor),
+                     intern(event), intern(direction) if direction else None)
+
+
+def parse_sel(entries, node_id=None):
+    """Parse a list of ipmitool "sel elist" entries.
+
+    Lines that aren't SEL entries are skipped.
+
+    >>> parse_sel(node.get_sel(), node.node_id)
+    [<SELRecord node 0 #0x1: System Event #0xf4 | >, ...]
+
+    :param entries: SEL output, as returned by Node.get_sel().
+    :type entries: list
+    :param node_id: ID of the node the entries came from.
+    :type node_id: integer
+
+    :returns: The parsed records.
+    :rtype: list
+
+    """
+    records = (parse_sel_entry(x, node_id) for x in entries)
+    return [x for x in records if x is not None]
+
+
+class SELIndex(object):
+    """An in-memory index of SEL records across any number of nodes.
+
+    Records are indexed by timestamp, sensor, event and node ID so queries
+    only touch the matching records.
+
+    >>> from cxmanage_api.sel_log import SELIndex
+    >>> index = SELIndex()
+    >>> for node_id, entries in fabric.get_sel(incremental=True).items():
+    ...     index.add(entries, node_id)
+    ...
+    >>> index.query(sensor="watchdog", event="hard reset",
+    ...             since=time.time() - 3600)
+    [<SELRecord node 12 #0x4: Watchdog 2 #0xfd | Hard reset | Asserted>]
+
+    """
+
+    def __init__(self):
+        """Default constructor for the SELIndex class."""
+        self._records = []
+        self._by_sensor = {}
+        self._by_event = {}
+        self._by_node = {}
+        self._times = None
+        self._time_order = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, entries, node_id=None):
+        """Add records to the index.
+
+        :param entries: SELRecords, or unparsed "sel elist" entries.
+        :type entries: list
+        :param node_id: Node ID to use when parsing unparsed entries.
+        :type node_id: integer
+
+        :returns: The number of records added.
+        :rtype: integer
+
+        """
+        count = 0
+        for record in entries:
+            if not isinstance(record, SELRecord):
+                record = parse_sel_entry(record, node_id)
+                if record is None:
+                    continue
+
+            position = len(self._records)
+            self._records.append(record)
+            self._by_sensor.setdefault(record.sensor, []).append(position)
+            self._by_event.setdefault(record.event, []).append(position)
+            self._by_node.setdefault(record.node_id, []).append(position)
+            count += 1
+
+        if count:
+            self._times = self._time_order = None
+        return count
+
+    @property
+    def sensors(self):
+        """The distinct sensor names in the index.
+
+        :rtype: list
+        """
+        return sorted(self._by_sensor)
+
+    @property
+    def events(self):
+        """The distinct event descriptions in the index.
+
+        :rtype: list
+        """
+        return sorted(self._by_event)
+
+    # pylint: disable=R0913
+    def query(self, since=None, until=None, sensor=None, event=None,
+              node_id=None, direction=None):
+        """Find records matching every given criterion.
+
+        Sensor and event are matched as case-insensitive substrings, e.g.
+        sensor="watchdog" matches "Watchdog 2 #0xfd".
+
+        :param since: Only match records at or after this time.
+        :type since: float
+        :param until: Only match records at or before this time.
+        :type until: float
+        :param sensor: Substring of the sensor column to match.
+        :type sensor: string
+        :param event: Substring of the event column to match.
+        :type event: string
+        :param node_id: Node ID, or list of node IDs, to match.
+        :type node_id: integer
+        :param direction: "Asserted" or "Deasserted".
+        :type direction: string
+
+        :returns: The matching records, ordered by timestamp. Pre-init
+                  records come last, and never match a time range.
+        :rtype: list
+
+        """
+        candidates = None
+        if sensor is not None:
+            candidates = self._lookup(self._by_sensor, sensor, candidates)
+        if event is not None:
+            candidates = self._lookup(self._by_event, event, candidates)
+        if node_id is not None:
+            if not isinstance(node_id, (list, tuple, set)):
+                node_id = [node_id]
+            positions = set()
+            for value in node_id:
+                positions.update(self._by_node.get(value, []))
+            candidates = self._intersect(candidates, positions)
+
+        times, order = self._time_index()
+        if since is None and until is None:
+            start, end = 0, len(order)
+        else:
+            start = 0 if since is None else bisect_left(times, since)
+            end = len(times) if until is None else bisect_right(times, until)
+
+        if candidates is None:
+            positions = order[start:end]
+        elif len(candidates) * 4 < end - start:
+            # Few candidates: cheaper to sort them than to scan the range
+            if end - start < len(order):
+                candidates = [x for x in candidates
+                              if self._in_range(x, since, until)]
+            positions = sorted(candidates, key=self._sort_key)
+        else:
+            positions = [x for x in order[start:end] if x in candidates]
+
+        records = [self._records[x] for x in positions]
+        if direction is not None:
+            records = [x for x in records if x.direction == direction]
+        return records
+
+    def _lookup(self, postings, substring, candidates):
+        """Get positions for every key containing substring."""
+        substring = substring.lower()
+        positions = set()
+        for key, values in postings.iteritems():
+            if substring in key.lower():
+                positions.update(values)
+        return self._intersect(candidates, positions)
+
+    @staticmethod
+    def _intersect(candidates, positions):
+        """Intersect two candidate sets, where None means everything."""
+        if candidates is None:
+            return positions
+        return candidates & positions
+
+    def _in_range(self, position, since, until):
+        """Check whether a record is dated within [since, until]."""
+        timestamp = self._records[position].timestamp
+        return timestamp is not None and \
+                (since is None or timestamp >= since) and \
+                (until is None or timestamp <= until)
+
+    def _sort_key(self, position):
+        """Sort key for a record position: pre-init records come last."""
+        timestamp = self._records[position].timestamp
+        if timestamp is None:
+            return (1, 0, position)
+        return (0, timestamp, position)
+
+    def _time_index(self):
+        """Get record positions ordered by time, building them if needed.
+
+        :returns: Sorted timestamps of dated records, and the matching
+                  positions. Positions of pre-init records come after the
+                  dated ones, so they're only returned by untimed queries.
+        :rtype: tuple
+
+        """
+        if self._time_order is None:
+            dated = [(x.timestamp, i) for i, x in enumerate(self._records)
+                     if x.timestamp is not None]
+            dated.sort()
+            undated = [i for i, x in enumerate(self._records)
+                       if x.timestamp is None]
+            self._times = [x[0] for x in dated]
+            self._time_order = [x[1] for x in dated] + undated
+        return self._times, self._time_order
+
+
+class SELLog(object):
+    """A local, persisted copy of a node's system event log.
+
+    The log is stored per node GUID as a plain text file of SEL entries,
+    next to a small JSON cursor recording the SEL state as of the last
+    update. Updating only transfers the entries added since then, so polling
+    a node with a large SEL costs O(new entries) instead of O(SEL size).
+
+    >>> from cxmanage_api.sel_log import SELLog
+    >>> sel_log = SELLog(node.guid)
+    >>> sel_log.update(node)
+    ['3 | 06/27/2013 | 21:01:13 | System Event #0xf4 |']
+    >>> sel_log.update(node)
+    []
+
+    :param guid: GUID of the node whose SEL is stored.
+    :type guid: string
+    :param directory: Directory to keep the log in. Defaults to
+                      ~/.cxmanage/sel
+    :type directory: string
+
+    """
+
+    def __init__(self, guid, directory=None):
+        """Default constructor for the SELLog class."""
+        if directory is None:
+            directory = DEFAULT_SEL_DIR
+        directory = os.path.expanduser(directory)
+
+        self.guid = guid
+        self.log_path = os.path.join(directory, "%s.log" % guid)
+        self.cursor_path = os.path.join(directory, "%s.cursor" % guid)
+        self.cursor = self._read_cursor()
+
+    def read(self):
+        """Get every SEL entry stored locally, oldest first.
+
+        :returns: The locally stored SEL entries.
+        :rtype: list
+
+        """
+        if self.cursor is None or not os.path.exists(self.log_path):
+            return []
+        with open(self.log_path) as log_file:
+            return log_file.read().splitlines()
+
+    def update(self, node):
+        """Fetch new SEL entries from a node and append them to the log.
+
+        If the node's SEL was cleared or otherwise changed in a way the
+        cursor can't account for, the whole SEL is fetched again and
+        appended, so entries that were cleared on the node are kept locally.
+
+        :param node: The node to fetch entries from. Must match the GUID.
+        :type node: `Node <node.html>`_
+
+        :returns: The entries that were added to the log.
+        :rtype: list
+
+        """
+        info = node.bmc.sel_info()
+        state = {
+            "entries": info.entries,
+            "last_add_time": str(getattr(info, "last_add_time", None)),
+            "last_del_time": str(getattr(info, "last_del_time", None))
+        }
+
+        entries = new_entries = self._fetch_new(node, state)
+        if new_entries is None:
+            entries = node.bmc.sel_elist()
+            new_entries = self._drop_logged(entries, state)
+
+        if entries:
+            state["last_record_id"] = get_record_id(entries[-1])
+        elif self.cursor is not None:
+            state["last_record_id"] = self.cursor.get("last_record_id")
+        else:
+            state["last_record_id"] = None
+        self._write(new_entries, state)
+        return new_entries
+
+    def _fetch_new(self, node, state):
+        """Fetch only the entries added since the cursor was written.
+
+        :returns: The new entries, or None if they can't be determined
+                  without fetching the whole SEL.
+        :rtype: list
+
+        """
+        cursor = self.cursor
+        if (cursor is None or
+                cursor["last_del_time"] != state["last_del_time"] or
+                cursor["entries"] > state["entries"]):
+            return None
+
+        count = state["entries"] - cursor["entries"]
+        if count == 0:
+            if cursor["last_add_time"] == state["last_add_time"]:
+                return []
+            return None
+
+        # Fetch one entry of overlap so we can tell that none were missed
+        last_record_id = cursor.get("last_record_id")
+        if last_record_id is None:
+            if cursor["entries"] != 0:
+                return None
+            return node.get_sel_tail(count)
+
+        entries = node.get_sel_tail(count + 1)
+        if len(entries) != count + 1 or \
+                get_record_id(entries[0]) != last_record_id:
+            return None
+        return entries[1:]
+
+    def _drop_logged(self, entries, state):
+        """Remove entries that are already in the log from a full fetch.
+
+        If the SEL hasn't been cleared since the last update, record IDs
+        have only grown since then, so anything up to the cursor's last
+        record ID was logged. Older entries in the log may be from before
+        an earlier clear, and their IDs reused, so they aren't compared.
+        If the SEL has been cleared since, everything is new.
+
+        """
+        if (self.cursor is None or
+                self.cursor["last_del_time"] != state["last_del_time"]):
+            return entries
+
+        last_record_id = self.cursor.get("last_record_id")
+        if last_record_id is None:
+            return entries
+        return [x for x in entries if get_record_id(x) is None or
+                get_record_id(x) > last_record_id]
+
+    def _read_cursor(self):
+        """Load the cursor from disk, if there is a usable one."""
+        try:
+            with open(self.cursor_path) as cursor_file:
+                return json.load(cursor_file)
+        except (IOError, ValueError):
+            return None
+
+    def _write(self, new_entries, state):
+        """Append entries to the log and save the new cursor."""
+        directory = os.path.dirname(self.log_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        mode = "a" if self.cursor is not None else "w"
+        with open(self.log_path, mode) as log_file:
+            log_file.writelines("%s\n" % entry for entry in new_entries)
+
+        temp_path = "%s.tmp" % self.cursor_path
+        with open(temp_path, "w") as cursor_file:
+            json.dump(state, cursor_file, indent=4)
+        os.rename(temp_path, self.cursor_path)
+        self.cursor = state
+
+
+# End of file: ./sel_log.py
@@ -0,0 +1,228 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: server_ip_cache.py"""
+
+import os
+import json
+from threading import Lock
+
+
+DEFAULT_SERVER_IP_CACHE = "~/.cxmanage/server_ips.json"
+ARP_TABLE = "/proc/net/arp"
+
+
+class ServerIPCache(object):
+    """A local, persisted record of the server IP addresses found by IP
+    discovery, so that they don't have to be found over SOL every time.
+
+    Entries are keyed by node GUID and interface, and store the MAC address
+    that the server reported alongside its IP. An entry is only trusted
+    while that MAC address is still one of the node's fabric MAC addresses,
+    and while the local ARP table doesn't map the IP to some other MAC, or
+    the MAC to some other IP. Neither check sends anything to the server.
+
+    >>> from cxmanage_api.server_ip_cache import ServerIPCache
+    >>> cache = ServerIPCache()
+    >>> cache.store(node.guid, '192.168.100.100', 'fc:2f:40:ab:cd:cc')
+    >>> cache.lookup(node.guid, mac_addresses=['fc:2f:40:ab:cd:cc'])
+    '192.168.100.100'
+
+    :param path: File to keep the cache in. Defaults to
+                 ~/.cxmanage/server_ips.json
+    :type path: string
+
+    """
+    _default = None
+
+    @staticmethod
+    def default():
+        """ Return the default ServerIPCache """
+        if ServerIPCache._default == None:
+            ServerIPCache._default = ServerIPCache()
+        return ServerIPCache._default
+
+    def __init__(self, path=None):
+        """Default constructor for the ServerIPCache class."""
+        if path is None:
+            path = DEFAULT_SERVER_IP_CACHE
+        self.path = os.path.expanduser(path)
+        self._lock = Lock()
+        self._entries = self._read()
+
+    def lookup(self, guid, interface=None, ipv6=False, mac_addresses=None):
+        """Get a node's server IP address from the cache, if it's still
+        valid.
+
+        :param guid: GUID of the node.
+        :type guid: string
+        :param interface: Network interface that was checked (e.g. eth0).
+        :type interface: string
+        :param ipv6: Whether the address is an IPv6 address.
+        :type ipv6: boolean
+        :param mac_addresses: The node's current fabric MAC addresses. If
+                              given, the stored MAC address must be one of
+                              them.
+        :type mac_addresses: list
+
+        :returns: The server IP address, or None if there is no valid entry.
+        :rtype: string
+
+        """
+        with self._lock:
+            entry = self._entries.get(guid, {}).get(
+                _get_key(interface, ipv6)
+            )
+        if (entry == None):
+            return None
+
+        mac_address = entry.get("mac_address")
+        if (mac_addresses != None):
+            if (mac_address == None or mac_address.lower() not in
+                    [x.lower() for x in mac_addresses]):
+                return None
+
+        if (mac_address != None):
+            mac_address = mac_address.lower()
+            arp_table = read_arp_table()
+            neighbor = arp_table.get(entry["server_ip"])
+            if (neighbor == None):
+                # The server may have been given another address
+                if (mac_address in arp_table.values()):
+                    return None
+            elif (neighbor != mac_address):
+                return None
+
+        return entry["server_ip"]
+
+    def store(self, guid, server_ip, mac_address=None, interface=None,
+              ipv6=False):
+        """Add or replace a node's server IP address, and save the cache.
+
+        :param guid: GUID of the node.
+        :type guid: string
+        :param server_ip: The server IP address.
+        :type server_ip: string
+        :param mac_address: MAC address of the server interface.
+        :type mac_address: string
+        :param interface: Network interface that was checked (e.g. eth0).
+        :type interface: string
+        :param ipv6: Whether the address is an IPv6 address.
+        :type ipv6: boolean
+
+        """
+        with self._lock:
+            self._entries.setdefault(guid, {})[_get_key(interface, ipv6)] = {
+                "server_ip": server_ip,
+                "mac_address": mac_address
+            }
+            self._write()
+
+    def remove(self, guid, interface=None, ipv6=False):
+        """Forget a node's server IP address, and save the cache.
+
+        :param guid: GUID of the node.
+        :type guid: string
+        :param interface: Network interface that was checked (e.g. eth0).
+        :type interface: string
+        :param ipv6: Whether the address is an IPv6 address.
+        :type ipv6: boolean
+
+        """
+        with self._lock:
+            entries = self._entries.get(guid, {})
+            if (entries.pop(_get_key(interface, ipv6), None) != None):
+                if (not entries):
+                    del self._entries[guid]
+                self._write()
+
+    def _read(self):
+        """Load the cache from disk, if there is a usable one."""
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+            if (isinstance(entries, dict)):
+                return entries
+        except (IOError, ValueError):
+            pass
+        return {}
+
+    def _write(self):
+        """Save the cache. Call with the lock held."""
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        temp_path = "%s.tmp" % self.path
+        with open(temp_path, "w") as cache_file:
+            json.dump(self._entries, cache_file, indent=4, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+
+def read_arp_table(path=None):
+    """Read the local IPv4 ARP table. Nothing is sent on the network.
+
+    >>> read_arp_table()
+    {'192.168.100.100': 'fc:2f:40:ab:cd:cc'}
+
+    :param path: File to read the ARP table from. Defaults to /proc/net/arp
+    :type path: string
+
+    :returns: Map of ip_addresses->mac_addresses, for complete entries.
+    :rtype: dictionary
+
+    """
+    if (path == None):
+        path = ARP_TABLE
+
+    table = {}
+    try:
+        with open(path) as arp_file:
+            lines = arp_file.read().splitlines()[1:]
+    except IOError:
+        return table
+
+    for line in lines:
+        fields = line.split()
+        # IP address, HW type, Flags, HW address, Mask, Device
+        if (len(fields) >= 4 and int(fields[2], 16) & 0x2):
+            table[fields[0]] = fields[3].lower()
+    return table
+
+
+def _get_key(interface, ipv6):
+    """Get the key for an interface within a node's entries."""
+    key = interface if interface else "default"
+    if ipv6:
+        key += "/ipv6"
+    return key
+
+
+# End of file: ./server_ip_cache.py
@@ -32,13 +32,18 @@
 # DAMAGE.
 
 
+import os
 import struct
 
-from cxmanage_api.crc32 import get_crc32
+from cxmanage_api.crc32 import get_crc32, Crc32
 
 
 HEADER_LENGTH = 60
 MIN_HEADER_LENGTH = 28
+ALIGNED_OFFSET = 4096
+
+# Size of the reads done by the file-based SIMG functions.
+CHUNK_SIZE = 1024 * 1024
 
 
 # pylint: disable=R0913, R0903, R0902
@@ -125,7 +130,7 @@ def create_simg(contents, priority=0, daddr=0, skip_crc32=False, align=False,
     header.version = version
 
     if (align):
-        header.imgoff = 4096
+        header.imgoff = ALIGNED_OFFSET
     # Calculate crc value
     if (skip_crc32):
         crc32 = 0
@@ -238,6 +243,229 @@ def get_simg_contents(simg):
     end = start + header.imglen
     return simg[start:end]
 
+def get_simg_size(length, align=False):
+    """Returns the size of an SIMG, without building it.
+
+    >>> from cxmanage_api.simg import get_simg_size
+    >>> get_simg_size(9)
+    69
+
+    :param length: Length of the SIMG contents.
+    :type length: integer
+    :param align: Flag used to turn on/off image offset of 4096.
+    :type align: boolean
+
+    :returns: Size of the SIMG in bytes.
+    :rtype: integer
+
+    """
+    if (align):
+        return ALIGNED_OFFSET + length
+    return HEADER_LENGTH + length
+
+def create_simg_file(src, dest, priority=0, daddr=0, skip_crc32=False,
+                     align=False, version=None):
+    """Create an SIMG version of a file, on disk.
+
+    The contents are streamed from src to dest in chunks, and the crc32 is
+    computed along the way, so the file is never held in memory.
+
+    >>> from cxmanage_api.simg import create_simg_file
+    >>> create_simg_file('foobarbaz.bin', 'foobarbaz.simg')
+    <cxmanage_api.simg.SIMGHeader instance at 0x7f4d1ce9aef0>
+
+    :param src: Path to the file to convert.
+    :type src: string
+    :param dest: Path to write the SIMG file to.
+    :type dest: string
+    :param priority: SIMG Header priority value.
+    :type priority: integer
+    :param daddr: SIMG Header daddr value.
+    :type daddr: integer
+    :param skip_crc32: Flag to skip crc32 calculating.
+    :type skip_crc32: boolean
+    :param align: Flag used to turn on/off image offset of 4096.
+    :type align: boolean
+    :param version: Version string.
+    :type version: string
+
+    :returns: The header that was written.
+    :rtype: SIMGHeader
+
+    """
+    if (version == None):
+        version = ''
+
+    header = SIMGHeader()
+    header.priority = priority
+    header.imglen = os.path.getsize(src)
+    header.daddr = daddr
+    header.version = version
+
+    if (align):
+        header.imgoff = ALIGNED_OFFSET
+    crc32 = Crc32().update(str(header)[:MIN_HEADER_LENGTH])
+
+    # Write the contents first, then fill in the header
+    with open(src, "rb") as fin:
+        with open(dest, "wb") as fout:
+            fout.seek(header.imgoff)
+            for chunk in _read_chunks(fin, header.imglen):
+                if (not skip_crc32):
+                    crc32.update(chunk)
+                fout.write(chunk)
+
+            header.flags = 0xFFFFFFFF
+            if (skip_crc32):
+                header.crc32 = 0
+            else:
+                header.crc32 = crc32.crc
+            fout.seek(0)
+            fout.write(str(header).ljust(header.imgoff, chr(0)))
+
+    return header
+
+def read_simg_header(filename):
+    """Returns the header of an SIMG file, without validating it.
+
+    >>> from cxmanage_api.simg import read_simg_header
+    >>> read_simg_header('foobarbaz.simg').imglen
+    9
+
+    :param filename: Path to the file.
+    :type filename: string
+
+    :returns: The SIMG header, or None if the file doesn't have one.
+    :rtype: SIMGHeader
+
+    """
+    with open(filename, "rb") as file_:
+        header_string = file_.read(HEADER_LENGTH)
+    if (not has_simg(header_string)):
+        return None
+    return SIMGHeader(header_string)
+
+def has_simg_file(filename):
+    """Returns true if this file has an SIMG header.
+
+    >>> from cxmanage_api.simg import has_simg_file
+    >>> has_simg_file('foobarbaz.simg')
+    True
+
+    :param filename: Path to the file.
+    :type filename: string
+
+    :returns: Whether or not the file has a SIMG header.
+    :rtype: boolean
+
+    """
+    return read_simg_header(filename) != None
+
+def valid_simg_file(filename):
+    """Return true if this file is a valid SIMG. Only the header is read
+    into memory; the crc32 is computed over the contents in chunks.
+
+    >>> from cxmanage_api.simg import valid_simg_file
+    >>> valid_simg_file('foobarbaz.simg')
+    True
+
+    :param filename: Path to the file.
+    :type filename: string
+
+    :returns: Whether or not the SIMG file is valid.
+    :rtype: boolean
+
+    """
+    header = read_simg_header(filename)
+    if (header == None):
+        return False
+
+    # Check offset
+    if (header.imgoff < MIN_HEADER_LENGTH):
+        return False
+
+    # Check length
+    if (os.path.getsize(filename) < header.imgoff + header.imglen):
+        return False
+
+    # Check crc32
+    if (header.crc32 != 0):
+        if (header.crc32 != get_simg_crc32(header, filename)):
+            return False
+    return True
+
+def get_simg_crc32(header, filename, offset=None):
+    """Returns the crc32 of an SIMG with this header, computed in chunks
+    over contents read from a file. Nothing is written, so this works for
+    raw files as well as SIMG files.
+
+    >>> from cxmanage_api.simg import get_simg_crc32, read_simg_header
+    >>> get_simg_crc32(read_simg_header('foobarbaz.simg'), 'foobarbaz.simg')
+    216724299
+
+    :param header: The SIMG header. Its flags and crc32 are ignored.
+    :type header: SIMGHeader
+    :param filename: Path to the file with the contents.
+    :type filename: string
+    :param offset: Where the contents start in the file. Defaults to the
+                   header's imgoff.
+    :type offset: integer
+
+    :returns: The crc32 value.
+    :rtype: integer
+
+    """
+    if (offset == None):
+        offset = header.imgoff
+
+    header = SIMGHeader(str(header))
+    header.flags = 0
+    header.crc32 = 0
+    crc32 = Crc32().update(str(header)[:MIN_HEADER_LENGTH])
+    with open(filename, "rb") as file_:
+        file_.seek(offset)
+        for chunk in _read_chunks(file_, header.imglen):
+            crc32.update(chunk)
+    return crc32.crc
+
+def read_simg_contents(filename, length=-1):
+    """Returns the contents of an SIMG file, or the start of them.
+
+    >>> from cxmanage_api.simg import read_simg_contents
+    >>> read_simg_contents('foobarbaz.simg', 3)
+    'foo'
+
+    :param filename: Path to the file.
+    :type filename: string
+    :param length: Number of bytes to read, or -1 to read all of them.
+    :type length: integer
+
+    :returns: Contents of this SIMG.
+    :rtype: string
+
+    :raises ValueError: If the file doesn't have an SIMG header.
+
+    """
+    header = read_simg_header(filename)
+    if (header == None):
+        raise ValueError("%s is not an SIMG" % filename)
+    if (length < 0 or length > header.imglen):
+        length = header.imglen
+
+    with open(filename, "rb") as file_:
+        file_.seek(header.imgoff)
+        return file_.read(length)
+
+def _read_chunks(file_, length):
+    """Read up to length bytes from file_, CHUNK_SIZE bytes at a time."""
+    while (length > 0):
+        chunk = file_.read(min(length, CHUNK_SIZE))
+        if (not chunk):
+            break
+        length -= len(chunk)
+        yield chunk
+
+
 
 # End of file: ./simg.py
 
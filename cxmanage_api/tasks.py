@@ -141,6 +141,26 @@ class TaskQueue(object):
         finally:
             self._lock.release()
 
+    def _get_or_remove_worker(self):
+        """Get a task from the task queue, or decrement the worker count if
+        there are none left. Should only be used by TaskWorker.
+
+        Both happen under the same lock, so a put() can't see a worker that's
+        about to exit and skip spawning a new one.
+
+        :returns: A Task object, or None if the worker should exit.
+        :rtype: Task
+
+        """
+        self._lock.acquire()
+        try:
+            return self._queue.popleft()
+        except IndexError:
+            self._workers -= 1
+            return None
+        finally:
+            self._lock.release()
+
     def _remove_worker(self):
         """Decrement the worker count. Should only be used by TaskWorker."""
         self._lock.acquire()
@@ -170,8 +190,10 @@ class TaskWorker(Thread):
         try:
             while True:
                 sleep(self._delay)
-                task = self._task_queue.get()
                 # pylint: disable=W0212
+                task = self._task_queue._get_or_remove_worker()
+                if (task == None):
+                    return
                 task._run()
         # pylint: disable=W0703
         except Exception:
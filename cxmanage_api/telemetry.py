@@ -0,0 +1,400 @@
+"""Calxeda: telemetry.py"""
+
+
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+
+
+import re
+import math
+import time
+from array import array
+from bisect import bisect_left
+from threading import Thread, Lock, Event
+
+from cxmanage_api.cx_exceptions import CommandFailedError
+
+
+_READING_RE = re.compile(
+    r'^\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(?=\s|$)\s*'
+    r'(?:\(\+/-\s*[^)]*\)\s*)?(.*?)\s*$'
+)
+
+
+def parse_sensor_reading(reading):
+    """Split a sensor reading string into a numeric value and a unit.
+
+    >>> parse_sensor_reading('5.016 (+/- 0) Watts')
+    (5.016, 'Watts')
+    >>> parse_sensor_reading('Unspecified')
+    (None, None)
+
+    :param reading: The sensor_reading field reported by the BMC.
+    :type reading: string
+
+    :returns: The reading as a float and its unit, or (None, None) if the
+              reading is not numeric.
+    :rtype: tuple
+
+    """
+    match = _READING_RE.match(reading)
+    if not match:
+        return None, None
+    return float(match.group(1)), match.group(2)
+
+
+def _percentile(ordered, percent):
+    """Linearly interpolated percentile of an already sorted sequence."""
+    position = (len(ordered) - 1) * (percent / 100.0)
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * \
+            (position - lower)
+
+
+def _escape_tag(value):
+    """Escape a tag key or value for the line protocol."""
+    return str(value).replace(",", r"\,").replace("=", r"\=") \
+            .replace(" ", r"\ ")
+
+
+class SensorRingBuffer(object):
+    """Fixed size history of (timestamp, value) samples for one sensor.
+
+    Storage is preallocated as two arrays of doubles, so appending a sample
+    never allocates and the oldest samples are overwritten once the buffer
+    is full.
+
+    >>> from cxmanage_api.telemetry import SensorRingBuffer
+    >>> buf = SensorRingBuffer(capacity=3)
+    >>> for i in range(5):
+    ...     buf.append(i, i * 10)
+    ...
+    >>> buf.samples()
+    (array('d', [2.0, 3.0, 4.0]), array('d', [20.0, 30.0, 40.0]))
+
+    :param capacity: Maximum number of samples to keep.
+    :type capacity: integer
+
+    """
+
+    def __init__(self, capacity, unit=None):
+        """Default constructor for the SensorRingBuffer class."""
+        if capacity < 1:
+            raise ValueError("Ring buffer capacity must be at least 1")
+        self.capacity = capacity
+        self.unit = unit
+
+        self._times = array('d', [0.0]) * capacity
+        self._values = array('d', [0.0]) * capacity
+        self._next = 0
+        self._count = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        """Store a sample, overwriting the oldest one if the buffer is full.
+
+        :param timestamp: Time of the sample, in seconds since the epoch.
+        :type timestamp: float
+        :param value: The sample value.
+        :type value: float
+
+        """
+        with self._lock:
+            self._times[self._next] = timestamp
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+
+    def samples(self, since=None):
+        """Get the stored samples, oldest first.
+
+        :param since: Only return samples taken at or after this time.
+        :type since: float
+
+        :returns: Timestamps and values as two parallel arrays.
+        :rtype: tuple
+
+        """
+        with self._lock:
+            start = (self._next - self._count) % self.capacity
+            end = start + self._count
+            if end <= self.capacity:
+                times = self._times[start:end]
+                values = self._values[start:end]
+            else:
+                times = self._times[start:] + self._times[:self._next]
+                values = self._values[start:] + self._values[:self._next]
+
+        if since is not None:
+            index = bisect_left(times, since)
+            times, values = times[index:], values[index:]
+        return times, values
+
+    def get_stats(self, since=None):
+        """Get aggregate statistics over the stored samples.
+
+        >>> buf.get_stats()
+        {'count': 3, 'min': 20.0, 'max': 40.0, 'mean': 30.0, 'p50': 30.0,
+         'p90': 38.0, 'p99': 39.8, 'rate': 10.0, 'unit': None}
+
+        :param since: Only consider samples taken at or after this time.
+        :type since: float
+
+        :returns: count, min, max, mean, p50, p90, p99, rate (change in value
+                  per second between the first and last sample) and unit, or
+                  None if there are no samples in the window.
+        :rtype: dictionary
+
+        """
+        times, values = self.samples(since)
+        if not values:
+            return None
+
+        ordered = sorted(values)
+        count = len(ordered)
+        elapsed = times[-1] - times[0]
+        if elapsed > 0:
+            rate = (values[-1] - values[0]) / elapsed
+        else:
+            rate = 0.0
+
+        return {
+            "count": count,
+            "min": ordered[0],
+            "max": ordered[-1],
+            "mean": math.fsum(values) / count,
+            "p50": _percentile(ordered, 50),
+            "p90": _percentile(ordered, 90),
+            "p99": _percentile(ordered, 99),
+            "rate": rate,
+            "unit": self.unit
+        }
+
+
+# pylint: disable=R0902
+class SensorCollector(Thread):
+    """Periodically samples sensor readings across a fabric.
+
+    Each (node, sensor) pair gets its own SensorRingBuffer, so memory use is
+    bounded by capacity no matter how long the collector runs.
+
+    >>> from cxmanage_api.fabric import Fabric
+    >>> from cxmanage_api.telemetry import SensorCollector
+    >>> collector = SensorCollector(Fabric('10.20.1.9'), interval=5)
+    >>> collector.start()
+    >>> # ... some time later ...
+    >>> collector.get_stats(0, 'Node Power', window=60)
+    {'count': 12, 'min': 4.728, 'max': 5.296, 'mean': 5.0273, ...}
+    >>> collector.stop()
+
+    :param fabric: Fabric (or Node-like object) to read sensors from. Its
+                   get_sensors() must return {node_id: {name: sensor}}.
+    :type fabric: Fabric
+    :param interval: Seconds between the start of consecutive samples.
+    :type interval: float
+    :param capacity: Number of samples to keep per sensor.
+    :type capacity: integer
+    :param search: Only collect sensors whose name contains this string.
+    :type search: string
+
+    """
+
+    # pylint: disable=R0913
+    def __init__(self, fabric, interval=10, capacity=360, search=""):
+        """Default constructor for the SensorCollector class."""
+        super(SensorCollector, self).__init__()
+        self.daemon = True
+
+        self.fabric = fabric
+        self.interval = interval
+        self.capacity = capacity
+        self.search = search
+        self.buffers = {}
+        self.errors = {}
+
+        self._lock = Lock()
+        self._halt = Event()
+
+    def run(self):
+        """Sample at a fixed cadence until stop() is called."""
+        while not self._halt.is_set():
+            start = time.time()
+            self.sample()
+            self._halt.wait(max(0, self.interval - (time.time() - start)))
+
+    def stop(self):
+        """Stop collecting after the current sample finishes."""
+        self._halt.set()
+
+    def sample(self):
+        """Take one sample of every matching sensor.
+
+        Nodes that fail to respond are skipped for this sample and their
+        errors are kept in the errors attribute.
+
+        :returns: The number of readings stored.
+        :rtype: integer
+
+        """
+        timestamp = time.time()
+        try:
+            results = self.fabric.get_sensors(self.search)
+            errors = {}
+        except CommandFailedError as err:
+            results, errors = err.results, err.errors
+
+        stored = 0
+        with self._lock:
+            self.errors = errors
+            for node_id, sensors in results.iteritems():
+                for name, sensor in sensors.iteritems():
+                    value, unit = parse_sensor_reading(sensor.sensor_reading)
+                    if value is None:
+                        continue
+                    key = (node_id, name)
+                    if not key in self.buffers:
+                        self.buffers[key] = SensorRingBuffer(self.capacity)
+                    self.buffers[key].unit = unit
+                    self.buffers[key].append(timestamp, value)
+                    stored += 1
+        return stored
+
+    def get_stats(self, node_id, sensor_name, window=None):
+        """Get aggregate statistics for one sensor on one node.
+
+        :param node_id: The node to get statistics for.
+        :type node_id: integer
+        :param sensor_name: The full name of the sensor.
+        :type sensor_name: string
+        :param window: Only consider the last window seconds of samples.
+        :type window: float
+
+        :returns: See SensorRingBuffer.get_stats(). None if the sensor has
+                  no samples in the window.
+        :rtype: dictionary
+
+        """
+        with self._lock:
+            buf = self.buffers.get((node_id, sensor_name))
+        if buf is None:
+            return None
+        return buf.get_stats(self._since(window))
+
+    def get_fabric_stats(self, sensor_name, window=None):
+        """Get aggregate statistics for one sensor across every node.
+
+        :param sensor_name: The full name of the sensor.
+        :type sensor_name: string
+        :param window: Only consider the last window seconds of samples.
+        :type window: float
+
+        :returns: Statistics keyed by node ID.
+        :rtype: dictionary
+
+        """
+        since = self._since(window)
+        with self._lock:
+            buffers = [(node_id, buf) for (node_id, name), buf
+                       in self.buffers.iteritems() if name == sensor_name]
+
+        stats = {}
+        for node_id, buf in buffers:
+            node_stats = buf.get_stats(since)
+            if node_stats is not None:
+                stats[node_id] = node_stats
+        return stats
+
+    def write_csv(self, filename, window=None):
+        """Write the collected samples to a CSV file.
+
+        Columns are timestamp, node, sensor, value and unit.
+
+        :param filename: Path of the file to write.
+        :type filename: string
+        :param window: Only write the last window seconds of samples.
+        :type window: float
+
+        """
+        with open(filename, "w") as out:
+            out.write("timestamp,node,sensor,value,unit\n")
+            for node_id, name, buf in self._sorted_buffers():
+                times, values = buf.samples(self._since(window))
+                prefix = '%s,"%s"' % (node_id, name.replace('"', '""'))
+                unit = '"%s"' % (buf.unit or "").replace('"', '""')
+                out.writelines("%.6f,%s,%r,%s\n" % (t, prefix, v, unit)
+                               for t, v in zip(times, values))
+
+    def write_line_protocol(self, filename, window=None,
+                            measurement="sensor"):
+        """Write the collected samples in InfluxDB line protocol format.
+
+        >>> collector.write_line_protocol('power.txt')
+        >>> print open('power.txt').readline()
+        sensor,node=0,sensor=Node\\ Power,unit=Watts value=5.016 138...
+
+        :param filename: Path of the file to write.
+        :type filename: string
+        :param window: Only write the last window seconds of samples.
+        :type window: float
+        :param measurement: Measurement name to use for every line.
+        :type measurement: string
+
+        """
+        with open(filename, "w") as out:
+            for node_id, name, buf in self._sorted_buffers():
+                times, values = buf.samples(self._since(window))
+                prefix = "%s,node=%s,sensor=%s" % (_escape_tag(measurement),
+                        node_id, _escape_tag(name))
+                if buf.unit:
+                    prefix += ",unit=%s" % _escape_tag(buf.unit)
+                out.writelines("%s value=%r %d\n" % (prefix, v, t * 1e9)
+                               for t, v in zip(times, values))
+
+    @staticmethod
+    def _since(window):
+        """Convert a window length into a starting timestamp."""
+        if window is None:
+            return None
+        return time.time() - window
+
+    def _sorted_buffers(self):
+        """Get (node_id, sensor_name, buffer) for every sensor, in order."""
+        with self._lock:
+            return sorted((node_id, name, buf) for (node_id, name), buf
+                          in self.buffers.iteritems())
+
+
+# End of file: ./telemetry.py
@@ -0,0 +1,131 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: address_map_test.py """
+
+import unittest
+
+from cxmanage_api.address_map import parse_leases, parse_neighbors, \
+        find_server_ip, normalize_mac
+from cxmanage_api.cx_exceptions import IPDiscoveryError
+
+
+DHCPD_LEASES = """\
+# The format of this file is documented in the dhcpd.leases(5) manual page.
+lease 192.168.100.100 {
+  starts 4 2013/11/14 00:00:00;
+  binding state active;
+  next binding state free;
+  hardware ethernet FC:2F:40:AB:CD:CC;
+  client-hostname "server0";
+}
+lease 192.168.100.101 {
+  binding state active;
+  hardware ethernet fc:2f:40:ab:cd:cd;
+}
+lease 192.168.100.101 {
+  binding state free;
+  hardware ethernet fc:2f:40:ab:cd:cd;
+}
+lease 192.168.100.102 {
+  binding state active;
+}
+"""
+
+DNSMASQ_LEASES = """\
+1384372342 fc:2f:40:ab:cd:cc 192.168.100.110 server0 *
+1384372343 fc:2f:40:ab:cd:ce 192.168.100.111 * 01:fc:2f:40:ab:cd:ce
+"""
+
+NEIGHBORS = """\
+192.168.100.100 dev eth0 lladdr fc:2f:40:ab:cd:cc REACHABLE
+192.168.100.109 dev eth0  FAILED
+fe80::fe2f:40ff:feab:cdcc dev eth0 lladdr fc:2f:40:ab:cd:cc STALE
+? (192.168.100.101) at fc:2f:40:ab:cd:cd [ether] on eth0
+server2 (192.168.100.102) at FC:2F:40:AB:CD:CE [ether] on eth0
+Address                  HWtype  HWaddress           Flags Mask        Iface
+192.168.100.103          ether   fc:2f:40:ab:cd:cf   C                 eth0
+IP address       HW type     Flags       HW address            Mask     Device
+192.168.100.104  0x1         0x2         fc:2f:40:ab:cd:d0     *        eth0
+192.168.100.105  0x1         0x0         00:00:00:00:00:00     *        eth0
+"""
+
+
+class AddressMapTest(unittest.TestCase):
+    """ Tests the address_map parsers """
+
+    def test_parse_leases(self):
+        """ Test parsing dhcpd lease files """
+        self.assertEqual(parse_leases(DHCPD_LEASES),
+                         {"fc:2f:40:ab:cd:cc": "192.168.100.100"})
+
+    def test_parse_dnsmasq_leases(self):
+        """ Test parsing dnsmasq lease files """
+        self.assertEqual(parse_leases(DNSMASQ_LEASES), {
+            "fc:2f:40:ab:cd:cc": "192.168.100.110",
+            "fc:2f:40:ab:cd:ce": "192.168.100.111"
+        })
+
+    def test_parse_neighbors(self):
+        """ Test parsing ip neigh and arp output """
+        self.assertEqual(parse_neighbors(NEIGHBORS), {
+            "fc:2f:40:ab:cd:cc": "192.168.100.100",
+            "fc:2f:40:ab:cd:cd": "192.168.100.101",
+            "fc:2f:40:ab:cd:ce": "192.168.100.102",
+            "fc:2f:40:ab:cd:cf": "192.168.100.103",
+            "fc:2f:40:ab:cd:d0": "192.168.100.104"
+        })
+        self.assertEqual(parse_neighbors(NEIGHBORS, ipv6=True),
+                         {"fc:2f:40:ab:cd:cc": "fe80::fe2f:40ff:feab:cdcc"})
+
+    def test_find_server_ip(self):
+        """ Test finding a node's address by MAC address """
+        mac_addresses = {
+            0: ["fc:2f:40:ab:cd:c"], 1: ["fc:2f:40:ab:cd:d"], 2: []
+        }
+        address_map = {
+            "fc:2f:40:ab:cd:0c": "192.168.100.100",
+            "fc:2f:40:ab:cd:0d": "192.168.100.101"
+        }
+        self.assertEqual(find_server_ip(mac_addresses, address_map),
+                         "192.168.100.100")
+        self.assertEqual(find_server_ip(mac_addresses, address_map, 1),
+                         "192.168.100.101")
+        self.assertRaises(IPDiscoveryError, find_server_ip, mac_addresses,
+                          address_map, 2)
+        self.assertRaises(IPDiscoveryError, find_server_ip, mac_addresses,
+                          {})
+
+    def test_normalize_mac(self):
+        """ Test normalizing MAC addresses """
+        self.assertEqual(normalize_mac("FC:2F:40:0:A:BC"),
+                         "fc:2f:40:00:0a:bc")
+
+# End of file: ./address_map_test.py
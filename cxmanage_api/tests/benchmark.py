@@ -0,0 +1,192 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: benchmark.py
+
+Benchmarks for the performance sensitive parts of cxmanage_api. These print
+timings, and only fail on a large regression, since wall-clock bounds are
+unreliable on loaded machines. They aren't part of run_tests. Run them with:
+
+    python -m unittest -v cxmanage_api.tests.benchmark
+
+"""
+
+import os
+import sys
+import time
+import random
+import timeit
+import logging
+import unittest
+from threading import Thread
+
+import tftpy
+
+from cxmanage_api import fabric_parsers, temp_dir
+from cxmanage_api.crc32 import get_crc32, get_crc32_table
+from cxmanage_api.tests.fabric_parsers_test import synthetic_ipinfo, \
+        synthetic_macaddrs, synthetic_uplink_info, synthetic_routing_table, \
+        synthetic_depth_chart
+from cxmanage_api.tests.tftp_server_test import _download
+from cxmanage_api.tftp_server import TftpServer
+
+
+def report(message):
+    """ Print a benchmark result """
+    sys.stderr.write("\n    %s " % message)
+
+
+class FabricParsersBenchmark(unittest.TestCase):
+    """ Time each parser on synthetic outputs for a 4096-node fabric """
+
+    # Each parser takes well under 0.1s on a 4096-node fabric, so this only
+    # catches a large regression.
+    bound = 1.0
+
+    def time_parser(self, parser, contents):
+        """ Report the best of 3 runs of parser(contents), and fail if it's
+        far slower than it should be """
+        duration = min(timeit.repeat(lambda: parser(contents),
+                                     repeat=3, number=1))
+        report("%s: %.3fs" % (parser.__name__, duration))
+        self.assertLess(duration, self.bound,
+                        "%s took %.3fs" % (parser.__name__, duration))
+
+    def test_ipinfo(self):
+        """ Benchmark parse_ipinfo """
+        self.time_parser(fabric_parsers.parse_ipinfo, synthetic_ipinfo())
+
+    def test_macaddrs(self):
+        """ Benchmark parse_macaddrs """
+        self.time_parser(fabric_parsers.parse_macaddrs, synthetic_macaddrs())
+
+    def test_uplink_info(self):
+        """ Benchmark parse_uplink_info """
+        self.time_parser(fabric_parsers.parse_uplink_info,
+                         synthetic_uplink_info())
+
+    def test_routing_table(self):
+        """ Benchmark parse_routing_table """
+        self.time_parser(fabric_parsers.parse_routing_table,
+                         synthetic_routing_table())
+
+    def test_depth_chart(self):
+        """ Benchmark parse_depth_chart """
+        self.time_parser(fabric_parsers.parse_depth_chart,
+                         synthetic_depth_chart())
+
+
+class Crc32Benchmark(unittest.TestCase):
+    """ Compare get_crc32 against the pure Python table loop """
+
+    def test_benchmark(self):
+        """ Benchmark get_crc32 on 64KiB of data """
+        string = "".join(chr(random.randint(0, 255)) for _ in xrange(65536))
+
+        start = time.time()
+        expected = get_crc32_table(string)
+        table_time = time.time() - start
+
+        start = time.time()
+        for _ in xrange(16):
+            result = get_crc32(string)
+        fast_time = (time.time() - start) / 16
+
+        self.assertEqual(result, expected)
+        report("table loop: %.4fs, get_crc32: %.6fs" % (table_time, fast_time))
+
+
+class TftpServerBenchmark(unittest.TestCase):
+    """ Compares loopback throughput against tftpy's TftpServer """
+
+    size = 256 * 1024
+
+    def setUp(self):
+        self.root = temp_dir()
+        self.filename = "benchmark.bin"
+        self.contents = os.urandom(self.size)
+        with open(os.path.join(self.root, self.filename), "wb") as fileobj:
+            fileobj.write(self.contents)
+
+    def test_benchmark(self):
+        """ Benchmark aggregate MB/s at 1, 16 and 64 concurrent clients """
+        server = TftpServer(self.root, ip_address="127.0.0.1")
+        thread = Thread(target=server.serve_forever,
+                        kwargs={"poll_interval": 0.05})
+        thread.daemon = True
+        thread.start()
+
+        old_server = tftpy.TftpServer(self.root)
+        tftpy.setLogLevel(logging.CRITICAL)
+        old_thread = Thread(target=old_server.listen,
+                            args=("127.0.0.1", 0))
+        old_thread.daemon = True
+        old_thread.start()
+        while getattr(old_server, "sock", None) == None:
+            time.sleep(0.01)
+        old_port = old_server.sock.getsockname()[1]
+
+        try:
+            for clients in [1, 16, 64]:
+                old = self._measure(old_port, clients, None)
+                new = self._measure(server.port, clients, None)
+                fast = self._measure(
+                    server.port, clients,
+                    {"blksize": 8192, "windowsize": 16, "tsize": 0}
+                )
+                report("%i clients: tftpy %.1f MB/s, lock-step %.1f MB/s,"
+                       " windowed %.1f MB/s" % (clients, old, new, fast))
+        finally:
+            server.stop()
+            old_server.stop(now=True)
+            thread.join()
+
+    def _measure(self, port, clients, options):
+        """ Aggregate MB/s for some number of concurrent downloads """
+        results = []
+
+        def download():
+            """ Download the file and check it """
+            data, _ = _download(port, self.filename, options)
+            results.append(data == self.contents)
+
+        threads = [Thread(target=download) for _ in range(clients)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        self.assertEqual(results, [True] * clients)
+        return clients * self.size / elapsed / 1024 / 1024
+
+
+# End of file: ./benchmark.py
@@ -0,0 +1,77 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: crc32_test.py """
+
+import random
+import unittest
+from mock import patch
+
+from cxmanage_api.crc32 import get_crc32, get_crc32_table, Crc32
+
+
+class Crc32Test(unittest.TestCase):
+    """ Tests involving the crc32 engine """
+
+    def test_known_values(self):
+        """ Test get_crc32 against known values """
+        self.assertEqual(get_crc32("Foo Bar Baz"), 3901333286)
+        self.assertEqual(get_crc32("Foo Bar Baz", 1), 688341222)
+        self.assertEqual(get_crc32(""), 0)
+        self.assertEqual(get_crc32("", 0xFFFFFFFF), 0xFFFFFFFF)
+
+    def test_equivalence(self):
+        """ Test that get_crc32 matches the table implementation """
+        for size in [1, 2, 7, 8, 9, 63, 64, 65, 1000, 8192]:
+            string = "".join(chr(random.randint(0, 255))
+                             for _ in xrange(size))
+            for crc in [0, 1, 0x7FFFFFFF, 0x80000000, 0xFFFFFFFF,
+                        random.randint(0, 0xFFFFFFFF)]:
+                self.assertEqual(get_crc32(string, crc),
+                                 get_crc32_table(string, crc))
+
+    def test_table_fallback(self):
+        """ Test get_crc32 without zlib """
+        with patch("cxmanage_api.crc32.zlib", None):
+            self.assertEqual(get_crc32("Foo Bar Baz"), 3901333286)
+            self.assertEqual(get_crc32("Foo Bar Baz", 1), 688341222)
+
+    def test_incremental(self):
+        """ Test that Crc32.update matches a one-shot get_crc32 """
+        string = "".join(chr(random.randint(0, 255)) for _ in xrange(10000))
+        for crc in [0, 0xFFFFFFFF]:
+            crc32 = Crc32(crc)
+            for start in xrange(0, len(string), 777):
+                crc32.update(string[start:start + 777])
+            self.assertEqual(crc32.crc, get_crc32(string, crc))
+            self.assertEqual(crc32.crc, get_crc32_table(string, crc))
+
+
+# End of file: ./crc32_test.py
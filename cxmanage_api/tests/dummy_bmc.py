@@ -80,6 +80,7 @@ class DummyBMC(Dummy):
         self.ipaddr_base = '192.168.100.1'
         self.unique_guid = 'FAKEGUID%s' % DummyBMC.GUID_UNIQUE
         self.sel = DummyBMC.generate_sel(with_errors=False)
+        self.sel_clears = 0
 
         DummyBMC.GUID_UNIQUE += 1
 
@@ -95,6 +96,22 @@ class DummyBMC(Dummy):
         """ List SEL. with_errors=True simulates a SEL that contains errors """
         return self.sel
 
+    def sel_info(self):
+        """ Get SEL info """
+        if self.sel:
+            last_add_time = " ".join(
+                x.strip() for x in self.sel[-1].split("|")[1:3]
+            )
+        else:
+            last_add_time = "Pre-Init"
+        return Result(entries=len(self.sel), last_add_time=last_add_time,
+                      last_del_time="Clear #%i" % self.sel_clears)
+
+    def sel_clear(self):
+        """ Clear SEL """
+        self.sel = []
+        self.sel_clears += 1
+
     @staticmethod
     def generate_sel(with_errors=False):
         """ Generates a SEL table for a Node """
@@ -44,6 +44,7 @@ class DummyIPRetriever(object):
         self.aggressive = aggressive
         self.verbosity = verbosity
         self.server_ip = None
+        self.server_mac = None
         for name, value in kwargs.iteritems():
             setattr(self, name, value)
 
@@ -54,3 +55,4 @@ class DummyIPRetriever(object):
             raise IPDiscoveryError("DummyIPRetriever.run() was called twice!")
         self.executed = True
         self.server_ip = "192.168.200.1"
+        self.server_mac = "fc:2f:40:00:00:00"
@@ -72,7 +72,7 @@ class DummyNode(Dummy):
         """Returns the chasis ID."""
         return self._chassis_id
 
-    def get_sel(self):
+    def get_sel(self, incremental=False):
         """Simulate get_sel()"""
         return self.sel
 
@@ -84,6 +84,10 @@ class DummyNode(Dummy):
         """Simulate get_power_policy(). """
         return "always-off"
 
+    def wait_for_mc_reset(self, timeout=300):
+        """Simulate wait_for_mc_reset(). """
+        return random.uniform(15, 30)
+
     def get_sensors(self, name=""):
         """Simulate get_sensors(). """
         power_value = "%f (+/- 0) Watts" % random.uniform(0, 10)
@@ -92,7 +96,8 @@ class DummyNode(Dummy):
                 TestSensor("Node Power", power_value),
                 TestSensor("Board Temp", temp_value)
         ]
-        return [s for s in sensors if name.lower() in s.sensor_name.lower()]
+        return dict((s.sensor_name, s) for s in sensors
+                if name.lower() in s.sensor_name.lower())
 
     def get_boot_order(self):
         """Simulate get_boot_order(). """
@@ -133,7 +138,8 @@ class DummyNode(Dummy):
         """Simulates get_fabric_ipinfo(). """
         return {}
 
-    def get_server_ip(self, interface=None, ipv6=False, aggressive=False):
+    def get_server_ip(self, interface=None, ipv6=False, aggressive=False,
+                      cache=None, mac_addresses=None):
         """Simulate get_server_ip(). """
         return "192.168.200.1"
 
@@ -144,7 +150,7 @@ class DummyNode(Dummy):
             result[node] = {}
             for port in range(3):
                 address = "00:00:00:00:%02x:%02x" % (node, port)
-                result[node][port] = address
+                result[node][port] = [address]
         return result
 
     def get_fabric_uplink_info(self):
@@ -0,0 +1,226 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: fabric_parsers_test.py """
+
+import unittest
+
+from cxmanage_api import fabric_parsers
+from cxmanage_api.cx_exceptions import ParseError
+
+
+NUM_NODES = 4096
+
+
+def synthetic_ipinfo(num_nodes=NUM_NODES):
+    """ Generate fabric_config_get_ip_info output for a large fabric """
+    return "".join("Node %i: 10.%i.%i.%i\n" % (i, i >> 16, (i >> 8) & 0xff,
+                   i & 0xff) for i in xrange(num_nodes))
+
+
+def synthetic_macaddrs(num_nodes=NUM_NODES):
+    """ Generate fabric_config_get_mac_addresses output for a large fabric """
+    return "".join(
+        "Node %i, Port %i: fc:2f:40:%02x:%02x:%02x\n" % (i, port, i >> 8,
+        i & 0xff, port) for i in xrange(num_nodes) for port in xrange(3)
+    )
+
+
+def synthetic_uplink_info(num_nodes=NUM_NODES):
+    """ Generate fabric_config_get_uplink_info output for a large fabric """
+    return "".join("Node %i: eth0 %i, eth1 %i, mgmt %i\n" % (i, i % 4,
+                   (i + 1) % 4, (i + 2) % 4) for i in xrange(num_nodes))
+
+
+def synthetic_routing_table(num_nodes=NUM_NODES):
+    """ Generate fabric_info_get_routing_table output for a large fabric """
+    return "".join("Node %i: rt - 0.%i.0.%i.%i\n" % (i, i % 3, i % 5, i % 7)
+                   for i in xrange(num_nodes))
+
+
+def synthetic_depth_chart(num_nodes=NUM_NODES):
+    """ Generate fabric_info_get_depth_chart output for a large fabric """
+    return "".join(
+        "Node %i: Shortest Distance %i hops via neighbor %i: "
+        "other hops/neighbors - %i/%i, %i/%i\n" % (i, i % 16, (i + 1) % 16,
+        i % 16 + 1, (i + 2) % 16, i % 16 + 2, (i + 3) % 16)
+        for i in xrange(num_nodes)
+    )
+
+
+class FabricParsersTest(unittest.TestCase):
+    """ Test the fabric TFTP output parsers """
+    def test_ipinfo(self):
+        """ Test parse_ipinfo """
+        self.assertEqual(
+            fabric_parsers.parse_ipinfo(
+                "Node 0: 10.20.1.9\n\nNode 1: 10.20.2.131\nNode 0.1: 10.0.0.5"
+            ),
+            {0: "10.20.1.9", 1: "10.20.2.131", "0.1": "10.0.0.5"}
+        )
+
+    def test_ipinfo_errors(self):
+        """ Test parse_ipinfo with invalid IP addresses and lines """
+        contents = "Node 0: 10.20.1.9\nNode 1: 0.0.0.0\nNode 2: 10.20.300.1\n"
+        self.assertRaises(ParseError, fabric_parsers.parse_ipinfo, contents)
+        self.assertEqual(
+            fabric_parsers.parse_ipinfo(contents, allow_errors=True),
+            {0: "10.20.1.9"}
+        )
+        self.assertRaises(ParseError, fabric_parsers.parse_ipinfo,
+                          "Node 0: 10.20.1.9\nNode 1:\n", True)
+
+    def test_macaddrs(self):
+        """ Test parse_macaddrs """
+        self.assertEqual(
+            fabric_parsers.parse_macaddrs(
+                "Node 0, Port 0: fc:2f:40:ab:cd:cc\n"
+                "Node 0, Port 0: fc:2f:40:ab:cd:cf\n"
+                "Node 0, Port 1: fc:2f:40:ab:cd:cd\n"
+                "Node 10, Port 2: 0:0:0:0:a:2\n"
+            ),
+            {0: {0: ["fc:2f:40:ab:cd:cc", "fc:2f:40:ab:cd:cf"],
+                 1: ["fc:2f:40:ab:cd:cd"]},
+             10: {2: ["0:0:0:0:a:2"]}}
+        )
+
+    def test_macaddrs_errors(self):
+        """ Test parse_macaddrs with invalid MAC addresses and lines """
+        for line in ["Node 0, Port 0: fc:2f:40:ab:cd",
+                     "Node 0, Port 0: fc:2f:40:ab:cd:1cc",
+                     "Node 0, Port 0: fc:2f:40:ab:cd:cg",
+                     "Node 0, Port x: fc:2f:40:ab:cd:cc",
+                     "Node 0"]:
+            self.assertRaises(ParseError, fabric_parsers.parse_macaddrs,
+                              "Node 0, Port 1: fc:2f:40:ab:cd:cd\n" + line)
+
+    def test_uplink_info(self):
+        """ Test parse_uplink_info, including multi-digit node IDs """
+        self.assertEqual(
+            fabric_parsers.parse_uplink_info(
+                "Node 1: eth0 0, eth1 0, mgmt 0\n"
+                "Node 12: eth0 1, eth1 2, mgmt 3\n"
+            ),
+            {1: {"eth0": 0, "eth1": 0, "mgmt": 0},
+             12: {"eth0": 1, "eth1": 2, "mgmt": 3}}
+        )
+        self.assertRaises(ParseError, fabric_parsers.parse_uplink_info,
+                          "Uplink 1: eth0 0\n")
+
+    def test_link_stats(self):
+        """ Test parse_link_stats """
+        self.assertEqual(
+            fabric_parsers.parse_link_stats(
+                "Packet Counts for Link 3:\n"
+                "pFS_LCn_CFG_0(link) = 0x1030d07f\n"
+                "pFS_LCn_STATE = 0x1033\n", link=3
+            ),
+            {"FS_LC3_CFG_0": "0x1030d07f", "FS_LC3_STATE": "0x1033"}
+        )
+
+        # Like the old parsing: an empty value is kept, and anything after
+        # a second "=" is ignored
+        self.assertEqual(
+            fabric_parsers.parse_link_stats(
+                "pFS_LCn_CFG_1 =\npFS_LCn_STATE = 0x1033 = up\n", link=0
+            ),
+            {"FS_LC0_CFG_1": "", "FS_LC0_STATE": "0x1033"}
+        )
+
+    def test_linkmap(self):
+        """ Test parse_linkmap """
+        self.assertEqual(
+            fabric_parsers.parse_linkmap("Link 1: Node 2\nLink 3: Node 1\n"
+                                         "Link 4: Node 13\n"),
+            {1: 2, 3: 1, 4: 13}
+        )
+
+    def test_routing_table(self):
+        """ Test parse_routing_table """
+        self.assertEqual(
+            fabric_parsers.parse_routing_table(
+                "Node 1: rt - 0.2.0.3.2\nNode 12: rt - 0.2.0.0.1\n"
+            ),
+            {1: [0, 2, 0, 3, 2], 12: [0, 2, 0, 0, 1]}
+        )
+
+    def test_depth_chart(self):
+        """ Test parse_depth_chart, including multiple other neighbors """
+        self.assertEqual(
+            fabric_parsers.parse_depth_chart(
+                "Node 1: Shortest Distance 0 hops via neighbor 0: "
+                "other hops/neighbors -\n"
+                "Node 4: Shortest Distance 2 hops via neighbor 6: "
+                "other hops/neighbors - 3/7\n"
+                "Node 12: Shortest Distance 4 hops via neighbor 14: "
+                "other hops/neighbors - 5/15, 6/11\n"
+            ),
+            {1: {"shortest": (0, 0)},
+             4: {"shortest": (6, 2), "others": [(7, 3)]},
+             12: {"shortest": (14, 4), "others": [(15, 5), (11, 6)]}}
+        )
+
+
+class FabricParsersLargeTest(unittest.TestCase):
+    """ Parse synthetic outputs for a 4096-node fabric """
+
+    def test_ipinfo(self):
+        """ Test parse_ipinfo on a full fabric """
+        contents = synthetic_ipinfo()
+        self.assertEqual(len(fabric_parsers.parse_ipinfo(contents)),
+                         NUM_NODES)
+
+    def test_macaddrs(self):
+        """ Test parse_macaddrs on a full fabric's MAC table """
+        contents = synthetic_macaddrs()
+        result = fabric_parsers.parse_macaddrs(contents)
+        self.assertEqual(len(result), NUM_NODES)
+        self.assertEqual(result[4095][2], ["fc:2f:40:0f:ff:02"])
+
+    def test_uplink_info(self):
+        """ Test parse_uplink_info on a full fabric """
+        contents = synthetic_uplink_info()
+        self.assertEqual(fabric_parsers.parse_uplink_info(contents)[4095],
+                         {"eth0": 3, "eth1": 0, "mgmt": 1})
+
+    def test_routing_table(self):
+        """ Test parse_routing_table on a full fabric """
+        contents = synthetic_routing_table()
+        self.assertEqual(len(fabric_parsers.parse_routing_table(contents)),
+                         NUM_NODES)
+
+    def test_depth_chart(self):
+        """ Test parse_depth_chart on a full fabric """
+        contents = synthetic_depth_chart()
+        result = fabric_parsers.parse_depth_chart(contents)
+        self.assertEqual(len(result), NUM_NODES)
+        self.assertEqual(len(result[17]["others"]), 2)
+
+# End of file: ./fabric_parsers_test.py
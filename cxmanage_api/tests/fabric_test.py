@@ -33,11 +33,15 @@
 
 """Calxeda: fabric_test.py """
 
+import time
 import random
 import unittest
+from threading import Lock
 from mock import call
 
+from cxmanage_api import temp_file
 from cxmanage_api.fabric import Fabric
+from cxmanage_api.server_ip_cache import ServerIPCache
 from cxmanage_api.tftp import InternalTftp, ExternalTftp
 from cxmanage_api.firmware_package import FirmwarePackage
 from cxmanage_api.cx_exceptions import CommandFailedError
@@ -102,6 +106,17 @@ class FabricTest(unittest.TestCase):
             [call.fabric_config_set_uplink(iface=iface, uplink=uplink)]
         )
 
+    def test_wait_for_mc_reset(self):
+        """ Test wait_for_mc_reset command """
+        self.fabric.mc_reset()
+        results = self.fabric.wait_for_mc_reset(timeout=60)
+        self.assertEqual(sorted(results), sorted(self.fabric.nodes))
+        self.assertTrue(all(15 <= x <= 30 for x in results.values()))
+        for node in self.nodes:
+            self.assertEqual(node.method_calls, [
+                call.mc_reset(False), call.wait_for_mc_reset(60)
+            ])
+
     def test_get_sensors(self):
         """ Test get_sensors command """
         self.fabric.get_sensors()
@@ -111,6 +126,15 @@ class FabricTest(unittest.TestCase):
                 call.get_sensors(""), call.get_sensors("Node Power")
             ])
 
+    def test_get_sel(self):
+        """ Test get_sel command """
+        self.fabric.get_sel()
+        self.fabric.get_sel(incremental=True)
+        for node in self.nodes:
+            self.assertEqual(node.method_calls, [
+                call.get_sel(False), call.get_sel(True)
+            ])
+
     def test_get_firmware_info(self):
         """ Test get_firmware_info command """
         self.fabric.get_firmware_info()
@@ -132,7 +156,7 @@ class FabricTest(unittest.TestCase):
         self.fabric.update_firmware(package)
         for node in self.nodes:
             self.assertEqual(node.method_calls, [
-                call.update_firmware(package, "INACTIVE", None)
+                call.update_firmware(package, "INACTIVE", None, False)
             ])
 
     def test_config_reset(self):
@@ -191,14 +215,85 @@ class FabricTest(unittest.TestCase):
                 node.method_calls, [call.ipmitool_command(ipmitool_args)]
             )
 
+    def test_ipmitool_batch(self):
+        """ Test ipmitool_batch command """
+        commands = [["power", "status"], ["mc", "info"]]
+        self.fabric.ipmitool_batch(commands, ["-I", "lanplus"])
+        for node in self.nodes:
+            self.assertEqual(
+                node.method_calls,
+                [call.ipmitool_batch(commands, ["-I", "lanplus"])]
+            )
+
     def test_get_server_ip(self):
         """ Test get_server_ip command """
-        self.fabric.get_server_ip("interface", "ipv6", "aggressive")
+        self.fabric.get_server_ip("interface", "ipv6", "aggressive",
+                                  use_cache=False)
         for node in self.nodes:
             self.assertEqual(node.method_calls,
-                [call.get_server_ip("interface", "ipv6", "aggressive")]
+                [call.get_server_ip("interface", "ipv6", "aggressive", None,
+                                    None)]
             )
 
+    def test_get_server_ip_cache(self):
+        """ Test that get_server_ip validates cached IPs with the MAC table
+        """
+        cache = ServerIPCache(temp_file())
+        self.fabric.get_server_ip(cache=cache)
+        self.assertEqual(self.nodes[0].method_calls[0],
+                         call.get_fabric_macaddrs())
+        for node_id, node in enumerate(self.nodes):
+            mac_addresses = [
+                "00:00:00:00:%02x:%02x" % (node_id, x) for x in range(3)
+            ]
+            self.assertEqual(node.method_calls[-1],
+                call.get_server_ip(None, False, False, cache, mac_addresses)
+            )
+
+    def test_get_server_ip_by_mac(self):
+        """ Test get_server_ip_by_mac command """
+        address_map = dict(
+            ("00:00:00:00:%02x:01" % i, "192.168.200.%i" % i)
+            for i in range(len(self.nodes))
+        )
+        results = self.fabric.get_server_ip_by_mac(address_map)
+        self.assertEqual(results, dict(
+            (i, "192.168.200.%i" % i) for i in range(len(self.nodes))
+        ))
+        self.assertEqual(self.nodes[0].method_calls,
+                         [call.get_fabric_macaddrs()])
+        for node in self.nodes[1:]:
+            self.assertEqual(node.method_calls, [])
+
+        del address_map["00:00:00:00:00:01"]
+        try:
+            self.fabric.get_server_ip_by_mac(address_map)
+            self.fail()
+        except CommandFailedError as err:
+            self.assertEqual(err.errors.keys(), [0])
+
+    def test_get_server_ip_sessions(self):
+        """ Test that get_server_ip bounds the number of SOL sessions """
+        lock = Lock()
+        active = [0, 0]
+
+        def get_server_ip(*args):
+            """ Count how many of these are running at once """
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return "192.168.200.1"
+
+        for node in self.nodes:
+            node.get_server_ip.side_effect = get_server_ip
+
+        results = self.fabric.get_server_ip(max_sessions=2)
+        self.assertEqual(len(results), len(self.nodes))
+        self.assertEqual(active[1], 2)
+
     def test_failed_command(self):
         """ Test a failed command """
         fail_nodes = [DummyFailNode(i) for i in DummyNode.ip_addresses]
@@ -0,0 +1,218 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: firmware_package_test.py """
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from mock import patch
+
+from cxmanage_api import image
+from cxmanage_api.cx_exceptions import InvalidImageError
+from cxmanage_api.firmware_package import FirmwarePackage
+from cxmanage_api.tests import random_file
+
+MANIFEST = """[package]
+required_cxmanage_version = 0.1.0
+firmware_version = ECX-1000-v1.0.0
+firmware_config = default
+
+[soc.bin]
+type = raw
+daddr = 1000
+versionstr = v1.0.0
+
+[cdb.bin]
+type = raw
+skip_crc32 = true
+"""
+
+
+class FirmwarePackageTest(unittest.TestCase):
+    """ Tests involving firmware packages """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="cxmanage_fwpkg_test-")
+        self.filename = self._make_package()
+        FirmwarePackage.clear_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+        FirmwarePackage.clear_cache()
+
+    def test_read_package(self):
+        """ Test reading a package """
+        package = FirmwarePackage(self.filename)
+        self.assertEqual(package.version, "ECX-1000-v1.0.0")
+        self.assertEqual(package.config, "default")
+
+        # The options come from the MANIFEST alone
+        images = package.images
+        self.assertEqual([x.type for x in images], ["RAW", "RAW"])
+        self.assertEqual(images[0].daddr, 0x1000)
+        self.assertEqual(images[0].version, "v1.0.0")
+        self.assertTrue(images[1].skip_crc32)
+        self.assertEqual(str(images[0]), "Image soc.bin (RAW)")
+        self.assertEqual(os.listdir(package.work_dir), [])
+
+        # Each image is extracted the first time it's used
+        self.assertEqual(open(images[0].filename).read(),
+                         open(os.path.join(self.work_dir, "soc.bin")).read())
+        self.assertEqual(os.listdir(package.work_dir), ["soc.bin"])
+        images[1].get_sha1()
+        self.assertEqual(sorted(os.listdir(package.work_dir)),
+                         ["cdb.bin", "soc.bin"])
+
+    def test_package_cache(self):
+        """ Test that packages with the same contents are only read once """
+        with patch("cxmanage_api.firmware_package.Image",
+                   wraps=image.Image) as image_class:
+            first = FirmwarePackage(self.filename)
+            first_images = first.images
+
+            # Same contents under another name
+            copy = os.path.join(self.work_dir, "copy.tar.gz")
+            shutil.copy(self.filename, copy)
+            second = FirmwarePackage(copy)
+
+            self.assertEqual(second.work_dir, first.work_dir)
+            self.assertEqual(image_class.call_count, 0)
+            self.assertEqual([x.filename for x in second.images],
+                             [x.filename for x in first_images])
+            self.assertEqual(image_class.call_count, 2)
+
+            # Each package gets its own list and images
+            second.images[0].version = "v2.0.0"
+            self.assertEqual(first.images[0].version, "v1.0.0")
+            second.images.pop()
+            self.assertEqual(len(first.images), 2)
+
+            # Different contents
+            other = FirmwarePackage(self._make_package("other.tar.gz"))
+            self.assertNotEqual(other.work_dir, first.work_dir)
+            [x.filename for x in other.images]
+            self.assertEqual(image_class.call_count, 4)
+
+    def test_invalid_manifest_option(self):
+        """ Test that a bad MANIFEST option is reported when the package is
+        read """
+        filename = self._make_package("bad.tar.gz", manifest=MANIFEST.replace(
+            "daddr = 1000", "daddr = xyz"
+        ))
+        with patch("tarfile.open", wraps=tarfile.open) as tar_open:
+            self.assertRaises(ValueError, FirmwarePackage, filename)
+            self.assertRaises(ValueError, FirmwarePackage, filename)
+            self.assertEqual(tar_open.call_count, 1)
+
+    def test_invalid_image(self):
+        """ Test that a bad image is only extracted and validated once """
+        filename = self._make_package("bad.tar.gz", manifest=MANIFEST.replace(
+            "type = raw\nskip_crc32", "type = cdb\nskip_crc32"
+        ))
+        package = FirmwarePackage(filename)
+        with patch("tarfile.open", wraps=tarfile.open) as tar_open:
+            self.assertRaises(InvalidImageError, getattr,
+                              package.images[1], "filename")
+            self.assertEqual(tar_open.call_count, 1)
+
+            # The failure is cached, not extracted again
+            self.assertRaises(InvalidImageError, getattr,
+                              FirmwarePackage(filename).images[1], "filename")
+            self.assertEqual(tar_open.call_count, 1)
+
+            # The other image is fine
+            self.assertTrue(os.path.exists(package.images[0].filename))
+
+    def test_extract_error(self):
+        """ Test that a failed extraction is retried """
+        package = FirmwarePackage(self.filename)
+        with patch("tarfile.TarFile.extract",
+                   side_effect=IOError(28, "No space left on device")):
+            self.assertRaises(IOError, getattr, package.images[0], "filename")
+        self.assertTrue(os.path.exists(package.images[0].filename))
+
+    def test_save_package(self):
+        """ Test saving packages that share their contents """
+        first = FirmwarePackage(self.filename)
+        second = FirmwarePackage(self.filename)
+        second.images[0].version = "v2.0.0"
+
+        first_filename = os.path.join(self.work_dir, "first.tar.gz")
+        second_filename = os.path.join(self.work_dir, "second.tar.gz")
+        first.save_package(first_filename)
+        second.save_package(second_filename)
+        self.assertNotIn("MANIFEST", os.listdir(first.work_dir))
+
+        FirmwarePackage.clear_cache()
+        self.assertEqual(FirmwarePackage(first_filename).images[0].version,
+                         "v1.0.0")
+        self.assertEqual(FirmwarePackage(second_filename).images[0].version,
+                         "v2.0.0")
+
+    def test_invalid_package(self):
+        """ Test reading invalid packages """
+        filename = os.path.join(self.work_dir, "invalid.tar.gz")
+        open(filename, "w").write("not a tarball")
+        self.assertRaises(ValueError, FirmwarePackage, filename)
+
+        filename = self._make_package("no_manifest.tar.gz", manifest=None)
+        self.assertRaises(ValueError, FirmwarePackage, filename)
+
+        self.assertRaises(ValueError, FirmwarePackage,
+                          os.path.join(self.work_dir, "missing.tar.gz"))
+
+    def test_required_version(self):
+        """ Test a package that needs a newer cxmanage """
+        filename = self._make_package("new.tar.gz", manifest=MANIFEST.replace(
+            "required_cxmanage_version = 0.1.0",
+            "required_cxmanage_version = 999.0.0"
+        ))
+        self.assertRaises(ValueError, FirmwarePackage, filename)
+
+    def _make_package(self, name="package.tar.gz", manifest=MANIFEST):
+        """ Create a firmware package with two random images """
+        filename = os.path.join(self.work_dir, name)
+        tar = tarfile.open(filename, "w:gz")
+        if manifest != None:
+            manifest_filename = os.path.join(self.work_dir, "MANIFEST")
+            open(manifest_filename, "w").write(manifest)
+            tar.add(manifest_filename, "MANIFEST")
+        for image_name in ["soc.bin", "cdb.bin"]:
+            image_filename = os.path.join(self.work_dir, image_name)
+            shutil.move(random_file(1024), image_filename)
+            tar.add(image_filename, image_name)
+        tar.close()
+        return filename
+
+
+# End of file: ./firmware_package_test.py
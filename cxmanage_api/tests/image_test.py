@@ -36,7 +36,11 @@ import os
 import shutil
 import tempfile
 import unittest
+from threading import Thread
+from mock import patch
 
+from cxmanage_api import simg
+from cxmanage_api.image import Image
 from cxmanage_api.simg import get_simg_header
 from cxmanage_api.tftp import InternalTftp
 from cxmanage_api.tests import random_file, TestImage
@@ -75,6 +79,58 @@ class ImageTest(unittest.TestCase):
         self.assertEqual(header.daddr, daddr)
         self.assertEqual(simg[header.imgoff:], contents)
 
+    def test_render_cache(self):
+        """ Test that identical renders are built once and shared """
+        filename = random_file(1024)
+        image = TestImage(filename, "RAW")
+
+        # Copy of the same image, under another name
+        copy_filename = os.path.join(self.work_dir, "copy.bin")
+        shutil.copy(filename, copy_filename)
+        copy = TestImage(copy_filename, "RAW")
+
+        with patch("cxmanage_api.image.create_simg_file",
+                   wraps=simg.create_simg_file) as create_simg:
+            first = image.render_to_simg(1, 0)
+            self.assertEqual(image.render_to_simg(1, 0), first)
+            self.assertEqual(copy.render_to_simg(1, 0), first)
+            self.assertEqual(create_simg.call_count, 1)
+
+            # Different header parameters get a different SIMG
+            second = image.render_to_simg(2, 0)
+            self.assertNotEqual(second, first)
+            self.assertEqual(get_simg_header(open(second).read()).priority, 2)
+            self.assertEqual(create_simg.call_count, 2)
+
+            # Rebuild files that have gone missing
+            os.remove(first)
+            rebuilt = image.render_to_simg(1, 0)
+            self.assertTrue(os.path.exists(rebuilt))
+            self.assertEqual(create_simg.call_count, 3)
+
+            Image.clear_render_cache()
+            image.render_to_simg(1, 0)
+            self.assertEqual(create_simg.call_count, 4)
+
+    def test_render_cache_threads(self):
+        """ Test that concurrent renders of one image only build it once """
+        image = TestImage(random_file(1024 * 1024), "RAW")
+        results = []
+
+        with patch("cxmanage_api.image.create_simg_file",
+                   wraps=simg.create_simg_file) as create_simg:
+            threads = [Thread(target=lambda: results.append(
+                image.render_to_simg(1, 0)
+            )) for _ in xrange(16)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(create_simg.call_count, 1)
+
+        self.assertEqual(len(results), 16)
+        self.assertEqual(len(set(results)), 1)
+
     @staticmethod
     def test_multiple_uploads():
         """ Test to make sure FDs are being closed """
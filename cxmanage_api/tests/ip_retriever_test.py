@@ -0,0 +1,155 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: ip_retriever_test.py """
+
+import unittest
+from mock import Mock, PropertyMock, patch
+
+from cxmanage_api.ip_retriever import IPRetriever
+from cxmanage_api.cx_exceptions import IPDiscoveryError
+
+
+class IPRetrieverTest(unittest.TestCase):
+    """ Tests the IPRetriever class """
+
+    def setUp(self):
+        self.bmc = Mock()
+        self.session = self.bmc.activate_payload.return_value
+        self.retriever = IPRetriever("10.0.0.1", bmc=self.bmc, timeout=1)
+        self.retriever.poll_interval = 0
+
+    @patch("cxmanage_api.ip_retriever.sleep")
+    @patch("cxmanage_api.ip_retriever.Server")
+    def test_find_ip(self, server, sleep):
+        """ Test that SOL discovery waits on output rather than sleeping """
+        server.return_value.is_powered = True
+
+        # SOL Session operational, then at a prompt, then ifconfig output
+        self.session.expect.side_effect = [10, 0, 0]
+        self.session.readline.side_effect = [
+            "          inet addr:10.0.0.100  Bcast:10.0.0.255\n", "\n", "\n"
+        ]
+
+        self.retriever.run()
+        self.assertEqual(self.retriever.server_ip, "10.0.0.100")
+        self.assertEqual(self.bmc.activate_payload.call_count, 1)
+        self.assertEqual(self.bmc.deactivate_payload.call_count, 1)
+        self.assertFalse(sleep.called)
+
+    @patch("cxmanage_api.ip_retriever.Server")
+    def test_find_ip_interfaces(self, server):
+        """ Test that the address and MAC come from the same interface """
+        server.return_value.is_powered = True
+
+        # Neither eth0 nor eth1 has an address, and eth2's block starts
+        # within the lines read for eth1
+        self.session.expect.side_effect = [10, 0, 0, 0]
+        self.session.readline.side_effect = [
+            ":Ethernet  HWaddr 00:11:22:33:44:55\n",
+            "          UP BROADCAST MULTICAST  MTU:1500  Metric:1\n",
+            "          RX packets:0 errors:0 dropped:0 overruns:0 frame:0\n",
+            ":Ethernet  HWaddr 00:11:22:33:44:AA\n",
+            "\n",
+            "eth2      Link encap:Ethernet  HWaddr 00:11:22:33:44:BB\n",
+            "          inet addr:10.0.0.100  Bcast:10.0.0.255\n",
+            "          UP BROADCAST MULTICAST  MTU:1500  Metric:1\n",
+            "          RX packets:0 errors:0 dropped:0 overruns:0 frame:0\n"
+        ]
+
+        self.retriever.run()
+        self.assertEqual(self.retriever.server_ip, "10.0.0.100")
+        self.assertEqual(self.retriever.server_mac, "00:11:22:33:44:bb")
+
+        # A given interface without an address is an error
+        self.retriever.set_interface("eth0")
+        self.session.expect.side_effect = [10, 0, 0]
+        self.session.readline.side_effect = [
+            ":Ethernet  HWaddr 00:11:22:33:44:55\n",
+            "          UP BROADCAST MULTICAST  MTU:1500  Metric:1\n",
+            "          RX packets:0 errors:0 dropped:0 overruns:0 frame:0\n"
+        ]
+        self.assertRaises(IPDiscoveryError, self.retriever.sol_try_command,
+                          self.retriever.sol_find_ip)
+
+    @patch("cxmanage_api.ip_retriever.sleep")
+    @patch("cxmanage_api.ip_retriever.Server")
+    def test_restart_sol(self, server, sleep):
+        """ Test that a stale SOL session is given time to go away """
+        server.return_value.is_powered = True
+        calls = []
+        self.bmc.deactivate_payload.side_effect = \
+                lambda: calls.append("deactivate")
+        sleep.side_effect = lambda seconds: calls.append("sleep")
+
+        # SOL payload already active, then as in test_find_ip
+        self.session.expect.side_effect = [9, 10, 0, 0]
+        self.session.readline.side_effect = [
+            "          inet addr:10.0.0.100  Bcast:10.0.0.255\n", "\n", "\n"
+        ]
+
+        self.retriever.run()
+        self.assertEqual(self.retriever.server_ip, "10.0.0.100")
+        self.assertEqual(self.bmc.activate_payload.call_count, 2)
+        self.assertEqual(calls, ["deactivate", "sleep", "deactivate"])
+
+    @patch("cxmanage_api.ip_retriever.sleep")
+    @patch("cxmanage_api.ip_retriever.Server")
+    def test_power_server(self, server, sleep):
+        """ Test that power changes are polled for """
+        is_powered = PropertyMock(
+            side_effect=[True, True, False, False, False, True, True]
+        )
+        type(server.return_value).is_powered = is_powered
+
+        self.assertTrue(self.retriever._power_server(cycle=True))
+        self.assertEqual(server.return_value.power_off.call_count, 1)
+        self.assertEqual(server.return_value.power_on.call_count, 1)
+        self.assertEqual(sleep.call_count, 3)
+
+    @patch("cxmanage_api.ip_retriever.sleep")
+    @patch("cxmanage_api.ip_retriever.Server")
+    def test_power_server_timeout(self, server, sleep):
+        """ Test that a server that won't power off stops discovery """
+        server.return_value.is_powered = True
+        self.retriever.timeout = 0
+        self.assertFalse(self.retriever._power_server(cycle=True))
+        self.assertFalse(server.return_value.power_on.called)
+
+        # Power cycling is the last resort when nothing else works
+        self.retriever.aggressive = True
+        self.session.expect.return_value = 0
+        self.assertRaises(IPDiscoveryError, self.retriever.sol_try_command,
+                          lambda session: None)
+        self.assertEqual(server.return_value.power_off.call_count, 2)
+        self.assertEqual(self.bmc.deactivate_payload.call_count, 1)
+        self.assertFalse(sleep.called)
+
+# End of file: ./ip_retriever_test.py
@@ -32,15 +32,55 @@
 
 """Unit tests for the Node class."""
 
+import os
+import sys
+import time
 import shutil
 import tempfile
 import unittest
-from mock import call
+from mock import call, patch, Mock, ANY
 
 from cxmanage_api.tests import DummyBMC, DummyUbootEnv, DummyIPRetriever
 from cxmanage_api.tests import TestImage, random_file
-from cxmanage_api.node import Node
+from cxmanage_api.tests.dummy_bmc import Result
+from cxmanage_api.node import Node, _split_batch_output
+from cxmanage_api.cx_exceptions import IpmiError, TimeoutError, \
+        InvalidImageError, IPDiscoveryError, NoPartitionError
 from cxmanage_api.firmware_package import FirmwarePackage
+from cxmanage_api.server_ip_cache import ServerIPCache
+
+
+FAKE_IPMITOOL = """#!%s
+import os
+import shlex
+import sys
+
+def run(args):
+    if args[:2] == ["set", "hostname"]:
+        print "Set session hostname to %%s" %% args[2]
+    elif args[0] == "echo":
+        print " ".join(args[1:])
+    elif args[0] == "warn":
+        sys.stderr.write("Warning: %%s\\n" %% " ".join(args[1:]))
+        print "done"
+    elif args[0] == "fail":
+        sys.stderr.write("Error: %%s\\n" %% " ".join(args[1:]))
+        return 1
+    else:
+        sys.stderr.write("Invalid command: %%s\\n" %% args[0])
+        return 1
+    return 0
+
+args = sys.argv[7:]
+if args[0] == "exec":
+    if not "FAKE_IPMITOOL_NO_EXEC" in os.environ:
+        for line in open(args[1]):
+            run(shlex.split(line))
+            sys.stdout.flush()
+            sys.stderr.flush()
+else:
+    sys.exit(run(args))
+"""
 
 
 class NodeTest(unittest.TestCase):
@@ -122,6 +162,234 @@ class NodeTest(unittest.TestCase):
                 result["Board Temp"].sensor_reading.endswith("degrees C")
             )
 
+    def test_mc_reset(self):
+        """ Test node.mc_reset method """
+        for node in self.nodes:
+            node.mc_reset()
+            self.assertEqual(node.bmc.method_calls, [call.mc_reset("cold")])
+
+    def test_wait_for_mc_reset(self):
+        """ Test node.wait_for_mc_reset method """
+        for node in self.nodes:
+            # Up, up, down, down, down, up
+            node.bmc.get_info_basic.side_effect = [
+                None, None, IpmiError(), IpmiError(), IpmiError(), None
+            ]
+            node.mc_reset()
+            start = time.time()
+            duration = node.wait_for_mc_reset(interval=0.01,
+                                              max_interval=0.02)
+            self.assertEqual(node.bmc.get_info_basic.call_count, 6)
+            self.assertTrue(duration < 1)
+            self.assertTrue(time.time() - start < 1)
+            self.assertEqual(node.last_reset_duration, duration)
+
+    def test_wait_for_mc_reset_transient(self):
+        """ Test that one failed probe isn't mistaken for the reset """
+        node = self.nodes[0]
+        # Up, down, up, up, down, down, down, up
+        node.bmc.get_info_basic.side_effect = [
+            None, IpmiError(), None, None, IpmiError(), IpmiError(),
+            IpmiError(), None
+        ]
+        node.mc_reset()
+        node.wait_for_mc_reset(interval=0.01, max_interval=0.02)
+        self.assertEqual(node.bmc.get_info_basic.call_count, 8)
+
+    def test_wait_for_mc_reset_stale(self):
+        """ Test that an old mc_reset doesn't shorten a later wait """
+        node = self.nodes[0]
+        node.mc_reset()
+        node._mc_reset_time -= 1000
+        node.bmc.get_info_basic.side_effect = [
+            IpmiError(), IpmiError(), IpmiError(), None
+        ]
+        node.wait_for_mc_reset(timeout=10, interval=0.01, max_interval=0.02)
+        self.assertEqual(node.bmc.get_info_basic.call_count, 4)
+        self.assertTrue(node.last_reset_duration < 1)
+        self.assertEqual(node._mc_reset_time, None)
+
+    def test_wait_for_mc_reset_fast(self):
+        """ Test wait_for_mc_reset when the node never appears to go down """
+        for node in self.nodes:
+            node.mc_reset()
+            node.wait_for_mc_reset(down_timeout=0.05, interval=0.01)
+            self.assertTrue(node.last_reset_duration < 1)
+
+    def test_wait_for_mc_reset_timeout(self):
+        """ Test wait_for_mc_reset when the node doesn't come back """
+        node = self.nodes[0]
+        node.bmc.get_info_basic.side_effect = IpmiError()
+        node.mc_reset()
+        self.assertRaises(TimeoutError, node.wait_for_mc_reset, timeout=0.2,
+                          interval=0.01, max_interval=0.05)
+
+    def test_ipmitool_batch(self):
+        """ Test node.ipmitool_batch method """
+        node = self.nodes[0]
+        with patch.dict(os.environ, {"IPMITOOL_PATH": self._fake_ipmitool()}):
+            result = node.ipmitool_batch([
+                ["echo", "hello world"], ["fail", "oops"], ["echo", "#1"],
+                ["warn", "slow"]
+            ])
+            self.assertEqual(result, [
+                ("hello world\n", "", 0), ("", "Error: oops\n", 1),
+                ("#1\n", "", 0), ("done\n", "Warning: slow\n", 0)
+            ])
+            self.assertEqual(node.ipmitool_batch([]), [])
+
+    def test_ipmitool_batch_fallback(self):
+        """ Test node.ipmitool_batch without a working exec mode """
+        node = self.nodes[0]
+        with patch.dict(os.environ, {
+            "IPMITOOL_PATH": self._fake_ipmitool(), "FAKE_IPMITOOL_NO_EXEC": "1"
+        }):
+            result = node.ipmitool_batch([["echo", "a"], ["fail", "b"]])
+            self.assertEqual(result, [("a\n", "", 0), ("", "Error: b\n", 1)])
+
+    def test_ipmitool_batch_quoting(self):
+        """ Test that ipmitool_batch refuses arguments it can't quote """
+        node = self.nodes[0]
+        with patch.dict(os.environ, {"IPMITOOL_PATH": self._fake_ipmitool()}):
+            self.assertEqual(node.ipmitool_batch([["echo", "a b", "#"]]),
+                             [("a b #\n", "", 0)])
+            self.assertRaises(ValueError, node.ipmitool_batch,
+                              [["echo", 'say "hi"']])
+            self.assertRaises(ValueError, node.ipmitool_batch,
+                              [["echo", "two\nlines"]])
+
+    def test_split_batch_output(self):
+        """ Test splitting ipmitool_batch output at the markers """
+        self.assertEqual(
+            _split_batch_output("M\nM\nx\nM\n\nM\n", 2), ["x\n", "\n"]
+        )
+        self.assertEqual(
+            _split_batch_output("A\nB\nA\nB\nA\nB\n", 1), [""]
+        )
+        self.assertEqual(_split_batch_output("M\nM\nx\n", 1), None)
+        self.assertEqual(_split_batch_output("", 1), None)
+
+    def _fake_ipmitool(self):
+        """ Write a fake ipmitool that understands exec mode """
+        filename = os.path.join(self.work_dir, "ipmitool")
+        with open(filename, "w") as script:
+            script.write(FAKE_IPMITOOL % sys.executable)
+        os.chmod(filename, 0755)
+        return filename
+
+    def test_get_sel(self):
+        """ Test node.get_sel method """
+        for node in self.nodes:
+            result = node.get_sel()
+            self.assertEqual(node.bmc.method_calls, [call.sel_elist()])
+            self.assertEqual(result, node.bmc.sel)
+
+    def test_get_sel_incremental(self):
+        """ Test node.get_sel method with incremental fetches """
+        def sel_tail(args):
+            """ Simulate "ipmitool sel elist last <count>" """
+            return "\n".join(node.bmc.sel[-int(args[-1]):])
+
+        with patch("cxmanage_api.sel_log.DEFAULT_SEL_DIR", self.work_dir):
+            for node in self.nodes:
+                node.ipmitool_command = Mock(side_effect=sel_tail)
+                original = list(node.bmc.sel)
+
+                # First fetch gets everything
+                self.assertEqual(node.get_sel(incremental=True), original)
+                self.assertEqual(node.bmc.sel_elist.call_count, 1)
+                self.assertFalse(node.ipmitool_command.called)
+
+                # Nothing new, nothing fetched
+                self.assertEqual(node.get_new_sel_entries(), [])
+                self.assertEqual(node.bmc.sel_elist.call_count, 1)
+                self.assertFalse(node.ipmitool_command.called)
+
+                # Only new entries are fetched, with one entry of overlap
+                new = ["a0 | 11/15/2013 | 10:00:00 | Watchdog 2 | Hard reset",
+                       "a1 | 11/15/2013 | 10:00:05 | System Event |"]
+                node.bmc.sel.extend(new)
+                self.assertEqual(node.get_new_sel_entries(), new)
+                node.ipmitool_command.assert_called_once_with(
+                    ["sel", "elist", "last", "3"]
+                )
+                self.assertEqual(node.bmc.sel_elist.call_count, 1)
+                self.assertEqual(node.get_sel(incremental=True),
+                                 original + new)
+
+                # A cleared SEL is fetched again, and the old entries kept
+                node.bmc.sel_clear()
+                node.bmc.sel.append(
+                    "1 | 11/16/2013 | 08:00:00 | System Event |"
+                )
+                self.assertEqual(node.get_new_sel_entries(), node.bmc.sel)
+                self.assertEqual(node.bmc.sel_elist.call_count, 2)
+                self.assertEqual(node.get_sel(incremental=True),
+                                 original + new + node.bmc.sel)
+
+    def test_get_sel_fallback(self):
+        """ Test that a full SEL fetch doesn't log entries twice """
+        def bad_sel_tail(args):
+            """ Return an overlap entry that doesn't match the log """
+            return "\n".join(
+                ["ff | 11/14/2013 | 09:00:00 | System Event |"] +
+                node.bmc.sel[-int(args[-1]) + 1:]
+            )
+
+        with patch("cxmanage_api.sel_log.DEFAULT_SEL_DIR", self.work_dir):
+            node = self.nodes[0]
+            node.ipmitool_command = Mock(side_effect=bad_sel_tail)
+            original = list(node.bmc.sel)
+            self.assertEqual(node.get_sel(incremental=True), original)
+
+            new = ["a0 | 11/15/2013 | 10:00:00 | Watchdog 2 | Hard reset"]
+            node.bmc.sel.extend(new)
+            self.assertEqual(node.get_new_sel_entries(), new)
+            self.assertEqual(node.bmc.sel_elist.call_count, 2)
+            self.assertEqual(node.get_sel(incremental=True), original + new)
+
+            # Record IDs from before a clear are used again
+            node.bmc.sel_clear()
+            cleared = ["1 | 11/16/2013 | 08:00:00 | System Event |",
+                       "2 | 11/16/2013 | 08:00:05 | System Event |"]
+            node.bmc.sel.extend(cleared)
+            self.assertEqual(node.get_new_sel_entries(), cleared)
+
+            reused = ["88 | 11/17/2013 | 09:00:00 | Watchdog 2 | Hard reset"]
+            node.bmc.sel.extend(reused)
+            self.assertEqual(node.get_new_sel_entries(), reused)
+            self.assertEqual(node.bmc.sel_elist.call_count, 4)
+            self.assertEqual(node.get_sel(incremental=True),
+                             original + new + cleared + reused)
+
+    def test_check_firmware_tftp(self):
+        """ Test that node._check_firmware probes TFTP cheaply """
+        filename = "%s/%s" % (self.work_dir, "image.bin")
+        open(filename, "w").write("")
+        package = FirmwarePackage()
+        package.images = [TestImage(filename, "SOC_ELF")]
+
+        node = self.nodes[0]
+        node._check_firmware(package)
+        self.assertIn(call.fabric_config_get_ip_info(
+            filename=ANY, tftp_addr=node.tftp_address
+        ), node.bmc.method_calls)
+        for partition in node.bmc.partitions:
+            self.assertEqual(partition.retrieves, 0)
+
+        # Without fabric TFTP commands, download the smallest partition
+        node.bmc.fabric_config_get_ip_info = Mock(side_effect=IpmiError())
+        node._check_firmware(package)
+        self.assertEqual(
+            [x.retrieves for x in node.bmc.partitions], [0, 0, 0, 0, 0, 1, 0]
+        )
+
+        # Nothing to download if every partition is empty
+        for partition in node.bmc.partitions:
+            partition.fwinfo.size = "%8x" % 0
+        self.assertRaises(NoPartitionError, node._check_tftp,
+                          node.bmc.get_firmware_info())
+
     def test_is_updatable(self):
         """ Test node.is_updatable method """
         for node in self.nodes:
@@ -206,6 +474,193 @@ class NodeTest(unittest.TestCase):
 
             node.bmc.set_firmware_version.assert_called_once_with("0.0.1")
 
+        # Images staged on the TFTP server are released after each transfer
+        self.assertEqual(os.listdir(DummyBMC.tftp.staging_dir), [])
+
+    def test_update_firmware_pipelined(self):
+        """ Test that node.update_firmware renders the next image early """
+        filename = "%s/%s" % (self.work_dir, "image.bin")
+        open(filename, "w").write("")
+
+        package = FirmwarePackage()
+        package.images = [
+            TestImage(filename, "SOC_ELF"),
+            TestImage(filename, "CDB"),
+            TestImage(filename, "UBOOTENV")
+        ]
+
+        node = self.nodes[0]
+        transfer_image = node._transfer_image
+        renders_seen = []
+
+        def transfer(filename, partition, image_type):
+            """ Wait for the next render, then do the transfer """
+            expected = min(transfer_mock.call_count + 1, 4)
+            deadline = time.time() + 5
+            while (render_mock.call_count < expected and
+                    time.time() < deadline):
+                time.sleep(0.01)
+            renders_seen.append(render_mock.call_count)
+            transfer_image(filename, partition, image_type)
+
+        with patch.object(node, "_render_image",
+                          wraps=node._render_image) as render_mock:
+            with patch.object(node, "_transfer_image",
+                              side_effect=transfer) as transfer_mock:
+                node.update_firmware(package)
+
+        self.assertEqual(renders_seen, [2, 3, 4, 4])
+        for partition in [node.bmc.partitions[x] for x in [2, 3, 5, 6]]:
+            self.assertEqual(partition.updates, 1)
+            self.assertEqual(partition.activates, 1)
+
+    def test_update_firmware_render_error(self):
+        """ Test node.update_firmware when an image can't be rendered """
+        filename = "%s/%s" % (self.work_dir, "image.bin")
+        open(filename, "w").write("")
+
+        package = FirmwarePackage()
+        package.images = [
+            TestImage(filename, "SOC_ELF"),
+            TestImage(filename, "CDB")
+        ]
+        package.images[1].render_to_simg = Mock(
+            side_effect=InvalidImageError("bad image")
+        )
+
+        node = self.nodes[0]
+        self.assertRaises(InvalidImageError, node.update_firmware, package)
+        self.assertEqual(node.bmc.partitions[2].updates, 1)
+        self.assertEqual(node.bmc.partitions[3].updates, 0)
+        self.assertFalse(node.bmc.set_firmware_version.called)
+
+    def test_update_firmware_transfer_error(self):
+        """ Test that a failed transfer waits for the render in progress """
+        filename = "%s/%s" % (self.work_dir, "image.bin")
+        open(filename, "w").write("")
+
+        package = FirmwarePackage()
+        package.images = [
+            TestImage(filename, "SOC_ELF"),
+            TestImage(filename, "CDB")
+        ]
+
+        node = self.nodes[0]
+        render_image = node._render_image
+        rendered = []
+
+        def render(*args):
+            """ Render slowly, and note when done """
+            time.sleep(0.2)
+            result = render_image(*args)
+            rendered.append(result)
+            return result
+
+        with patch.object(node, "_render_image", side_effect=render):
+            with patch.object(node, "_transfer_image",
+                              side_effect=IpmiError("transfer failed")):
+                self.assertRaises(IpmiError, node.update_firmware, package)
+                self.assertEqual(len(rendered), 2)
+
+    def test_update_firmware_delta(self):
+        """ Test node.update_firmware with delta updates """
+        filename = "%s/%s" % (self.work_dir, "image.bin")
+        open(filename, "w").write("CDBH")
+
+        package = FirmwarePackage()
+        package.images = [
+            TestImage(filename, "SOC_ELF", version="v0.0.0"),
+            TestImage(filename, "CDB", version="v0.0.0"),
+            TestImage(filename, "UBOOTENV", version="v0.0.0")
+        ]
+        images = dict((x.type, x) for x in package.images)
+
+        for node in self.nodes:
+            # Everything but partition 3 (the newest CDB) is up to date
+            node.bmc.partitions[3].fwinfo.priority = "%8x" % 1
+
+            def check_firmware(partition_id):
+                """ Report the partition's crc32 """
+                fwinfo = node.bmc.partitions[partition_id].fwinfo
+                image = images[fwinfo.type.split()[1][1:-1]]
+                crc32 = image.get_crc32(int(fwinfo.priority, 16),
+                                        int(fwinfo.daddr, 16))
+                if partition_id == 3:
+                    crc32 ^= 1
+                return Result(crc32="%08x" % crc32, error=None)
+            node.bmc.check_firmware = Mock(side_effect=check_firmware)
+
+            node.update_firmware(package, delta=True)
+
+            partitions = node.bmc.partitions
+            for partition in [partitions[x] for x in [0, 1, 2, 4, 5, 6]]:
+                self.assertEqual(partition.updates, 0)
+                self.assertEqual(partition.retrieves, 0)
+                self.assertEqual(partition.activates, 0)
+            self.assertEqual(partitions[3].updates, 1)
+            self.assertEqual(partitions[3].activates, 1)
+
+    def test_update_firmware_delta_rebooted(self):
+        """ Test that delta updates skip images the node already boots """
+        filename = "%s/%s" % (self.work_dir, "image.bin")
+        open(filename, "w").write("CDBH")
+
+        package = FirmwarePackage()
+        package.images = [
+            TestImage(filename, "SOC_ELF", version="v0.0.0"),
+            TestImage(filename, "CDB", version="v0.0.0")
+        ]
+        images = dict((x.type, x) for x in package.images)
+
+        node = self.nodes[0]
+        # After an update and a reboot, the active partitions are the newest
+        # and the inactive partitions still hold the previous build.
+        for partition_id in [0, 1]:
+            node.bmc.partitions[partition_id].fwinfo.priority = "%8x" % 1
+        for partition_id in [2, 3]:
+            node.bmc.partitions[partition_id].fwinfo.version = "v0.0.-1"
+
+        def check_firmware(partition_id):
+            """ Report the partition's crc32 """
+            fwinfo = node.bmc.partitions[partition_id].fwinfo
+            image = images[fwinfo.type.split()[1][1:-1]]
+            crc32 = image.get_crc32(int(fwinfo.priority, 16),
+                                    int(fwinfo.daddr, 16))
+            return Result(crc32="%08x" % crc32, error=None)
+        node.bmc.check_firmware = Mock(side_effect=check_firmware)
+
+        node.update_firmware(package, delta=True)
+
+        for partition in node.bmc.partitions[:4]:
+            self.assertEqual(partition.updates, 0)
+            self.assertEqual(partition.activates, 0)
+
+        # Without delta, the inactive partitions still get updated
+        node.update_firmware(package)
+        for partition in node.bmc.partitions[2:4]:
+            self.assertEqual(partition.updates, 1)
+
+    def test_update_firmware_delta_version(self):
+        """ Test that delta updates don't skip images of other versions """
+        filename = "%s/%s" % (self.work_dir, "image.bin")
+        open(filename, "w").write("")
+
+        package = FirmwarePackage()
+        package.images = [
+            TestImage(filename, "SOC_ELF", version="v0.0.1"),
+            TestImage(filename, "CDB", version="v0.0.1")
+        ]
+
+        node = self.nodes[0]
+        node.update_firmware(package, delta=True)
+
+        # check_firmware only runs for the post-verify
+        partitions = node.bmc.partitions
+        for partition in [partitions[2], partitions[3]]:
+            self.assertEqual(partition.updates, 1)
+            self.assertEqual(partition.checks, 2)
+            self.assertEqual(partition.activates, 1)
+
     def test_config_reset(self):
         """ Test node.config_reset method """
         for node in self.nodes:
@@ -335,6 +790,7 @@ class NodeTest(unittest.TestCase):
 
     def test_get_fabric_ipinfo(self):
         """ Test node.get_fabric_ipinfo method """
+        tftp_files = os.listdir(DummyBMC.tftp.tftp_dir)
         for node in self.nodes:
             result = node.get_fabric_ipinfo()
 
@@ -343,6 +799,23 @@ class NodeTest(unittest.TestCase):
             self.assertEqual(result, dict([(i, DummyBMC.ip_addresses[i])
                     for i in range(len(DummyBMC.ip_addresses))]))
 
+        # Results are received into memory, leaving no files behind
+        self.assertEqual(os.listdir(DummyBMC.tftp.tftp_dir), tftp_files)
+
+    def test_get_fabric_ipinfo_error(self):
+        """ Test that a failed fabric command stops expecting its upload """
+        # pylint: disable=W0212
+        uploads = dict(DummyBMC.tftp._uploads)
+        spooled = dict(DummyBMC.tftp._spooled)
+
+        node = self.nodes[0]
+        node.bmc.fabric_config_get_ip_info = Mock(side_effect=IpmiError())
+        self.assertRaises(IpmiError, node.get_fabric_ipinfo)
+        self.assertTrue(node.bmc.fabric_config_get_ip_info.called)
+
+        self.assertEqual(DummyBMC.tftp._uploads, uploads)
+        self.assertEqual(DummyBMC.tftp._spooled, spooled)
+
     def test_get_fabric_macaddrs(self):
         """ Test node.get_fabric_macaddrs method """
         for node in self.nodes:
@@ -399,12 +872,120 @@ class NodeTest(unittest.TestCase):
             node.get_link_stats()
             self.assertTrue(node.bmc.fabric_get_linkstats.called)
 
+    def test_read_fru(self):
+        """ Test node.read_fru method """
+        Node.clear_fru_cache()
+        for node in self.nodes:
+            node.ipmitool_command = Mock(side_effect=IpmiError)
+            result = node.read_fru(99)
+            self.assertEqual(len(result), 3 * 516 + 3 + 3 * 7673)
+            self.assertEqual(node.read_fru(99, 3 * 516, 3), "0.0")
+            self.assertEqual(node.read_fru(99, 3 * 516 + 3), "x00" * 7673)
+            self.assertEqual(node.bmc.fru_read.call_count, 1)
+
+            # Bypassing the cache reads the FRU again
+            self.assertEqual(node.read_fru(99, use_cache=False), result)
+            self.assertEqual(node.bmc.fru_read.call_count, 2)
+
+            # Small reads fell back from ranged reads once, then gave up
+            self.assertEqual(node.ipmitool_command.call_count, 0)
+            self.assertEqual(node.read_fru(98, 0, 16), "x00" * 5 + "x")
+            self.assertEqual(node.ipmitool_command.call_count, 1)
+            self.assertEqual(node.read_fru(97, 0, 16), "x00" * 5 + "x")
+            self.assertEqual(node.ipmitool_command.call_count, 1)
+
+    def test_read_fru_range(self):
+        """ Test ranged reads in node.read_fru """
+        contents = "x00" * 516 + "0.0" + "x00" * 7673
+
+        def read_fru_data(args):
+            """ Simulate ipmitool raw Read FRU Data commands """
+            offset = int(args[4], 16) + (int(args[5], 16) << 8)
+            data = contents[offset:offset + int(args[6])]
+            return " ".join("%02x" % ord(x) for x in chr(len(data)) + data)
+
+        Node.clear_fru_cache()
+        for node in self.nodes:
+            node.ipmitool_command = Mock(side_effect=read_fru_data)
+            self.assertEqual(node.read_fru(99, 3 * 516, 3), "0.0")
+            self.assertEqual(node.read_fru(99, 1000, 100),
+                             contents[1000:1100])
+            self.assertEqual(node.ipmitool_command.call_count, 1 + 4)
+            self.assertEqual(node.read_fru(99, len(contents) - 10, 100),
+                             contents[-10:])
+            self.assertFalse(node.bmc.fru_read.called)
+
     def test_get_server_ip(self):
         """ Test node.get_server_ip method """
         for node in self.nodes:
             result = node.get_server_ip()
             self.assertEqual(result, "192.168.200.1")
 
+    def test_get_server_ip_cache(self):
+        """ Test node.get_server_ip with a ServerIPCache """
+        path = os.path.join(self.work_dir, "server_ips.json")
+        cache = ServerIPCache(path)
+        mac_addresses = ["fc:2f:40:00:00:00", "fc:2f:40:00:00:01"]
+        node = self.nodes[0]
+
+        # Found over SOL, then stored
+        self.assertEqual(node.get_server_ip(cache=cache), "192.168.200.1")
+        self.assertEqual(
+            ServerIPCache(path).lookup(node.guid), "192.168.200.1"
+        )
+
+        # Taken from the cache while the MAC address is still there
+        node.ipretriever = Mock()
+        self.assertEqual(
+            node.get_server_ip(cache=cache, mac_addresses=mac_addresses),
+            "192.168.200.1"
+        )
+        self.assertFalse(node.ipretriever.called)
+
+        # Or checked against a fabric MAC table that was already read
+        node.get_fabric_macaddrs = Mock()
+        self.assertEqual(
+            node.get_server_ip(
+                cache=cache, mac_table={node.node_id: {0: mac_addresses}}
+            ),
+            "192.168.200.1"
+        )
+        self.assertFalse(node.get_fabric_macaddrs.called)
+        self.assertFalse(node.ipretriever.called)
+
+        # Found over SOL again once it's gone
+        node.ipretriever = Mock(side_effect=DummyIPRetriever)
+        self.assertEqual(
+            node.get_server_ip(cache=cache, mac_addresses=mac_addresses[1:]),
+            "192.168.200.1"
+        )
+        self.assertTrue(node.ipretriever.called)
+
+    def test_get_server_ip_by_mac(self):
+        """ Test node.get_server_ip_by_mac method """
+        for node in self.nodes:
+            address_map = {
+                "00:00:00:00:%02x:02" % node.node_id: "192.168.200.1"
+            }
+            self.assertEqual(node.get_server_ip_by_mac(address_map),
+                             "192.168.200.1")
+            self.assertRaises(IPDiscoveryError, node.get_server_ip_by_mac,
+                              address_map, 1)
+
+        # With a fabric MAC table that was already read
+        node = self.nodes[0]
+        node.get_fabric_macaddrs = Mock()
+        mac_table = {node.node_id: {0: ["fc:2f:40:00:00:00"]}}
+        self.assertEqual(
+            node.get_server_ip_by_mac({"fc:2f:40:00:00:00": "192.168.200.2"},
+                                      mac_table=mac_table),
+            "192.168.200.2"
+        )
+        self.assertRaises(IPDiscoveryError, node.get_server_ip_by_mac,
+                          {"fc:2f:40:00:00:00": "192.168.200.2"},
+                          mac_table={})
+        self.assertFalse(node.get_fabric_macaddrs.called)
+
     def test_get_linkspeed(self):
         """ Test node.get_linkspeed method """
         for node in self.nodes:
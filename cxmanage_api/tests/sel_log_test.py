@@ -0,0 +1,166 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: sel_log_test.py """
+
+import time
+import unittest
+
+from cxmanage_api.fabric import Fabric
+from cxmanage_api.sel_log import SELRecord, SELIndex, parse_sel_entry, \
+        parse_sel
+from cxmanage_api.tests import DummyNode
+
+
+def local_time(*args):
+    """ Get the epoch time for a local date and time """
+    return time.mktime(args + (0, 0, -1))
+
+
+class SELParserTest(unittest.TestCase):
+    """ Test parsing of SEL entries """
+    def test_parse_entry(self):
+        """ Test parsing a complete entry """
+        record = parse_sel_entry(
+            '  1a | 06/27/2013 | 20:25:35 | Watchdog 2 #0xfd | Hard reset | '
+            'Asserted', 3
+        )
+        self.assertEqual(record, SELRecord(
+            3, 0x1a, local_time(2013, 6, 27, 20, 25, 35), "Watchdog 2 #0xfd",
+            "Hard reset", "Asserted"
+        ))
+
+    def test_parse_short_entry(self):
+        """ Test parsing entries without an event or direction """
+        record = parse_sel_entry(
+            '1 | 06/21/2013 | 16:13:31 | System Event #0xf4 |'
+        )
+        self.assertEqual(record.node_id, None)
+        self.assertEqual(record.sensor, "System Event #0xf4")
+        self.assertEqual(record.event, "")
+        self.assertEqual(record.direction, None)
+
+    def test_parse_pre_init(self):
+        """ Test parsing entries logged before the clock was set """
+        record = parse_sel_entry(
+            '2 | Pre-Init | 0000000012 | System Event #0xf4 | '
+            'Timestamp Clock Sync | Asserted'
+        )
+        self.assertEqual(record.timestamp, None)
+        self.assertEqual(record.event, "Timestamp Clock Sync")
+
+    def test_parse_garbage(self):
+        """ Test that non-SEL lines are skipped """
+        self.assertEqual(parse_sel_entry("SEL has no entries"), None)
+        self.assertEqual(parse_sel(["", "SEL has no entries",
+            "1 | 06/21/2013 | 16:13:31 | System Event #0xf4 |"]),
+            [SELRecord(None, 1, local_time(2013, 6, 21, 16, 13, 31),
+                       "System Event #0xf4", "", None)])
+
+
+class SELIndexTest(unittest.TestCase):
+    """ Test the SELIndex class """
+    def setUp(self):
+        self.base = local_time(2013, 11, 14, 0, 0, 0)
+        self.index = SELIndex()
+        for node_id in range(4096):
+            entries = [
+                "1 | 11/14/2013 | 00:00:%02i | System Boot Initiated | "
+                "Initiated by power up | Asserted" % (node_id % 60),
+                "2 | 11/14/2013 | 01:%02i:00 | System Event #0xf4 |"
+                % (node_id % 60)
+            ]
+            if node_id % 512 == 7:
+                entries.append("3 | 11/14/2013 | 02:30:00 | Watchdog 2 "
+                               "#0xfd | Hard reset | Asserted")
+            if node_id % 1024 == 9:
+                entries.append("4 | 11/14/2013 | 05:00:00 | Watchdog 2 "
+                               "#0xfd | Hard reset | Asserted")
+            self.assertEqual(self.index.add(entries, node_id), len(entries))
+
+    def test_len(self):
+        """ Test that every record was indexed """
+        self.assertEqual(len(self.index), 4096 * 2 + 8 + 4)
+        self.assertEqual(len(self.index.sensors), 3)
+
+    def test_query_sensor_and_time(self):
+        """ Test finding watchdog resets within a window across 4k nodes """
+        start = time.time()
+        records = self.index.query(sensor="watchdog", event="hard reset",
+                since=self.base + 2 * 3600, until=self.base + 3 * 3600)
+        self.assertTrue(time.time() - start < 1)
+
+        self.assertEqual([x.node_id for x in records],
+                         [7 + 512 * x for x in range(8)])
+        self.assertTrue(all(x.record_id == 3 for x in records))
+
+    def test_query_time(self):
+        """ Test time range queries and ordering """
+        records = self.index.query(since=self.base + 3600)
+        times = [x.timestamp for x in records]
+        self.assertEqual(times, sorted(times))
+        self.assertEqual(len(records), 4096 + 12)
+        self.assertEqual(records[-1].event, "Hard reset")
+        self.assertEqual(self.index.query(until=self.base - 1), [])
+
+    def test_query_node(self):
+        """ Test node queries """
+        records = self.index.query(node_id=[9, 10])
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[-1].timestamp, self.base + 5 * 3600)
+        self.assertEqual(len(self.index.query(node_id=9, sensor="watchdog",
+                                              direction="Asserted")), 1)
+        self.assertEqual(self.index.query(node_id=9999), [])
+
+    def test_pre_init(self):
+        """ Test that undated records only match untimed queries """
+        self.index.add(["5 | Pre-Init | 0000000012 | System Event #0xf4 | "
+                        "Timestamp Clock Sync | Asserted"], 0)
+        records = self.index.query(node_id=0)
+        self.assertEqual(records[-1].timestamp, None)
+        self.assertTrue(all(x.timestamp is not None for x in
+                            self.index.query(node_id=0, since=0)))
+
+
+class FabricSELIndexTest(unittest.TestCase):
+    """ Test building a SELIndex from a fabric """
+    def test_get_sel_index(self):
+        """ Test Fabric.get_sel_index() """
+        fabric = Fabric(DummyNode.ip_addresses[0], node=DummyNode)
+        nodes = [DummyNode(i) for i in DummyNode.ip_addresses]
+        for node_id, node in enumerate(nodes):
+            node.sel.append("%x | 11/14/2013 | 18:02:29 | Watchdog 2 #0xfd | "
+                            "Hard reset | Asserted" % node_id)
+        fabric._nodes = dict(enumerate(nodes))
+
+        index = fabric.get_sel_index()
+        records = index.query(sensor="watchdog")
+        self.assertEqual([x.node_id for x in records], range(len(nodes)))
+        self.assertEqual([x.record_id for x in records], range(len(nodes)))
@@ -0,0 +1,138 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: server_ip_cache_test.py """
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from cxmanage_api.server_ip_cache import ServerIPCache, read_arp_table
+
+
+ARP_TABLE = """\
+IP address       HW type     Flags       HW address            Mask     Device
+10.0.0.100       0x1         0x2         FC:2F:40:00:00:01     *        eth0
+10.0.0.101       0x1         0x0         00:00:00:00:00:00     *        eth0
+"""
+
+
+class ServerIPCacheTest(unittest.TestCase):
+    """ Tests the ServerIPCache class """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="cxmanage_ip_cache_test-")
+        self.path = os.path.join(self.work_dir, "cache", "server_ips.json")
+        self.arp_path = os.path.join(self.work_dir, "arp")
+        with open(self.arp_path, "w") as arp_file:
+            arp_file.write(ARP_TABLE)
+        self.patcher = patch(
+            "cxmanage_api.server_ip_cache.ARP_TABLE", self.arp_path
+        )
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_store(self):
+        """ Test that entries are kept per GUID and interface, on disk """
+        cache = ServerIPCache(self.path)
+        self.assertEqual(cache.lookup("guid"), None)
+
+        cache.store("guid", "10.0.0.100", "fc:2f:40:00:00:01")
+        cache.store("guid", "10.0.1.100", "fc:2f:40:00:00:02", "eth1")
+        cache.store("guid", "fe80::1", "fc:2f:40:00:00:02", "eth1", True)
+
+        cache = ServerIPCache(self.path)
+        self.assertEqual(cache.lookup("guid"), "10.0.0.100")
+        self.assertEqual(cache.lookup("guid", "eth1"), "10.0.1.100")
+        self.assertEqual(cache.lookup("guid", "eth1", True), "fe80::1")
+        self.assertEqual(cache.lookup("guid", "eth2"), None)
+        self.assertEqual(cache.lookup("other"), None)
+
+        cache.remove("guid", "eth1")
+        self.assertEqual(ServerIPCache(self.path).lookup("guid", "eth1"),
+                         None)
+        self.assertEqual(sorted(json.load(open(self.path))["guid"]),
+                         ["default", "eth1/ipv6"])
+
+    def test_validate(self):
+        """ Test that entries are checked against MAC addresses """
+        cache = ServerIPCache(self.path)
+        cache.store("guid", "10.0.0.100", "fc:2f:40:00:00:01")
+        self.assertEqual(
+            cache.lookup("guid", mac_addresses=["FC:2F:40:00:00:01"]),
+            "10.0.0.100"
+        )
+        self.assertEqual(
+            cache.lookup("guid", mac_addresses=["fc:2f:40:00:00:03"]), None
+        )
+
+        # The ARP table says someone else has this IP now
+        cache.store("guid", "10.0.0.100", "fc:2f:40:00:00:03")
+        self.assertEqual(
+            cache.lookup("guid", mac_addresses=["fc:2f:40:00:00:03"]), None
+        )
+
+        # The ARP table says this MAC has another IP now
+        cache.store("guid", "10.0.0.102", "fc:2f:40:00:00:01")
+        self.assertEqual(
+            cache.lookup("guid", mac_addresses=["fc:2f:40:00:00:01"]), None
+        )
+
+        # Incomplete ARP entries are ignored
+        cache.store("guid", "10.0.0.101", "fc:2f:40:00:00:03")
+        self.assertEqual(
+            cache.lookup("guid", mac_addresses=["fc:2f:40:00:00:03"]),
+            "10.0.0.101"
+        )
+
+    def test_bad_file(self):
+        """ Test that an unreadable cache is treated as empty """
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as cache_file:
+            cache_file.write("not json")
+        cache = ServerIPCache(self.path)
+        self.assertEqual(cache.lookup("guid"), None)
+        cache.store("guid", "10.0.0.100")
+        self.assertEqual(ServerIPCache(self.path).lookup("guid"), "10.0.0.100")
+
+    def test_read_arp_table(self):
+        """ Test reading the ARP table """
+        self.assertEqual(read_arp_table(self.arp_path),
+                         {"10.0.0.100": "fc:2f:40:00:00:01"})
+        self.assertEqual(read_arp_table(os.path.join(self.work_dir, "none")),
+                         {})
+
+# End of file: ./server_ip_cache_test.py
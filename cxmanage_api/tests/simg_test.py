@@ -0,0 +1,119 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: simg_test.py """
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from cxmanage_api.simg import create_simg, create_simg_file, get_simg_size, \
+        read_simg_header, has_simg_file, valid_simg_file, read_simg_contents
+from cxmanage_api.tests import random_file
+
+
+class SIMGTest(unittest.TestCase):
+    """ Tests involving the file-based SIMG functions """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="cxmanage_simg_test-")
+        self.filename = random_file(10000)
+        self.contents = open(self.filename).read()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+        os.remove(self.filename)
+
+    def test_create_simg_file(self):
+        """ Test that create_simg_file matches create_simg """
+        dest = os.path.join(self.work_dir, "image.simg")
+        for kwargs in [
+            {},
+            {"priority": 7, "daddr": 0x1000, "version": "v1.2.3"},
+            {"align": True},
+            {"skip_crc32": True}
+        ]:
+            # Use small chunks, to check crc32s that span chunks
+            with patch("cxmanage_api.simg.CHUNK_SIZE", 999):
+                header = create_simg_file(self.filename, dest, **kwargs)
+            expected = create_simg(self.contents, **kwargs)
+            self.assertEqual(open(dest).read(), expected)
+            self.assertEqual(str(header), expected[:len(str(header))])
+            self.assertEqual(get_simg_size(len(self.contents),
+                    kwargs.get("align", False)), len(expected))
+
+    def test_read_simg_header(self):
+        """ Test reading an SIMG header from a file """
+        dest = os.path.join(self.work_dir, "image.simg")
+        create_simg_file(self.filename, dest, priority=3, daddr=12345)
+
+        header = read_simg_header(dest)
+        self.assertEqual(header.priority, 3)
+        self.assertEqual(header.daddr, 12345)
+        self.assertEqual(header.imglen, len(self.contents))
+        self.assertTrue(has_simg_file(dest))
+
+        self.assertEqual(read_simg_header(self.filename), None)
+        self.assertFalse(has_simg_file(self.filename))
+
+    def test_valid_simg_file(self):
+        """ Test validating an SIMG file """
+        dest = os.path.join(self.work_dir, "image.simg")
+        create_simg_file(self.filename, dest)
+        with patch("cxmanage_api.simg.CHUNK_SIZE", 999):
+            self.assertTrue(valid_simg_file(dest))
+        self.assertFalse(valid_simg_file(self.filename))
+
+        # Corrupt the contents
+        simg = open(dest).read()
+        index = len(simg) - 1
+        open(dest, "w").write(simg[:index] + chr(ord(simg[index]) ^ 1))
+        self.assertFalse(valid_simg_file(dest))
+
+        # Truncate the contents
+        open(dest, "w").write(simg[:-1])
+        self.assertFalse(valid_simg_file(dest))
+
+        # No crc32 to check
+        create_simg_file(self.filename, dest, skip_crc32=True)
+        self.assertTrue(valid_simg_file(dest))
+
+    def test_read_simg_contents(self):
+        """ Test reading the contents of an SIMG file """
+        dest = os.path.join(self.work_dir, "image.simg")
+        create_simg_file(self.filename, dest, align=True)
+        self.assertEqual(read_simg_contents(dest), self.contents)
+        self.assertEqual(read_simg_contents(dest, 4), self.contents[:4])
+        self.assertRaises(ValueError, read_simg_contents, self.filename)
+
+
+# End of file: ./simg_test.py
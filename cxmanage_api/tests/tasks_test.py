@@ -35,6 +35,7 @@
 
 import unittest
 import time
+from mock import patch
 
 from cxmanage_api.tasks import TaskQueue
 
@@ -69,6 +70,32 @@ class TaskTest(unittest.TestCase):
 
         self.assertGreaterEqual(finish - start, 2.0)
 
+    def test_worker_handoff(self):
+        """ Test tasks put while the only worker is exiting """
+        task_queue = TaskQueue(threads=1)
+        counter = Counter()
+
+        # Stall the worker whenever it runs out of tasks
+        get_task = task_queue._get_or_remove_worker
+        def stalled_get_task():
+            """ Get a task, taking a while to exit """
+            task = get_task()
+            if task == None:
+                time.sleep(0.1)
+            return task
+
+        with patch.object(task_queue, "_get_or_remove_worker",
+                          side_effect=stalled_get_task):
+            for _ in xrange(5):
+                task = task_queue.put(counter.add, 1)
+                deadline = time.time() + 5
+                while task.is_alive() and time.time() < deadline:
+                    time.sleep(0.01)
+                self.assertFalse(task.is_alive())
+                time.sleep(0.05)
+
+        self.assertEqual(counter.value, 5)
+
 
 class Counter(object):
     """ Simple counter object for testing purposes """
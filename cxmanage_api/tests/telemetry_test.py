@@ -0,0 +1,182 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: telemetry_test.py """
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from cxmanage_api.fabric import Fabric
+from cxmanage_api.telemetry import SensorRingBuffer, SensorCollector, \
+        parse_sensor_reading
+from cxmanage_api.tests import DummyNode, DummyFailNode
+
+
+class ParseSensorReadingTest(unittest.TestCase):
+    """ Test parsing of sensor reading strings """
+    def test_parse(self):
+        """ Test numeric readings with and without tolerances """
+        self.assertEqual(parse_sensor_reading("5.016 (+/- 0) Watts"),
+                (5.016, "Watts"))
+        self.assertEqual(parse_sensor_reading("38 (+/- 1.5) degrees C"),
+                (38.0, "degrees C"))
+        self.assertEqual(parse_sensor_reading("-1.5 Volts"), (-1.5, "Volts"))
+        self.assertEqual(parse_sensor_reading("12"), (12.0, ""))
+
+    def test_parse_non_numeric(self):
+        """ Test readings that have no numeric value """
+        self.assertEqual(parse_sensor_reading("Unspecified"), (None, None))
+        self.assertEqual(parse_sensor_reading(""), (None, None))
+        self.assertEqual(parse_sensor_reading("0x00"), (None, None))
+        self.assertEqual(parse_sensor_reading("3e"), (None, None))
+        self.assertEqual(parse_sensor_reading("1.2.3 V"), (None, None))
+        self.assertEqual(parse_sensor_reading("12V"), (None, None))
+
+
+class SensorRingBufferTest(unittest.TestCase):
+    """ Test the SensorRingBuffer class """
+    def test_wraparound(self):
+        """ Test that the oldest samples are overwritten """
+        buf = SensorRingBuffer(4)
+        for i in range(10):
+            buf.append(i, i * 2)
+        self.assertEqual(len(buf), 4)
+        times, values = buf.samples()
+        self.assertEqual(list(times), [6.0, 7.0, 8.0, 9.0])
+        self.assertEqual(list(values), [12.0, 14.0, 16.0, 18.0])
+
+    def test_window(self):
+        """ Test that samples can be limited to a time window """
+        buf = SensorRingBuffer(8)
+        for i in range(12):
+            buf.append(i, i)
+        times, values = buf.samples(since=9)
+        self.assertEqual(list(times), [9.0, 10.0, 11.0])
+        self.assertEqual(list(values), [9.0, 10.0, 11.0])
+
+    def test_stats(self):
+        """ Test aggregate statistics """
+        buf = SensorRingBuffer(16, unit="Watts")
+        self.assertEqual(buf.get_stats(), None)
+        for i in range(11):
+            buf.append(i * 2, i * 10)
+        stats = buf.get_stats()
+        self.assertEqual(stats["count"], 11)
+        self.assertEqual(stats["min"], 0)
+        self.assertEqual(stats["max"], 100)
+        self.assertAlmostEqual(stats["mean"], 50)
+        self.assertAlmostEqual(stats["p50"], 50)
+        self.assertAlmostEqual(stats["p90"], 90)
+        self.assertAlmostEqual(stats["p99"], 99)
+        self.assertAlmostEqual(stats["rate"], 5)
+        self.assertEqual(stats["unit"], "Watts")
+
+
+class SensorCollectorTest(unittest.TestCase):
+    """ Test the SensorCollector class """
+    def setUp(self):
+        self.fabric = Fabric(DummyNode.ip_addresses[0], node=DummyNode)
+        self.nodes = [DummyNode(i) for i in DummyNode.ip_addresses]
+        self.fabric._nodes = dict((i, self.nodes[i])
+                for i in xrange(len(self.nodes)))
+        self.work_dir = tempfile.mkdtemp(prefix="cxmanage_test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_sample(self):
+        """ Test that samples land in per-sensor buffers """
+        collector = SensorCollector(self.fabric, capacity=4)
+        for _ in range(6):
+            self.assertEqual(collector.sample(), 2 * len(self.nodes))
+
+        self.assertEqual(len(collector.buffers), 2 * len(self.nodes))
+        for node_id in self.fabric.nodes:
+            stats = collector.get_stats(node_id, "Node Power")
+            self.assertEqual(stats["count"], 4)
+            self.assertEqual(stats["unit"], "Watts")
+            self.assertTrue(0 <= stats["min"] <= stats["max"] <= 10)
+
+        fabric_stats = collector.get_fabric_stats("Board Temp")
+        self.assertEqual(sorted(fabric_stats), sorted(self.fabric.nodes))
+        self.assertEqual(collector.get_stats(0, "Nonexistent"), None)
+
+    def test_search(self):
+        """ Test that only matching sensors are collected """
+        collector = SensorCollector(self.fabric, search="Node Power")
+        collector.sample()
+        self.assertTrue(all(name == "Node Power"
+                            for _, name in collector.buffers))
+
+    def test_partial_failure(self):
+        """ Test that failing nodes don't stop the others being sampled """
+        self.fabric._nodes[1] = DummyFailNode(self.nodes[1].ip_address)
+        self.fabric._nodes[1].get_sensors.side_effect = \
+                DummyFailNode.DummyFailError
+        collector = SensorCollector(self.fabric)
+        self.assertEqual(collector.sample(), 2 * (len(self.nodes) - 1))
+        self.assertEqual(collector.errors.keys(), [1])
+        self.assertEqual(collector.get_stats(1, "Node Power"), None)
+
+    def test_thread(self):
+        """ Test sampling in the background """
+        collector = SensorCollector(self.fabric, interval=0.01)
+        collector.start()
+        time.sleep(0.2)
+        collector.stop()
+        collector.join(5)
+        self.assertFalse(collector.is_alive())
+        self.assertTrue(collector.get_stats(0, "Node Power")["count"] > 1)
+
+    def test_export(self):
+        """ Test CSV and line protocol export """
+        collector = SensorCollector(self.fabric)
+        collector.sample()
+        collector.sample()
+
+        filename = os.path.join(self.work_dir, "sensors.csv")
+        collector.write_csv(filename)
+        lines = open(filename).read().splitlines()
+        self.assertEqual(lines[0], "timestamp,node,sensor,value,unit")
+        self.assertEqual(len(lines), 1 + 4 * len(self.nodes))
+        fields = lines[1].split(",")
+        self.assertEqual(fields[1:3], ["0", '"Board Temp"'])
+        self.assertEqual(fields[4], '"degrees C"')
+
+        filename = os.path.join(self.work_dir, "sensors.txt")
+        collector.write_line_protocol(filename)
+        lines = open(filename).read().splitlines()
+        self.assertEqual(len(lines), 4 * len(self.nodes))
+        self.assertTrue(lines[0].startswith(
+                r"sensor,node=0,sensor=Board\ Temp,unit=degrees\ C value="))
+        self.assertEqual(len(lines[0].split()[-1]), 19)
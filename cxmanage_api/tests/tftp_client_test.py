@@ -0,0 +1,368 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: tftp_client_test.py """
+
+import os
+import time
+import socket
+import struct
+import logging
+import unittest
+from threading import Thread
+
+import tftpy
+from mock import patch
+
+from cxmanage_api import temp_dir, tftp_client, tftp_server
+from cxmanage_api.tests import random_file
+from cxmanage_api.tftp_client import TftpClient, RetransmitTimer
+from cxmanage_api.tftp_metrics import TransferLog
+from cxmanage_api.tftp_server import TftpServer, DATA, ACK
+from cxmanage_api.cx_exceptions import TftpException
+
+
+class TftpClientTest(unittest.TestCase):
+    """ Tests the TftpClient against our own server """
+
+    def setUp(self):
+        self.root = temp_dir()
+        self.server_log = TransferLog()
+        self.server = TftpServer(self.root, ip_address="127.0.0.1",
+                                 timeout=0.2, transfer_log=self.server_log)
+        self.thread = Thread(target=self.server.serve_forever,
+                             kwargs={"poll_interval": 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        self.client_log = TransferLog()
+        self.client = TftpClient("127.0.0.1", self.server.port, timeout=0.2,
+                                 transfer_log=self.client_log)
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join()
+
+    def test_put_and_get(self):
+        """ Test transfers with negotiated options """
+        for size in [0, 1427, 1428, 100000]:
+            filename = random_file(size)
+            contents = open(filename).read()
+
+            stats = self.client.put_file(filename, "remote")
+            self.assertEqual((stats.direction, stats.size), ("send", size))
+            self.assertEqual((stats.blksize, stats.windowsize), (1428, 8))
+            self.assertEqual(
+                open(os.path.join(self.root, "remote")).read(), contents
+            )
+
+            stats = self.client.get_file("remote", filename)
+            self.assertEqual((stats.direction, stats.size),
+                             ("receive", size))
+            self.assertEqual((stats.blksize, stats.windowsize), (1428, 8))
+            self.assertEqual(stats.throughput > 0, size > 0)
+            self.assertEqual(open(filename).read(), contents)
+            os.remove(filename)
+
+    def test_server_limits(self):
+        """ Test that we use smaller values the server picks """
+        self.server.max_blksize = 1024
+        self.server.max_windowsize = 4
+        filename = random_file(10000)
+
+        stats = self.client.put_file(filename, "remote")
+        self.assertEqual((stats.blksize, stats.windowsize), (1024, 4))
+        stats = self.client.get_file("remote", filename)
+        self.assertEqual((stats.blksize, stats.windowsize), (1024, 4))
+        os.remove(filename)
+
+    def test_lost_packets(self):
+        """ Test that lost packets are sent again in both directions """
+        filename = random_file(50000)
+        contents = open(filename).read()
+
+        dropped = set()
+
+        def drop(send):
+            """ Drop DATA blocks 3 and 20 the first time they're sent """
+            def wrapper(obj, packet, *args):
+                """ Wrapped send """
+                opcode, block = struct.unpack("!HH", packet[:4])
+                if opcode == DATA and block in (3, 20) and \
+                        not (send, block) in dropped:
+                    dropped.add((send, block))
+                    return True
+                return send(obj, packet, *args)
+            return wrapper
+
+        # pylint: disable=W0212
+        with patch.object(tftp_client._Transfer, "_send",
+                          drop(tftp_client._Transfer._send)):
+            self.client.put_file(filename, "remote")
+        self.assertEqual(
+            open(os.path.join(self.root, "remote")).read(), contents
+        )
+        self.assertEqual(len(dropped), 2)
+
+        dest = random_file(0)
+        with patch.object(tftp_server._Session, "send",
+                          drop(tftp_server._Session.send)):
+            self.client.get_file("remote", dest)
+        self.assertEqual(open(dest).read(), contents)
+        self.assertEqual(len(dropped), 4)
+        for stats in self.client_log.get_records():
+            self.assertTrue(stats.retransmits > 0)
+        os.remove(filename)
+        os.remove(dest)
+
+    def test_lost_acks(self):
+        """ Test that lost ACKs are recovered from, including the ones that
+        make the server send its OACK again """
+        filename = random_file(50000)
+        contents = open(filename).read()
+        # One block per window, so a lost first block isn't followed by
+        # others, and wait long enough that the server's retransmits arrive
+        # first
+        client = TftpClient("127.0.0.1", self.server.port, windowsize=1)
+        client.timer = RetransmitTimer(1.0, minimum=1.0)
+
+        dropped = set()
+
+        def drop(send, packets):
+            """ Drop some packets the first time they're sent """
+            def wrapper(obj, packet, *args):
+                """ Wrapped send """
+                key = struct.unpack("!HH", packet[:4])
+                if key in packets and not key in dropped:
+                    dropped.add(key)
+                    return True
+                return send(obj, packet, *args)
+            return wrapper
+
+        # Lose our first block, then one of the server's ACKs
+        # pylint: disable=W0212
+        with patch.object(tftp_client._Transfer, "_send",
+                          drop(tftp_client._Transfer._send,
+                               [(DATA, 1)])):
+            with patch.object(tftp_server._Session, "send",
+                              drop(tftp_server._Session.send,
+                                   [(ACK, 24)])):
+                client.put_file(filename, "remote")
+        self.assertEqual(
+            open(os.path.join(self.root, "remote")).read(), contents
+        )
+        self.assertEqual(dropped, set([(DATA, 1), (ACK, 24)]))
+
+        # Lose our ACK of the OACK, then a later one
+        dest = random_file(0)
+        dropped.clear()
+        with patch.object(tftp_client._Transfer, "_send",
+                          drop(tftp_client._Transfer._send,
+                               [(ACK, 0), (ACK, 16)])):
+            client.get_file("remote", dest)
+        self.assertEqual(open(dest).read(), contents)
+        self.assertEqual(dropped, set([(ACK, 0), (ACK, 16)]))
+        os.remove(filename)
+        os.remove(dest)
+
+    def test_errors(self):
+        """ Test that server errors become TftpExceptions """
+        self.assertRaises(TftpException, self.client.get_file,
+                          "missing_file", random_file(0))
+        self.assertRaises(TftpException, self.client.put_file,
+                          random_file(10), "../outside")
+        self.assertTrue(self.client.use_options)
+
+        # Failures are recorded too
+        records = self.client_log.get_records()
+        self.assertEqual([x.direction for x in records], ["receive", "send"])
+        self.assertTrue(records[0].error.startswith("TFTP error 1"))
+        self.assertTrue(records[1].error.startswith("TFTP error 2"))
+
+    def test_transfer_log(self):
+        """ Test that both ends record each transfer """
+        filename = random_file(30000)
+        self.client.put_file(filename, "remote")
+        self.client.get_file("remote", filename)
+        os.remove(filename)
+
+        records = self.client_log.get_records()
+        self.assertEqual([(x.peer, x.direction, x.filename, x.size, x.blksize,
+                           x.windowsize, x.error) for x in records],
+                         [("127.0.0.1", "send", "remote", 30000, 1428, 8,
+                           None),
+                          ("127.0.0.1", "receive", "remote", 30000, 1428, 8,
+                           None)])
+
+        # The server records a session once it's over
+        deadline = time.time() + 5
+        while len(self.server_log) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        records = self.server_log.get_records()
+        self.assertEqual(sorted((x.direction, x.filename, x.size, x.error)
+                                for x in records),
+                         [("receive", "remote", 30000, None),
+                          ("send", "remote", 30000, None)])
+
+    def test_timeout(self):
+        """ Test that we give up on a server that doesn't answer """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        client = TftpClient("127.0.0.1", sock.getsockname()[1],
+                            timeout=0.01, retries=3, min_wait=0)
+        self.assertRaises(TftpException, client.get_file, "file",
+                          random_file(0))
+
+        # The last try goes without options
+        requests = []
+        for _ in range(4):
+            requests.append(sock.recv(1024))
+        self.assertTrue(all("windowsize" in x for x in requests[:3]))
+        self.assertFalse("windowsize" in requests[3])
+        sock.close()
+
+    def test_min_wait(self):
+        """ Test that we wait a while before giving up, even with short
+        timeouts """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        client = TftpClient("127.0.0.1", sock.getsockname()[1],
+                            timeout=0.01, retries=1, min_wait=0.5)
+        start = time.time()
+        self.assertRaises(TftpException, client.get_file, "file",
+                          random_file(0))
+        self.assertTrue(time.time() - start >= 0.5)
+
+        # It kept asking after running out of retries
+        sock.settimeout(0)
+        requests = 0
+        try:
+            while True:
+                sock.recv(1024)
+                requests += 1
+        except socket.error:
+            pass
+        self.assertTrue(requests > 2)
+        sock.close()
+
+
+class TftpClientFallbackTest(unittest.TestCase):
+    """ Tests the TftpClient against servers without our options """
+
+    def test_tftpy_server(self):
+        """ Test against tftpy's server, which doesn't do windowsize """
+        root = temp_dir()
+        server = tftpy.TftpServer(root)
+        tftpy.setLogLevel(logging.CRITICAL)
+        thread = Thread(target=server.listen, args=("127.0.0.1", 0))
+        thread.daemon = True
+        thread.start()
+        while getattr(server, "sock", None) == None:
+            pass
+        client = TftpClient("127.0.0.1", server.sock.getsockname()[1])
+
+        filename = random_file(20000)
+        contents = open(filename).read()
+        stats = client.put_file(filename, "remote")
+        self.assertEqual((stats.blksize, stats.windowsize), (1428, 1))
+        stats = client.get_file("remote", filename)
+        self.assertEqual((stats.blksize, stats.windowsize), (1428, 1))
+        self.assertEqual(open(filename).read(), contents)
+        server.stop(now=True)
+        os.remove(filename)
+
+    def test_options_refused(self):
+        """ Test falling back when a server refuses options """
+        root = temp_dir()
+        server = TftpServer(root, ip_address="127.0.0.1")
+        # pylint: disable=W0212
+        start_session = server._start_session
+        requests = []
+
+        def refuse_options(packet, address):
+            """ Refuse any request with options """
+            requests.append(packet)
+            if packet.count("\0") > 3:
+                if "broken" in packet:
+                    raise tftp_server._TftpError(0, "Server is broken")
+                raise tftp_server._TftpError(8, "No options")
+            return start_session(packet, address)
+
+        server._start_session = refuse_options
+        thread = Thread(target=server.serve_forever,
+                        kwargs={"poll_interval": 0.05})
+        thread.daemon = True
+        thread.start()
+
+        client = TftpClient("127.0.0.1", server.port)
+        filename = random_file(5000)
+        contents = open(filename).read()
+        stats = client.put_file(filename, "remote")
+        self.assertEqual((stats.blksize, stats.windowsize), (512, 1))
+        stats = client.get_file("remote", filename)
+        self.assertEqual(open(filename).read(), contents)
+
+        # Each request falls back on its own
+        self.assertTrue(client.use_options)
+        self.assertEqual(len(requests), 4)
+
+        # Other errors don't mean the options were refused
+        self.assertRaises(TftpException, client.get_file, "broken", filename)
+        self.assertEqual(len(requests), 5)
+
+        server.stop()
+        thread.join()
+        os.remove(filename)
+
+
+class RetransmitTimerTest(unittest.TestCase):
+    """ Tests the RetransmitTimer """
+
+    def test_timer(self):
+        """ Test RTO estimates, limits and backoff """
+        timer = RetransmitTimer(1.0, minimum=0.01, maximum=4.0)
+        self.assertEqual(timer.rto, 1.0)
+
+        timer.sample(0.1)
+        self.assertAlmostEqual(timer.srtt, 0.1)
+        self.assertAlmostEqual(timer.rto, 0.3)
+        for _ in range(50):
+            timer.sample(0.1)
+        self.assertAlmostEqual(timer.srtt, 0.1)
+        self.assertTrue(timer.rto < 0.11)
+
+        for _ in range(10):
+            timer.backoff()
+        self.assertEqual(timer.rto, 4.0)
+
+        for _ in range(50):
+            timer.sample(0.0001)
+        self.assertEqual(timer.rto, 0.01)
+
+# End of file: ./tftp_client_test.py
@@ -0,0 +1,90 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: tftp_metrics_test.py """
+
+import unittest
+
+from cxmanage_api.tftp_metrics import TransferLog, TransferStats
+
+
+class TransferLogTest(unittest.TestCase):
+    """ Tests the TransferLog class """
+
+    def test_capacity(self):
+        """ Test that the oldest records are dropped """
+        log = TransferLog(capacity=3)
+        for i in range(5):
+            log.record(TransferStats("10.0.0.1", "send", "file%i" % i, 100,
+                                     1.0, 512, 1))
+        self.assertEqual(len(log), 3)
+        self.assertEqual([x.filename for x in log.get_records()],
+                         ["file2", "file3", "file4"])
+        log.clear()
+        self.assertEqual(log.get_records(), [])
+        self.assertRaises(ValueError, TransferLog, 0)
+
+    def test_stats(self):
+        """ Test filtering and summarizing records """
+        log = TransferLog()
+        self.assertEqual(log.get_stats(), None)
+
+        log.record(TransferStats("10.0.0.1", "send", "a", 1000, 1.0, 1428, 8,
+                                 retransmits=2, timeouts=1))
+        log.record(TransferStats("10.0.0.1", "receive", "b", 500, 0.5, 512,
+                                 1, error="Timed out"))
+        log.record(TransferStats("10.0.0.2", "send", "c", 3000, 1.0, 1428,
+                                 8))
+
+        self.assertEqual(log.get_peers(), [("10.0.0.1", "receive"),
+                                           ("10.0.0.1", "send"),
+                                           ("10.0.0.2", "send")])
+        self.assertEqual(
+            [x.filename for x in log.get_records(peer="10.0.0.1")],
+            ["a", "b"]
+        )
+        self.assertEqual(
+            [x.filename for x in log.get_records(direction="send")],
+            ["a", "c"]
+        )
+        self.assertEqual(log.get_records(since=log.get_records()[-1].timestamp
+                                         + 1), [])
+
+        self.assertEqual(log.get_stats(), {
+            "count": 3, "failures": 1, "size": 4500, "elapsed": 2.5,
+            "throughput": 1800.0, "retransmits": 2, "timeouts": 1
+        })
+        self.assertEqual(log.get_stats(peer="10.0.0.2")["throughput"], 3000)
+
+    def test_default(self):
+        """ Test that there's one default log """
+        self.assertTrue(TransferLog.default() is TransferLog.default())
+
+# End of file: ./tftp_metrics_test.py
@@ -0,0 +1,272 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: tftp_server_test.py """
+
+import os
+import time
+import socket
+import struct
+import unittest
+from threading import Thread
+
+from cxmanage_api import temp_dir
+from cxmanage_api.tests import random_file
+from cxmanage_api.tftp_server import TftpServer, parse_request, \
+        negotiate_options, RRQ, WRQ, DATA, ACK, ERROR, OACK, \
+        ERR_FILE_NOT_FOUND, ERR_ACCESS_VIOLATION, ERR_ILLEGAL_OPERATION
+
+
+class TftpServerTest(unittest.TestCase):
+    """ Tests the TftpServer engine with a minimal client """
+
+    def setUp(self):
+        self.root = temp_dir()
+        self.uploads = []
+        self.server = TftpServer(self.root, ip_address="127.0.0.1",
+                                 upload_callback=self.uploads.append,
+                                 timeout=0.2)
+        self.thread = Thread(target=self.server.serve_forever,
+                             kwargs={"poll_interval": 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join()
+
+    def _file(self, size):
+        """ Create a random file in the server root """
+        filename = random_file(size)
+        basename = os.path.basename(filename)
+        os.rename(filename, os.path.join(self.root, basename))
+        return basename, open(os.path.join(self.root, basename)).read()
+
+    def test_parse_request(self):
+        """ Test parsing requests and negotiating options """
+        self.assertEqual(
+            parse_request(_request(RRQ, "a/b.bin", {"BlkSize": "1428"})),
+            ("a/b.bin", "octet", {"blksize": "1428"})
+        )
+        self.assertRaises(ValueError, parse_request, "\0\x01file\0")
+
+        accepted, blksize, windowsize, timeout = negotiate_options(
+            {"blksize": "100000", "windowsize": "16", "tsize": "0",
+             "timeout": "3", "bogus": "1"}, 1000, max_windowsize=8
+        )
+        self.assertEqual(accepted, {"blksize": "65464", "windowsize": "8",
+                                    "tsize": "1000", "timeout": "3"})
+        self.assertEqual((blksize, windowsize, timeout), (65464, 8, 3.0))
+
+        accepted, blksize, windowsize, _ = negotiate_options(
+            {"blksize": "4", "windowsize": "0"}, 1000
+        )
+        self.assertEqual((accepted, blksize, windowsize), ({}, 512, 1))
+
+    def test_download(self):
+        """ Test downloads without options """
+        for size in [0, 1, 511, 512, 513, 1024, 5000]:
+            filename, contents = self._file(size)
+            data, options = _download(self.server.port, filename)
+            self.assertEqual(data, contents)
+            self.assertEqual(options, None)
+
+    def test_download_options(self):
+        """ Test downloads with blksize, tsize and windowsize """
+        filename, contents = self._file(100000)
+        for blksize, windowsize in [(1428, 1), (8192, 16), (1000, 64)]:
+            data, options = _download(
+                self.server.port, filename,
+                {"blksize": blksize, "windowsize": windowsize, "tsize": 0}
+            )
+            self.assertEqual(data, contents)
+            self.assertEqual(options, {"blksize": str(blksize),
+                                       "windowsize": str(windowsize),
+                                       "tsize": "100000"})
+
+    def test_download_rollover(self):
+        """ Test that block numbers wrap around after 65535 """
+        filename, contents = self._file(8 * 70000 + 3)
+        data, _ = _download(self.server.port, filename,
+                            {"blksize": 8, "windowsize": 64})
+        self.assertEqual(data, contents)
+
+    def test_download_loss(self):
+        """ Test that lost blocks within a window are sent again """
+        filename, contents = self._file(64 * 1024)
+        data, _ = _download(self.server.port, filename,
+                            {"blksize": 1024, "windowsize": 8},
+                            drop=set([1, 5, 8, 9, 40, 64, 65]))
+        self.assertEqual(data, contents)
+
+    def test_upload(self):
+        """ Test uploads, with and without options """
+        # Uploads replace a file without truncating its other links
+        shared, shared_contents = self._file(1024)
+        os.link(os.path.join(self.root, shared),
+                os.path.join(self.root, "upload.bin"))
+
+        for options in [None, {"blksize": 1024, "windowsize": 8}]:
+            contents = open(random_file(20000)).read()
+            _upload(self.server.port, "upload.bin", contents, options)
+
+            deadline = time.time() + 5
+            while not self.uploads and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(self.uploads, ["upload.bin"])
+            self.assertEqual(
+                open(os.path.join(self.root, "upload.bin")).read(), contents
+            )
+            del self.uploads[:]
+        self.assertEqual(open(os.path.join(self.root, shared)).read(),
+                         shared_contents)
+
+    def test_errors(self):
+        """ Test that bad requests get error packets """
+        sock = _socket()
+        address = ("127.0.0.1", self.server.port)
+
+        for packet, code in [
+                (_request(RRQ, "missing_file"), ERR_FILE_NOT_FOUND),
+                (_request(RRQ, "../../etc/passwd"), ERR_ACCESS_VIOLATION),
+                (_request(WRQ, "/../outside"), ERR_ACCESS_VIOLATION),
+                (struct.pack("!HH", ACK, 1), ERR_ILLEGAL_OPERATION),
+                ("\0\x01", ERR_ILLEGAL_OPERATION)]:
+            sock.sendto(packet, address)
+            reply = sock.recv(65536)
+            self.assertEqual(struct.unpack("!HH", reply[:4]), (ERROR, code))
+        sock.close()
+
+    def test_session_timeout(self):
+        """ Test that sessions are dropped when the client goes quiet """
+        filename, _ = self._file(5000)
+        sock = _socket()
+        sock.sendto(_request(RRQ, filename), ("127.0.0.1", self.server.port))
+
+        # The first block is sent until we run out of retries
+        for _ in range(self.server.retries + 1):
+            reply = sock.recv(65536)
+            self.assertEqual(struct.unpack("!HH", reply[:4]), (DATA, 1))
+        self.assertRaises(socket.timeout, sock.recv, 65536)
+        self.assertEqual(self.server.session_count, 0)
+        sock.close()
+
+
+def _socket():
+    """ A client socket that won't wait forever """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.settimeout(2)
+    return sock
+
+
+def _request(opcode, filename, options=None):
+    """ Build a RRQ or WRQ packet """
+    packet = struct.pack("!H", opcode) + "%s\0octet\0" % filename
+    for name, value in (options or {}).items():
+        packet += "%s\0%s\0" % (name, value)
+    return packet
+
+
+def _parse_oack(packet):
+    """ Parse an OACK packet into a dictionary """
+    fields = packet[2:].split("\0")[:-1]
+    return dict(zip(fields[::2], fields[1::2]))
+
+
+def _download(port, filename, options=None, drop=None):
+    """ Read a file, ACKing once per window. Block numbers in "drop" are
+    ignored the first time they arrive. Returns the data and any OACK. """
+    sock = _socket()
+    sock.sendto(_request(RRQ, filename, options), ("127.0.0.1", port))
+    drop = set(drop or [])
+    blksize, windowsize, oack = 512, 1, None
+    blocks, received = [], 0
+
+    while True:
+        packet, address = sock.recvfrom(65536)
+        opcode, block = struct.unpack("!HH", packet[:4])
+        if opcode == OACK:
+            oack = _parse_oack(packet)
+            blksize = int(oack.get("blksize", blksize))
+            windowsize = int(oack.get("windowsize", windowsize))
+            sock.sendto(struct.pack("!HH", ACK, 0), address)
+            continue
+        elif opcode != DATA:
+            raise ValueError("Unexpected opcode %i" % opcode)
+
+        expected = len(blocks) + 1
+        if expected in drop and block == expected & 0xFFFF:
+            drop.remove(expected)
+            continue
+        if block != expected & 0xFFFF:
+            if block != (expected - 1) & 0xFFFF or received:
+                # Out of order: start again from the last good block
+                received = 0
+                sock.sendto(struct.pack("!HH", ACK, len(blocks) & 0xFFFF),
+                            address)
+            continue
+
+        blocks.append(packet[4:])
+        received += 1
+        if len(packet) - 4 < blksize or received >= windowsize:
+            received = 0
+            sock.sendto(struct.pack("!HH", ACK, block), address)
+            if len(packet) - 4 < blksize:
+                sock.close()
+                return "".join(blocks), oack
+
+
+def _upload(port, filename, contents, options=None):
+    """ Write a file, sending a window of blocks between ACKs """
+    sock = _socket()
+    sock.sendto(_request(WRQ, filename, options), ("127.0.0.1", port))
+    packet, address = sock.recvfrom(65536)
+
+    blksize, windowsize = 512, 1
+    if struct.unpack("!H", packet[:2])[0] == OACK:
+        oack = _parse_oack(packet)
+        blksize = int(oack.get("blksize", blksize))
+        windowsize = int(oack.get("windowsize", windowsize))
+
+    count = len(contents) // blksize + 1
+    acked = 0
+    while acked < count:
+        for block in range(acked + 1, min(acked + windowsize, count) + 1):
+            data = contents[(block - 1) * blksize:block * blksize]
+            sock.sendto(struct.pack("!HH", DATA, block) + data, address)
+        reply = sock.recv(65536)
+        opcode, block = struct.unpack("!HH", reply[:4])
+        if opcode != ACK:
+            raise ValueError("Unexpected opcode %i" % opcode)
+        acked = block
+    sock.close()
+
+# End of file: ./tftp_server_test.py
@@ -33,11 +33,18 @@
 """Calxeda: tftp_test.py"""
 
 import os
+import time
 import socket
+import tempfile
 import unittest
+from threading import Thread
+from mock import patch
 
 from cxmanage_api.tests import random_file
-from cxmanage_api.tftp import InternalTftp, ExternalTftp
+from cxmanage_api.tftp import InternalTftp, InternalTftpPool, ExternalTftp
+from cxmanage_api.node import Node
+from cxmanage_api.tests.dummy_bmc import DummyBMC
+from cxmanage_api.cx_exceptions import TftpException
 
 
 def _get_relative_host():
@@ -82,6 +89,156 @@ class InternalTftpTest(unittest.TestCase):
         self.assertEqual(open(filename).read(), contents)
         os.remove(filename)
 
+    def test_shared_staging(self):
+        """ Test that one file put under many names is stored once """
+        filename = random_file(1024)
+        contents = open(filename).read()
+        names = ["node%i.simg" % i for i in xrange(8)]
+        client = ExternalTftp("127.0.0.1", self.tftp1.port)
+
+        for name in names:
+            self.tftp1.put_file(filename, name)
+        stored = os.listdir(self.tftp1.staging_dir)
+        self.assertEqual(len(stored), 1)
+        self.assertEqual(
+            os.stat(os.path.join(self.tftp1.staging_dir, stored[0])).st_nlink,
+            len(names) + 1
+        )
+
+        # Each name can be downloaded
+        dest = random_file(0)
+        client.get_file(names[3], dest)
+        self.assertEqual(open(dest).read(), contents)
+        os.remove(dest)
+
+        # The stored copy goes away with the last name
+        for name in names[:-1]:
+            self.tftp1.release_file(name)
+            self.assertFalse(os.path.exists(
+                os.path.join(self.tftp1.tftp_dir, name)
+            ))
+        self.assertEqual(len(os.listdir(self.tftp1.staging_dir)), 1)
+        self.tftp1.release_file(names[-1])
+        self.assertEqual(os.listdir(self.tftp1.staging_dir), [])
+
+        # Files are stored again if they're put again
+        self.tftp1.put_file(filename, names[0])
+        self.assertEqual(len(os.listdir(self.tftp1.staging_dir)), 1)
+        os.remove(filename)
+
+    def test_upload_over_shared_file(self):
+        """ Test that uploading over a put file leaves its links alone """
+        filename = random_file(1024)
+        contents = open(filename).read()
+        client = ExternalTftp("127.0.0.1", self.tftp1.port)
+        self.tftp1.put_file(filename, "node0.simg")
+        self.tftp1.put_file(filename, "node1.simg")
+        os.remove(filename)
+
+        # The staging area isn't served
+        self.assertEqual(sorted(os.listdir(self.tftp1.tftp_dir)),
+                         ["node0.simg", "node1.simg"])
+
+        upload = random_file(512)
+        client.put_file(upload, "node0.simg")
+        self.assertEqual(
+            open(os.path.join(self.tftp1.tftp_dir, "node0.simg")).read(),
+            open(upload).read()
+        )
+        self.assertEqual(
+            open(os.path.join(self.tftp1.tftp_dir, "node1.simg")).read(),
+            contents
+        )
+        stored = os.listdir(self.tftp1.staging_dir)
+        self.assertEqual(
+            open(os.path.join(self.tftp1.staging_dir, stored[0])).read(),
+            contents
+        )
+        os.remove(upload)
+
+    def test_wait_for_file(self):
+        """ Test waiting for a client to upload a file """
+        filename = random_file(1024)
+        contents = open(filename).read()
+        basename = os.path.basename(filename)
+        client = ExternalTftp("127.0.0.1", self.tftp1.port)
+
+        # Upload in the background, after we start waiting
+        self.tftp1.expect_file(basename)
+        uploader = Thread(target=client.put_file, args=(filename, basename))
+        uploader.start()
+
+        start = time.time()
+        path = self.tftp1.wait_for_file(basename, timeout=10)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(open(path).read(), contents)
+        uploader.join()
+
+        # Upload before we start waiting
+        self.tftp1.expect_file(basename)
+        client.put_file(filename, basename)
+        path = self.tftp1.wait_for_file(basename, timeout=10)
+        self.assertEqual(open(path).read(), contents)
+        os.remove(filename)
+
+    def test_wait_for_contents(self):
+        """ Test receiving uploads into memory """
+        client = ExternalTftp("127.0.0.1", self.tftp1.port)
+        for size in [0, 1024, 100000]:
+            filename = random_file(size)
+            contents = open(filename).read()
+
+            self.tftp1.expect_file("result.txt", in_memory=True)
+            client.put_file(filename, "result.txt")
+            self.assertEqual(
+                self.tftp1.wait_for_contents("result.txt", timeout=10),
+                contents
+            )
+            self.assertEqual(os.listdir(self.tftp1.tftp_dir), [])
+
+        # Files that weren't expected in memory are read from disk
+        self.tftp1.expect_file("result.txt")
+        client.put_file(filename, "result.txt")
+        self.assertEqual(
+            self.tftp1.wait_for_contents("result.txt", timeout=10), contents
+        )
+        self.assertEqual(os.listdir(self.tftp1.tftp_dir), [])
+        os.remove(filename)
+
+    def test_spooled_uploads(self):
+        """ Test that uploads into memory spill outside the TFTP directory,
+        and are thrown away if they're released or time out """
+        client = ExternalTftp("127.0.0.1", self.tftp1.port)
+        filename = random_file(100000)
+        with patch("tempfile.SpooledTemporaryFile",
+                   wraps=tempfile.SpooledTemporaryFile) as spooled_class:
+            self.tftp1.expect_file("result.txt", in_memory=True)
+            client.put_file(filename, "result.txt")
+            self.tftp1.wait_for_contents("result.txt", timeout=10)
+            self.assertEqual(spooled_class.call_args[1]["dir"],
+                             self.tftp1.staging_dir)
+        os.remove(filename)
+
+        # pylint: disable=W0212
+        self.tftp1.expect_file("result.txt", in_memory=True)
+        buffer_ = self.tftp1._open_upload("result.txt", None)
+        self.tftp1.release_file("result.txt")
+        self.assertTrue(buffer_.closed)
+        self.assertEqual(self.tftp1._buffers, {})
+
+        self.tftp1.expect_file("result.txt", in_memory=True)
+        buffer_ = self.tftp1._open_upload("result.txt", None)
+        self.assertRaises(TftpException, self.tftp1.wait_for_contents,
+                          "result.txt", 0.01)
+        self.assertTrue(buffer_.closed)
+        self.assertEqual(self.tftp1._buffers, {})
+
+    def test_wait_for_file_timeout(self):
+        """ Test that waiting for a file that never arrives times out """
+        self.tftp1.expect_file("missing_file")
+        self.assertRaises(TftpException, self.tftp1.wait_for_file,
+                          "missing_file", 0.1)
+
     def test_get_address_with_relhost(self):
         """Tests the get_address(relative_host) function with a relative_host
         specified.
@@ -99,6 +256,32 @@ class InternalTftpTest(unittest.TestCase):
                          self.tftp2.get_address(relative_host=relative_host))
         sock.close()
 
+    def test_get_address_cache(self):
+        """ Test that addresses are looked up once per subnet """
+        with patch("cxmanage_api.tftp.socket.socket") as socket_:
+            socket_.return_value.getsockname.return_value = ("10.0.0.2", 0)
+            for i in range(1, 50):
+                self.assertEqual(
+                    self.tftp1.get_address(relative_host="10.0.0.%i" % i),
+                    "10.0.0.2"
+                )
+            self.assertEqual(socket_.call_count, 1)
+
+            socket_.return_value.getsockname.return_value = ("10.0.1.2", 0)
+            self.assertEqual(self.tftp1.get_address("10.0.1.1"), "10.0.1.2")
+            self.assertEqual(socket_.call_count, 2)
+
+            # Failures make us look it up again
+            socket_.return_value.getsockname.return_value = ("10.0.0.3", 0)
+            self.tftp1.invalidate_address("10.0.0.9")
+            self.assertEqual(self.tftp1.get_address("10.0.0.1"), "10.0.0.3")
+            self.assertEqual(self.tftp1.get_address("10.0.1.1"), "10.0.1.2")
+            self.assertEqual(socket_.call_count, 3)
+
+            self.tftp1.invalidate_address()
+            self.tftp1.get_address("10.0.1.1")
+            self.assertEqual(socket_.call_count, 4)
+
 
 class ExternalTftpTest(unittest.TestCase):
     """Tests the ExternalTftp class.
@@ -133,4 +316,84 @@ class ExternalTftpTest(unittest.TestCase):
         self.assertEqual(open(filename).read(), contents)
         os.remove(filename)
 
+    def test_read_file(self):
+        """Test reading files into memory, including ones large enough to
+        spill to disk.
+        """
+        for size in [0, 1024, 200000]:
+            filename = random_file(size)
+            contents = open(filename).read()
+            self.etftp.put_file(src=filename, dest="remote")
+            with patch("cxmanage_api.tftp.SPOOL_SIZE", 65536):
+                self.assertEqual(self.etftp.read_file("remote"), contents)
+            self.assertEqual(self.etftp.last_transfer.size, size)
+            os.remove(filename)
+
+
+class InternalTftpPoolTest(unittest.TestCase):
+    """ Tests the InternalTftpPool class """
+
+    def setUp(self):
+        """ Create a pool to test with """
+        self.pool = InternalTftpPool(count=3)
+
+    def test_servers(self):
+        """ Test that each server in the pool has its own port """
+        self.assertEqual(len(self.pool.servers), 3)
+        ports = set(x.port for x in self.pool.servers)
+        self.assertEqual(len(ports), 3)
+        self.assertFalse(0 in ports)
+
+        # Servers keep their files separate
+        filename = random_file(1024)
+        contents = open(filename).read()
+        self.pool.servers[0].put_file(filename, "file")
+        client = ExternalTftp("127.0.0.1", self.pool.servers[0].port)
+        client.get_file("file", filename)
+        self.assertEqual(open(filename).read(), contents)
+        client = ExternalTftp("127.0.0.1", self.pool.servers[1].port)
+        self.assertRaises(TftpException, client.get_file, "file", filename)
+        os.remove(filename)
+
+    def test_assign(self):
+        """ Test that nodes are spread evenly and keep their server """
+        hosts = ["10.0.0.%i" % i for i in range(1, 8)]
+        servers = [self.pool.assign(x) for x in hosts]
+        self.assertEqual(self.pool.get_loads(), [3, 2, 2])
+        self.assertEqual(servers[:3], self.pool.servers)
+        self.assertEqual([self.pool.assign(x) for x in hosts], servers)
+
+        # Released slots get reused
+        self.pool.release(hosts[1])
+        self.pool.release(hosts[2])
+        self.assertEqual(self.pool.get_loads(), [3, 1, 1])
+        self.assertTrue(self.pool.assign("10.0.0.8") is self.pool.servers[1])
+        self.assertTrue(self.pool.assign("10.0.0.9") is self.pool.servers[2])
+
+    def test_endpoints(self):
+        """ Test creating a pool from a list of endpoints """
+        pool = InternalTftpPool(
+            endpoints=[("127.0.0.1", 0), ("127.0.0.2", 0)]
+        )
+        self.assertEqual(
+            [x.get_address() for x in pool.servers],
+            ["127.0.0.1", "127.0.0.2"]
+        )
+        self.assertRaises(ValueError, InternalTftpPool, endpoints=[])
+
+    def test_node(self):
+        """ Test that a node given a pool uses its assigned server """
+        nodes = [
+            Node(ip_address="192.168.100.%i" % i, tftp=self.pool,
+                 bmc=DummyBMC)
+            for i in range(3)
+        ]
+        self.assertEqual(
+            [x.tftp for x in nodes], self.pool.servers
+        )
+        for node in nodes:
+            self.assertEqual(
+                node.tftp_address.split(":")[1], str(node.tftp.port)
+            )
+
 # End of file: ./tftp_test.py
@@ -32,18 +32,25 @@
 # DAMAGE.
 
 
+import os
+import time
+import hashlib
 import shutil
 import socket
-import logging
+import tempfile
 import traceback
 
-from datetime import datetime, timedelta
-from tftpy import TftpClient, TftpServer, setLogLevel
-from threading import Thread
-from cxmanage_api import temp_dir
+from threading import Thread, Lock, Event
+from cxmanage_api import WORK_DIR, temp_dir, temp_file
+from cxmanage_api.tftp_server import TftpServer, create_file
+from cxmanage_api.tftp_client import TftpClient
 from tftpy.TftpShared import TftpException
 
 
+# Files received into memory spill to disk beyond this size.
+SPOOL_SIZE = 1024 * 1024
+
+
 class InternalTftp(Thread):
     """Internally serves files using the `Trivial File Transfer Protocol \
 <http://en.wikipedia.org/wiki/Trivial_File_Transfer_Protocol>`_.
@@ -76,36 +83,39 @@ class InternalTftp(Thread):
         self.daemon = True
 
         self.tftp_dir = temp_dir()
+        # Outside tftp_dir, so that clients can't read or write it directly
+        self.staging_dir = temp_dir()
         self.verbose = verbose
 
-        self.server = TftpServer(tftproot=self.tftp_dir)
+        self.server = TftpServer(self.tftp_dir, port=port,
+                                 upload_callback=self._upload_complete,
+                                 open_upload=self._open_upload)
         self.ip_address = ip_address
-        self.port = port
+        self._uploads = {}
+        self._spooled = {}
+        self._buffers = {}
+        self._uploads_lock = Lock()
+        self._staged = {}
+        self._hashes = {}
+        self._staged_lock = Lock()
+        self._routes = {}
+        self._routes_lock = Lock()
+        self.port = self.server.port
         self.start()
 
-        # Get the port we actually hosted on
-        if port == 0:
-            deadline = datetime.now() + timedelta(seconds=10)
-            while datetime.now() < deadline:
-                try:
-                    self.port = self.server.sock.getsockname()[1]
-                    break
-                except (AttributeError, socket.error):
-                    pass
-            else:
-                # don't catch the error on our last attempt
-                self.port = self.server.sock.getsockname()[1]
-
     def run(self):
         """ Run the server. Listens indefinitely. """
-        if not self.verbose:
-            setLogLevel(logging.CRITICAL)
-        self.server.listen(listenport=self.port)
+        self.server.serve_forever()
 
     def get_address(self, relative_host=None):
         """Returns the ipv4 address of this server.
         If a relative_host is specified, then we discover our address to them.
 
+        .. note::
+            * Addresses are remembered for each /24 subnet, since hosts in the
+              same subnet reach us the same way. Call invalidate_address() if
+              a host fails to reach us.
+
         >>> i_tftp.get_address(relative_host='10.10.14.150')
         'localhost'
 
@@ -120,12 +130,38 @@ class InternalTftp(Thread):
             return self.ip_address
         elif (relative_host == None):
             return "localhost"
-        else:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        key = _get_route_key(relative_host)
+        with self._routes_lock:
+            if (key in self._routes):
+                return self._routes[key]
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
             sock.connect((relative_host, self.port))
             ipv4 = sock.getsockname()[0]
+        finally:
             sock.close()
-            return ipv4
+
+        with self._routes_lock:
+            self._routes[key] = ipv4
+        return ipv4
+
+    def invalidate_address(self, relative_host=None):
+        """Forget the address we found for a host, so that the next call to
+        get_address() looks it up again. Forgets every host by default.
+
+        >>> i_tftp.invalidate_address(relative_host='10.10.14.150')
+
+        :param relative_host: Ip address to the relative host.
+        :type relative_host: string
+
+        """
+        with self._routes_lock:
+            if (relative_host == None):
+                self._routes.clear()
+            else:
+                self._routes.pop(_get_route_key(relative_host), None)
 
     def get_file(self, src, dest):
         """Download a file from the tftp server to local_path.
@@ -153,6 +189,12 @@ class InternalTftp(Thread):
     def put_file(self, src, dest):
         """Upload a file from src to dest on the tftp server (path).
 
+        .. note::
+            * Each distinct file is stored once, and dest is a hard link to
+              it. Putting the same file under many names (one per node, for
+              example) doesn't copy it again. Use release_file() to remove
+              a name once its transfer is done.
+
         >>> i_tftp.put_file(src='/local/file.txt', dest='remote_file_name.txt')
 
         :param src: Path to the local file to send to the TFTP server.
@@ -164,14 +206,293 @@ class InternalTftp(Thread):
         dest = "%s/%s" % (self.tftp_dir, dest)
         if (src != dest):
             try:
-                # Ensure that the local file exists ...
-                with open(src) as a_file:
-                    a_file.close()
-                shutil.copy(src, dest)
+                stored = "%s/%s" % (self.staging_dir, self._get_sha1(src))
+                with self._staged_lock:
+                    if (not os.path.exists(stored)):
+                        temp_stored = "%s.tmp" % stored
+                        shutil.copy(src, temp_stored)
+                        os.rename(temp_stored, stored)
+
+                    # Link then rename, so that clients reading a file that's
+                    # being replaced never see a partial copy.
+                    temp_dest = "%s.tmp" % dest
+                    try:
+                        os.link(stored, temp_dest)
+                    except OSError:
+                        shutil.copy(stored, temp_dest)
+                    os.rename(temp_dest, dest)
+                    self._staged[dest] = stored
             except Exception:
                 traceback.format_exc()
                 raise
 
+    def release_file(self, filename):
+        """Remove a file that was put on the server, once it's no longer
+        needed. The stored copy is removed along with its last name, and
+        an upload of the file that was expected but never waited for is
+        forgotten.
+
+        >>> i_tftp.release_file('remote_file_name.txt')
+
+        :param filename: Name of the file on the tftp server.
+        :type filename: string
+
+        """
+        with self._uploads_lock:
+            self._uploads.pop(filename.lstrip("/"), None)
+            self._spooled.pop(filename.lstrip("/"), None)
+            buffer_ = self._buffers.pop(filename.lstrip("/"), None)
+        if (buffer_ != None):
+            buffer_.close()
+
+        path = "%s/%s" % (self.tftp_dir, filename)
+        with self._staged_lock:
+            stored = self._staged.pop(path, None)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            if (stored != None and not stored in self._staged.values()):
+                try:
+                    os.remove(stored)
+                except OSError:
+                    pass
+
+    def _get_sha1(self, src):
+        """Get the SHA-1 of a local file, remembering it until the file
+        changes.
+        """
+        stat = os.stat(src)
+        key = (os.path.realpath(src), stat.st_size, stat.st_mtime)
+        with self._staged_lock:
+            if (key in self._hashes):
+                return self._hashes[key]
+
+        sha1 = hashlib.sha1()
+        with open(src, "rb") as file_:
+            for chunk in iter(lambda: file_.read(1024 * 1024), ""):
+                sha1.update(chunk)
+
+        with self._staged_lock:
+            self._hashes[key] = sha1.hexdigest()
+        return sha1.hexdigest()
+
+    def expect_file(self, filename, in_memory=False):
+        """Prepare to wait for a client to upload a file to this server.
+
+        Call this before triggering the upload, so that wait_for_file() sees
+        the upload even if it finishes first.
+
+        :param filename: Name of the file on the tftp server.
+        :type filename: string
+        :param in_memory: Receive the file into memory instead of the TFTP
+                          directory, for use with wait_for_contents().
+        :type in_memory: boolean
+
+        """
+        filename = filename.lstrip("/")
+        with self._uploads_lock:
+            self._uploads[filename] = Event()
+            if (in_memory):
+                self._spooled[filename] = None
+
+    def wait_for_file(self, filename, timeout=None):
+        """Wait for a client to finish uploading a file to this server.
+
+        >>> i_tftp.expect_file('ipinfo.txt')
+        >>> # ... ask a node to upload ipinfo.txt to us ...
+        >>> i_tftp.wait_for_file('ipinfo.txt', timeout=10)
+        '/tmp/cxmanage-0hGavN/tmpLvDvRk/ipinfo.txt'
+
+        :param filename: Name of the file on the tftp server.
+        :type filename: string
+        :param timeout: Maximum number of seconds to wait.
+        :type timeout: float
+
+        :returns: The local path of the uploaded file.
+        :rtype: string
+
+        :raises TftpException: If the upload doesn't finish in time.
+
+        """
+        filename = filename.lstrip("/")
+        self._wait(filename, timeout)
+        return os.path.join(self.tftp_dir, filename)
+
+    def wait_for_contents(self, filename, timeout=None):
+        """Wait for a client to finish uploading a file to this server, and
+        return its contents. Nothing is left behind in the TFTP directory.
+
+        >>> i_tftp.expect_file('ipinfo.txt', in_memory=True)
+        >>> # ... ask a node to upload ipinfo.txt to us ...
+        >>> i_tftp.wait_for_contents('ipinfo.txt', timeout=10)
+        'Node 0: 192.168.100.1\\nNode 1: 192.168.100.2\\n'
+
+        :param filename: Name of the file on the tftp server.
+        :type filename: string
+        :param timeout: Maximum number of seconds to wait.
+        :type timeout: float
+
+        :returns: The contents of the uploaded file.
+        :rtype: string
+
+        :raises TftpException: If the upload doesn't finish in time.
+
+        """
+        filename = filename.lstrip("/")
+        try:
+            self._wait(filename, timeout)
+        finally:
+            with self._uploads_lock:
+                contents = self._spooled.pop(filename, None)
+                buffer_ = self._buffers.pop(filename, None)
+            if (buffer_ != None):
+                buffer_.close()
+
+        if (contents == None):
+            # Not received into memory, so read it from disk
+            path = os.path.join(self.tftp_dir, filename)
+            contents = open(path, "rb").read()
+            os.remove(path)
+        return contents
+
+    def _wait(self, filename, timeout):
+        """Wait for an upload to finish."""
+        with self._uploads_lock:
+            event = self._uploads.setdefault(filename, Event())
+
+        finished = event.wait(timeout)
+
+        with self._uploads_lock:
+            if self._uploads.get(filename) is event:
+                del self._uploads[filename]
+
+        if not finished:
+            raise TftpException("Timed out waiting for upload of %s"
+                    % filename)
+
+    def _open_upload(self, filename, path):
+        """Get a file object for an upload. Called by the server."""
+        filename = filename.lstrip("/")
+        with self._uploads_lock:
+            if filename in self._spooled:
+                # Spill outside tftp_dir, where clients can't see it
+                buffer_ = tempfile.SpooledTemporaryFile(SPOOL_SIZE,
+                                                        dir=self.staging_dir)
+                self._buffers[filename] = buffer_
+                return buffer_
+        return create_file(path)
+
+    def _upload_complete(self, filename):
+        """Wake up anyone waiting for this file. Called by the server."""
+        filename = filename.lstrip("/")
+        if filename.startswith(self.tftp_dir):
+            filename = os.path.relpath(filename, self.tftp_dir)
+
+        with self._uploads_lock:
+            buffer_ = self._buffers.pop(filename, None)
+            if (buffer_ != None and filename in self._spooled):
+                buffer_.seek(0)
+                self._spooled[filename] = buffer_.read()
+            event = self._uploads.get(filename)
+        if event is not None:
+            event.set()
+
+
+class InternalTftpPool(object):
+    """A pool of InternalTftp servers, each with its own socket and thread,
+    for spreading many nodes' transfers across several endpoints. Use one
+    server per management interface, or several on one interface.
+
+    Pass a pool anywhere an InternalTftp is accepted. Each Node is assigned
+    the server with the fewest nodes, and keeps it.
+
+    >>> from cxmanage_api.tftp import InternalTftpPool
+    >>> pool = InternalTftpPool(count=4)
+    >>> # Alternatively, one server per interface ...
+    >>> pool = InternalTftpPool(endpoints=[('10.1.0.5', 0), ('10.2.0.5', 0)])
+    >>> pool.assign('10.1.0.100')
+    <cxmanage_api.tftp.InternalTftp(Thread-1, started daemon 140109)>
+
+    :param count: Number of servers to start, on ports picked automatically.
+    :type count: integer
+    :param endpoints: (ip_address, port) for each server. Overrides count.
+    :type endpoints: list
+    :param verbose: Flag to turn on additional messaging.
+    :type verbose: boolean
+
+    """
+
+    def __init__(self, count=4, endpoints=None, verbose=False):
+        """Default constructor for the InternalTftpPool class."""
+        if (endpoints == None):
+            endpoints = [(None, 0)] * count
+        if (len(endpoints) < 1):
+            raise ValueError("An InternalTftpPool needs at least one server")
+
+        self.servers = [
+            InternalTftp(ip_address=ip_address, port=port, verbose=verbose)
+            for ip_address, port in endpoints
+        ]
+        self._assignments = {}
+        self._lock = Lock()
+
+    def assign(self, key):
+        """Get the server for a node, assigning it the least loaded server if
+        it doesn't have one yet.
+
+        :param key: Identifies the node, e.g. by its ip address.
+        :type key: string
+
+        :returns: The server assigned to this node.
+        :rtype: InternalTftp
+
+        """
+        with self._lock:
+            if (key not in self._assignments):
+                loads = self._get_loads()
+                self._assignments[key] = min(self.servers, key=loads.get)
+            return self._assignments[key]
+
+    def release(self, key):
+        """Forget a node's assignment, freeing up its share of its server.
+
+        :param key: Identifies the node, e.g. by its ip address.
+        :type key: string
+
+        """
+        with self._lock:
+            self._assignments.pop(key, None)
+
+    def get_loads(self):
+        """Get the number of nodes assigned to each server.
+
+        :returns: A count for each server, in the same order as servers.
+        :rtype: list
+
+        """
+        with self._lock:
+            loads = self._get_loads()
+        return [loads[x] for x in self.servers]
+
+    def _get_loads(self):
+        """Count the nodes assigned to each server. Call with the lock held."""
+        loads = dict((x, 0) for x in self.servers)
+        for server in self._assignments.itervalues():
+            loads[server] += 1
+        return loads
+
+
+def _get_route_key(host):
+    """Get the key to remember a route to this host by: the /24 subnet for
+    ipv4 addresses, or the name itself for anything else.
+    """
+    fields = host.split(".")
+    if (len(fields) == 4 and all(x.isdigit() for x in fields)):
+        return ".".join(fields[:3])
+    return host
+
 
 class ExternalTftp(object):
     """Defines a ExternalTftp object, which is actually TFTP client.
@@ -193,9 +514,8 @@ class ExternalTftp(object):
         self.ip_address = ip_address
         self.port = port
         self.verbose = verbose
-
-        if not self.verbose:
-            setLogLevel(logging.CRITICAL)
+        self.client = TftpClient(ip_address, port)
+        self.last_transfer = None
 
     def get_address(self, relative_host=None):
         """Return the ip address of the ExternalTftp server.
@@ -213,66 +533,190 @@ class ExternalTftp(object):
         del relative_host  # Needed only for function signature.
         return self.ip_address
 
+    def invalidate_address(self, relative_host=None):
+        """Forget the address found for a host. The ExternalTftp address is
+        fixed, so this does nothing.
+
+        :param relative_host: Unused parameter, for function signature.
+        :type relative_host: None
+
+        """
+        del relative_host  # Needed only for function signature.
+
     def get_file(self, src, dest):
         """Download a file from the ExternalTftp Server.
 
-        .. note::
-            * TftpClient is not threadsafe, so we create a unique instance for
-              each transfer.
-
         >>> e_tftp.get_file(src='remote_file_i_want.txt', dest='/local/path')
+        <cxmanage_api.tftp_metrics.TransferStats object at 0x7f1e5c2a4d10>
 
         :param src: The path to the file on the Tftp server.
         :type src: string
         :param dest: The local destination to copy the file to.
         :type dest: string
 
+        :returns: Throughput and other statistics for the transfer.
+        :rtype: TransferStats
+
         :raises TftpException: If the file does not exist or cannot be obtained
                                from the TFTP server.
-        :raises TftpException: If a TypeError is received from tftpy.
 
         """
         try:
-            client = TftpClient(self.ip_address, self.port)
-            client.download(output=dest, filename=src)
+            self.last_transfer = self.client.get_file(src, dest)
         except TftpException:
             if (self.verbose):
                 traceback.format_exc()
             raise
-        except TypeError:
-            if (self.verbose):
-                traceback.format_exc()
-            raise TftpException("Failed download file from TFTP server")
+        if (self.verbose):
+            print self.last_transfer
+        return self.last_transfer
 
     def put_file(self, src, dest):
         """Uploads a file to the tftp server.
 
-        .. note::
-            * TftpClient is not threadsafe, so we create a unique instance for
-              each transfer.
-
         >>> e_tftp.put_file(src='local_file.txt', dest='remote_name.txt')
+        <cxmanage_api.tftp_metrics.TransferStats object at 0x7f1e5c2a4d10>
 
         :param src: Source file path (on your local machine).
         :type src: string
         :param dest: Destination path (on the TFTP server).
         :type dest: string
 
+        :returns: Throughput and other statistics for the transfer.
+        :rtype: TransferStats
+
         :raises TftpException: If the file cannot be written to the TFTP server.
-        :raises TftpException: If a TypeError is received from tftpy.
 
         """
         try:
-            client = TftpClient(self.ip_address, self.port)
-            client.upload(input=src, filename=dest)
+            self.last_transfer = self.client.put_file(src, dest)
         except TftpException:
             if (self.verbose):
                 traceback.format_exc()
             raise
-        except TypeError:
+        if (self.verbose):
+            print self.last_transfer
+        return self.last_transfer
+
+    def read_file(self, src):
+        """Download a file from the ExternalTftp Server into memory. Large
+        files spill over into a temporary file while being received.
+
+        >>> e_tftp.read_file('ipinfo.txt')
+        'Node 0: 192.168.100.1\\nNode 1: 192.168.100.2\\n'
+
+        :param src: The path to the file on the Tftp server.
+        :type src: string
+
+        :returns: The contents of the file.
+        :rtype: string
+
+        :raises TftpException: If the file does not exist or cannot be obtained
+                               from the TFTP server.
+
+        """
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE, dir=WORK_DIR) as dest:
+            try:
+                self.last_transfer = self.client.get_file(src, dest)
+            except TftpException:
+                if (self.verbose):
+                    traceback.format_exc()
+                raise
             if (self.verbose):
-                traceback.format_exc()
-            raise TftpException("Failed to upload file to TFTP server")
+                print self.last_transfer
+            dest.seek(0)
+            return dest.read()
+
+    def expect_file(self, filename, in_memory=False):
+        """Prepare to wait for a file. Only needed for InternalTftp servers.
+
+        :param filename: Unused parameter, for function signature.
+        :type filename: string
+        :param in_memory: Unused parameter, for function signature.
+        :type in_memory: boolean
+
+        """
+        del filename, in_memory  # Needed only for function signature.
+
+    def release_file(self, filename):
+        """Release a file that was put on the server. We can't delete files
+        from an external server, so this does nothing.
+
+        :param filename: Unused parameter, for function signature.
+        :type filename: string
+
+        """
+        del filename  # Needed only for function signature.
+
+    def wait_for_file(self, filename, timeout=None):
+        """Wait for a file to appear on the ExternalTftp server.
+
+        .. note::
+            * We have no way to be notified by an external server, so this
+              polls the server once a second.
+
+        >>> e_tftp.wait_for_file('ipinfo.txt', timeout=10)
+        '/tmp/cxmanage-0hGavN/tmpLvDvRk'
+
+        :param filename: The path to the file on the Tftp server.
+        :type filename: string
+        :param timeout: Maximum number of seconds to wait.
+        :type timeout: float
+
+        :returns: The local path of a downloaded copy of the file.
+        :rtype: string
+
+        :raises TftpException: If the file doesn't appear in time.
+
+        """
+        dest = temp_file()
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            try:
+                self.get_file(src=filename, dest=dest)
+                if os.path.getsize(dest) > 0:
+                    return dest
+            except (TftpException, IOError, OSError):
+                pass
+
+            if deadline is not None and time.time() >= deadline:
+                raise TftpException("Timed out waiting for %s" % filename)
+            time.sleep(1)
+
+    def wait_for_contents(self, filename, timeout=None):
+        """Wait for a file to appear on the ExternalTftp server, and return its
+        contents.
+
+        .. note::
+            * We have no way to be notified by an external server, so this
+              polls the server once a second.
+
+        >>> e_tftp.wait_for_contents('ipinfo.txt', timeout=10)
+        'Node 0: 192.168.100.1\\nNode 1: 192.168.100.2\\n'
+
+        :param filename: Name of the file on the tftp server.
+        :type filename: string
+        :param timeout: Maximum number of seconds to wait.
+        :type timeout: float
+
+        :returns: The contents of the file.
+        :rtype: string
+
+        :raises TftpException: If the file doesn't appear in time.
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            try:
+                contents = self.read_file(filename)
+                if contents:
+                    return contents
+            except TftpException:
+                pass
+
+            if deadline is not None and time.time() >= deadline:
+                raise TftpException("Timed out waiting for %s" % filename)
+            time.sleep(1)
 
 
 # End of file: ./tftp.py
@@ -0,0 +1,506 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: tftp_client.py"""
+
+import os
+import time
+import socket
+import struct
+from threading import Lock
+
+from tftpy.TftpShared import TftpException
+
+from cxmanage_api.tftp_server import RRQ, WRQ, DATA, ACK, ERROR, OACK, \
+        DEFAULT_BLKSIZE, MIN_BLKSIZE, MAX_PACKET_SIZE, SOCKET_BUFFER_SIZE
+from cxmanage_api.tftp_metrics import TransferLog, TransferStats
+
+
+# Largest block that fits in a 1500 byte ethernet frame, rounded down to a
+# size that common servers (including the ECME's) are known to accept.
+CLIENT_BLKSIZE = 1428
+CLIENT_WINDOWSIZE = 8
+
+# TFTP error code for refused options (RFC 2347).
+_OPTION_ERROR = 8
+
+
+class TftpClient(object):
+    """A TFTP client that negotiates larger blocks and windows.
+
+    Requests ask for blksize (RFC 2348), tsize (RFC 2349) and windowsize
+    (RFC 7440). If the server refuses them, or doesn't answer, the request
+    is sent again as a plain RFC 1350 transfer.
+
+    Retransmit timeouts adapt to the measured round trip time, using
+    Jacobson's algorithm with Karn's rule and exponential backoff. The
+    estimate is shared by every transfer made with this client. A short
+    timeout recovers quickly from lost packets, so a transfer only gives up
+    once it has used its retries and has heard nothing for min_wait seconds.
+
+    Unlike tftpy's client, one instance can be used by many threads at once.
+    Every transfer, including failed ones, is recorded in a TransferLog.
+
+    >>> from cxmanage_api.tftp_client import TftpClient
+    >>> client = TftpClient('10.20.1.9', 5001)
+    >>> client.put_file('local_file.txt', 'remote_name.txt')
+
+    :param host: Address of the TFTP server.
+    :type host: string
+    :param port: Port of the TFTP server.
+    :type port: integer
+    :param blksize: Block size to ask for.
+    :type blksize: integer
+    :param windowsize: Window size to ask for.
+    :type windowsize: integer
+    :param timeout: Retransmit timeout to start with, in seconds.
+    :type timeout: float
+    :param retries: Retransmissions in a row before giving up.
+    :type retries: integer
+    :param min_wait: Least time without a reply before giving up, in
+                     seconds.
+    :type min_wait: float
+    :param transfer_log: Where to record transfers. Defaults to
+                         TransferLog.default().
+    :type transfer_log: TransferLog
+
+    """
+
+    # pylint: disable=R0913
+    def __init__(self, host, port=69, blksize=CLIENT_BLKSIZE,
+                 windowsize=CLIENT_WINDOWSIZE, timeout=1.0, retries=5,
+                 transfer_log=None, min_wait=30.0):
+        self.host = host
+        self.port = port
+        if (transfer_log == None):
+            transfer_log = TransferLog.default()
+        self.transfer_log = transfer_log
+        self.blksize = blksize
+        self.windowsize = windowsize
+        self.retries = retries
+        self.min_wait = min_wait
+        self.timer = RetransmitTimer(timeout)
+        self.use_options = (blksize != DEFAULT_BLKSIZE or windowsize != 1)
+
+    def get_file(self, src, dest):
+        """Download a file from the server.
+
+        :param src: Name of the file on the server.
+        :type src: string
+        :param dest: Local path or file object to write to.
+        :type dest: string
+
+        :returns: Statistics for the transfer.
+        :rtype: TransferStats
+
+        :raises TftpException: If the transfer fails.
+
+        """
+        if hasattr(dest, "write"):
+            return _Transfer(self, src).run("receive", dest)
+        with open(dest, "wb") as fileobj:
+            return _Transfer(self, src).run("receive", fileobj)
+
+    def put_file(self, src, dest):
+        """Upload a file to the server.
+
+        :param src: Local path to read from.
+        :type src: string
+        :param dest: Name of the file on the server.
+        :type dest: string
+
+        :returns: Statistics for the transfer.
+        :rtype: TransferStats
+
+        :raises TftpException: If the transfer fails.
+
+        """
+        with open(src, "rb") as fileobj:
+            size = os.fstat(fileobj.fileno()).st_size
+            return _Transfer(self, dest, size).run("send", fileobj)
+
+
+class RetransmitTimer(object):
+    """Adaptive retransmit timeout, following RFC 6298.
+
+    >>> timer = RetransmitTimer(1.0)
+    >>> timer.sample(0.02)
+    >>> timer.rto
+    0.1
+
+    :param timeout: Timeout to use before the first sample.
+    :type timeout: float
+    :param minimum: Smallest timeout to use.
+    :type minimum: float
+    :param maximum: Largest timeout to back off to.
+    :type maximum: float
+
+    """
+
+    def __init__(self, timeout=1.0, minimum=0.1, maximum=8.0):
+        self.rto = timeout
+        self.minimum = minimum
+        self.maximum = maximum
+        self.srtt = None
+        self.rttvar = None
+        self._lock = Lock()
+
+    def sample(self, rtt):
+        """Update the estimate with a round trip time, in seconds. Samples
+        must not come from retransmitted packets."""
+        with self._lock:
+            if (self.srtt == None):
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+                self.srtt = 0.875 * self.srtt + 0.125 * rtt
+            self.rto = min(max(self.srtt + 4 * self.rttvar, self.minimum),
+                           self.maximum)
+
+    def backoff(self):
+        """Double the timeout after a retransmission."""
+        with self._lock:
+            self.rto = min(self.rto * 2, self.maximum)
+
+
+class _Transfer(object):
+    """State for a single transfer."""
+
+    def __init__(self, client, filename, size=None):
+        self.client = client
+        self.filename = filename
+        self.size = size
+        self.timer = client.timer
+        self.blksize = DEFAULT_BLKSIZE
+        self.windowsize = 1
+        self.transferred = 0
+        self.retransmits = 0
+        self.timeouts = 0
+        self.address = None
+        self.use_options = client.use_options
+        self.last_reply = time.time()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                 SOCKET_BUFFER_SIZE)
+        except socket.error:
+            pass
+
+    def run(self, direction, fileobj):
+        """Send or receive the file, and record how it went."""
+        start = time.time()
+        error = None
+        try:
+            if (direction == "send"):
+                self._upload(fileobj)
+            else:
+                self._download(fileobj)
+        except Exception as err:    # pylint: disable=W0703
+            error = str(err) or err.__class__.__name__
+            raise
+        finally:
+            self.sock.close()
+            stats = TransferStats(
+                self.client.host, direction, self.filename, self.transferred,
+                time.time() - start, self.blksize, self.windowsize,
+                self.retransmits, self.timeouts, error
+            )
+            self.client.transfer_log.record(stats)
+        return stats
+
+    def _download(self, fileobj):
+        """Read the file from the server into fileobj."""
+        packet = self._request(RRQ)
+        expected = 1
+        received = 0
+        retries = 0
+        gap_acked = False
+        ack_time = None
+
+        if self._opcode(packet) == OACK:
+            self._ack(0)
+            ack_time = time.time()
+            packet = None
+
+        while True:
+            if packet == None:
+                packet = self._receive()
+            if packet == None:
+                # Start the window again from the first missing block
+                retries = self._retry(retries)
+                received = 0
+                self.retransmits += 1
+                self._ack(expected - 1)
+                ack_time = None
+                continue
+
+            opcode = self._opcode(packet)
+            if opcode == OACK and expected == 1:
+                # Our ACK of the OACK was lost, and the server sent it again
+                packet = None
+                self.retransmits += 1
+                self._ack(0)
+                ack_time = None
+                continue
+            elif opcode != DATA:
+                raise TftpException("Unexpected opcode %i" % opcode)
+            block = struct.unpack("!H", packet[2:4])[0]
+            data = packet[4:]
+            packet = None
+
+            if block != expected & 0xFFFF:
+                # Ask for the rest again from the first block we missed
+                if not gap_acked:
+                    gap_acked = True
+                    received = 0
+                    self.retransmits += 1
+                    self._ack(expected - 1)
+                    ack_time = None
+                continue
+
+            if ack_time != None:
+                self.timer.sample(time.time() - ack_time)
+                ack_time = None
+            fileobj.write(data)
+            self.transferred += len(data)
+            expected += 1
+            received += 1
+            retries = 0
+            gap_acked = False
+
+            if len(data) < self.blksize or received >= self.windowsize:
+                received = 0
+                self._ack(block)
+                ack_time = time.time()
+                if len(data) < self.blksize:
+                    return
+
+    def _upload(self, fileobj):
+        """Write fileobj to the server."""
+        packet = self._request(WRQ)
+        opcode = self._opcode(packet)
+        if opcode == ACK and struct.unpack("!H", packet[2:4])[0] != 0:
+            raise TftpException("Unexpected ACK")
+
+        last_block = self.size // self.blksize + 1
+        base = 1
+        next_block = 1
+        retries = 0
+        send_times = {}
+        resent = set()
+        rewound = None
+
+        while True:
+            limit = min(base + self.windowsize, last_block + 1)
+            while next_block < limit:
+                if next_block in send_times:
+                    resent.add(next_block)
+                    self.retransmits += 1
+                fileobj.seek((next_block - 1) * self.blksize)
+                self._send(struct.pack("!HH", DATA, next_block & 0xFFFF) +
+                           fileobj.read(self.blksize))
+                send_times[next_block] = time.time()
+                next_block += 1
+
+            packet = self._receive()
+            if packet == None:
+                retries = self._retry(retries)
+                next_block = base
+                rewound = base
+                continue
+
+            opcode = self._opcode(packet)
+            if opcode == OACK and base == 1:
+                # Our first block was lost, and the server sent its OACK
+                # again. It stands in for ACK 0.
+                block = 0
+            elif opcode != ACK:
+                raise TftpException("Unexpected opcode %i" % opcode)
+            else:
+                block = struct.unpack("!H", packet[2:4])[0]
+            acked = base - 1 + ((block - (base - 1)) & 0xFFFF)
+            if acked >= next_block:
+                continue
+
+            if acked >= base:
+                if acked not in resent:
+                    self.timer.sample(time.time() - send_times[acked])
+                for i in xrange(base, acked + 1):
+                    send_times.pop(i, None)
+                    resent.discard(i)
+                base = acked + 1
+                retries = 0
+                self.transferred = min((base - 1) * self.blksize,
+                                       self.size)
+            if base > last_block:
+                return
+
+            # The server missed something. Go back, once per gap.
+            if acked < next_block - 1 and rewound != base:
+                next_block = base
+                rewound = base
+
+    def _request(self, opcode):
+        """Send a request, negotiating options if we can. Returns the first
+        packet of the reply, which is an OACK if options were accepted."""
+        retries = 0
+        while True:
+            options = self._get_options(opcode, retries)
+            packet = struct.pack("!H", opcode) + "%s\0octet\0" % self.filename
+            packet += "".join("%s\0%s\0" % (name, value)
+                              for name, value in sorted(options.items()))
+            self.address = None
+            self.sock.sendto(packet, (self.client.host, self.client.port))
+            sent = time.time()
+
+            try:
+                reply = self._receive()
+            except TftpException as err:
+                if options and getattr(err, "code", None) == _OPTION_ERROR:
+                    # The server refused our options. Ask again without
+                    # them, and don't count this against our retries.
+                    self.use_options = False
+                    continue
+                raise
+
+            if reply == None:
+                retries = self._retry(retries)
+                self.retransmits += 1
+                continue
+
+            if retries == 0:
+                self.timer.sample(time.time() - sent)
+            if self._opcode(reply) == OACK:
+                self._accept_options(options, reply)
+            return reply
+
+    def _get_options(self, opcode, retries):
+        """Options to send with a request."""
+        # A server that ignores requests with options won't answer at all,
+        # so the last tries go without them.
+        if not self.use_options or (retries > 0 and
+                                    retries >= self.client.retries):
+            return {}
+
+        options = {"tsize": 0}
+        if self.client.blksize != DEFAULT_BLKSIZE:
+            options["blksize"] = self.client.blksize
+        if self.client.windowsize != 1:
+            options["windowsize"] = self.client.windowsize
+        if opcode == WRQ:
+            options["tsize"] = self.size
+        return options
+
+    def _accept_options(self, options, oack):
+        """Check an OACK against what we asked for, and use its values."""
+        fields = oack[2:].split("\0")[:-1]
+        accepted = dict(zip([x.lower() for x in fields[::2]], fields[1::2]))
+        try:
+            for name, value in accepted.items():
+                if not name in options:
+                    raise ValueError
+                value = int(value)
+                if name == "blksize":
+                    if not MIN_BLKSIZE <= value <= options[name]:
+                        raise ValueError
+                    self.blksize = value
+                elif name == "windowsize":
+                    if not 1 <= value <= options[name]:
+                        raise ValueError
+                    self.windowsize = value
+        except ValueError:
+            self._send(struct.pack("!HH", ERROR, 8) + "Bad options\0")
+            raise TftpException("Server sent bad options: %r" % accepted)
+
+    def _receive(self):
+        """Wait for a packet from the server. Returns None on timeout.
+
+        The first reply tells us the server's port for this transfer, and
+        after that we ignore anything from other ports. We don't check the
+        host, since a server with several addresses may not reply from the
+        one we sent to.
+
+        """
+        deadline = time.time() + self.timer.rto
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                packet, address = self.sock.recvfrom(MAX_PACKET_SIZE)
+            except socket.timeout:
+                return None
+            except socket.error as err:
+                raise TftpException("Socket error: %s" % err)
+
+            if len(packet) < 4:
+                continue
+            if self.address == None:
+                self.address = address
+            elif address[1] != self.address[1]:
+                continue
+            self.last_reply = time.time()
+
+            if self._opcode(packet) == ERROR:
+                code = struct.unpack("!H", packet[2:4])[0]
+                error = TftpException("TFTP error %i: %s"
+                                      % (code, packet[4:].rstrip("\0")))
+                error.code = code
+                raise error
+            return packet
+
+    def _retry(self, retries):
+        """Count a timeout and back off. Returns the new retry count."""
+        retries += 1
+        if (retries > self.client.retries and
+                time.time() - self.last_reply >= self.client.min_wait):
+            raise TftpException("Timed out waiting for TFTP server")
+        self.timeouts += 1
+        self.timer.backoff()
+        return retries
+
+    def _ack(self, block):
+        """Acknowledge everything up to a block."""
+        self._send(struct.pack("!HH", ACK, block & 0xFFFF))
+
+    def _send(self, packet):
+        """Send a packet to the server's port for this transfer."""
+        self.sock.sendto(packet, self.address)
+
+    @staticmethod
+    def _opcode(packet):
+        """Get the opcode of a packet."""
+        return struct.unpack("!H", packet[:2])[0]
+
+
+# End of file: ./tftp_client.py
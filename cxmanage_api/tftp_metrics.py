@@ -0,0 +1,219 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: tftp_metrics.py"""
+
+import time
+from collections import deque
+from threading import Lock
+
+
+class TransferStats(object):
+    """Record of a single TFTP transfer, finished or failed.
+
+    >>> stats = client.get_file('fabric_info.txt', '/tmp/fabric_info.txt')
+    >>> stats.throughput
+    2097152.0
+
+    :param peer: Address of the host at the other end.
+    :type peer: string
+    :param direction: "send" if we sent the file, "receive" if we got it.
+    :type direction: string
+    :param filename: Name of the file on the server.
+    :type filename: string
+    :param size: Number of bytes transferred.
+    :type size: integer
+    :param elapsed: Seconds from request to completion.
+    :type elapsed: float
+    :param blksize: Negotiated block size.
+    :type blksize: integer
+    :param windowsize: Negotiated window size.
+    :type windowsize: integer
+    :param retransmits: Number of packets we had to send again.
+    :type retransmits: integer
+    :param timeouts: Number of times we gave up waiting on the peer.
+    :type timeouts: integer
+    :param error: Why the transfer failed, or None if it succeeded.
+    :type error: string
+
+    """
+
+    # pylint: disable=R0913
+    def __init__(self, peer, direction, filename, size, elapsed, blksize,
+                 windowsize, retransmits=0, timeouts=0, error=None):
+        self.timestamp = time.time()
+        self.peer = peer
+        self.direction = direction
+        self.filename = filename
+        self.size = size
+        self.elapsed = elapsed
+        self.blksize = blksize
+        self.windowsize = windowsize
+        self.retransmits = retransmits
+        self.timeouts = timeouts
+        self.error = error
+
+    @property
+    def throughput(self):
+        """Average bytes per second."""
+        return self.size / max(self.elapsed, 1e-6)
+
+    def __str__(self):
+        result = ("%s %s %s: %i bytes in %.3f seconds (%.1f KB/s), "
+                  "blksize %i, windowsize %i, %i retransmits, %i timeouts" % (
+                      self.peer, self.direction, self.filename, self.size,
+                      self.elapsed, self.throughput / 1024, self.blksize,
+                      self.windowsize, self.retransmits, self.timeouts))
+        if (self.error != None):
+            result += ", failed: %s" % self.error
+        return result
+
+
+class TransferLog(object):
+    """Bounded, thread-safe history of TFTP transfers. Once it's full, the
+    oldest records are dropped.
+
+    Our TFTP clients and servers all record to the default log unless
+    they're given another one.
+
+    >>> from cxmanage_api.tftp_metrics import TransferLog
+    >>> log = TransferLog.default()
+    >>> log.get_stats(direction="send")
+    {'count': 12, 'failures': 0, 'size': 50331648, 'elapsed': 21.2,
+     'throughput': 2374134.3, 'retransmits': 3, 'timeouts': 1}
+
+    :param capacity: Maximum number of records to keep.
+    :type capacity: integer
+
+    """
+    _default = None
+
+    @staticmethod
+    def default():
+        """ Return the default TransferLog """
+        if TransferLog._default == None:
+            TransferLog._default = TransferLog()
+        return TransferLog._default
+
+    def __init__(self, capacity=1000):
+        """Default constructor for the TransferLog class."""
+        if capacity < 1:
+            raise ValueError("Transfer log capacity must be at least 1")
+        self.capacity = capacity
+        self._records = deque(maxlen=capacity)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def record(self, stats):
+        """Add a transfer to the log.
+
+        :param stats: The transfer to record.
+        :type stats: TransferStats
+
+        """
+        with self._lock:
+            self._records.append(stats)
+
+    def get_records(self, peer=None, direction=None, since=None):
+        """Get recorded transfers, oldest first.
+
+        >>> log.get_records(peer='10.20.1.9')
+        [<cxmanage_api.tftp_metrics.TransferStats object at 0x7f1e5c2a4d10>]
+
+        :param peer: Only return transfers with this host.
+        :type peer: string
+        :param direction: Only return transfers in this direction.
+        :type direction: string
+        :param since: Only return transfers recorded at or after this time.
+        :type since: float
+
+        :returns: Matching transfers.
+        :rtype: list
+
+        """
+        with self._lock:
+            records = list(self._records)
+        return [x for x in records if
+                (peer == None or x.peer == peer) and
+                (direction == None or x.direction == direction) and
+                (since == None or x.timestamp >= since)]
+
+    def get_stats(self, peer=None, direction=None, since=None):
+        """Get aggregate statistics over recorded transfers.
+
+        :param peer: Only consider transfers with this host.
+        :type peer: string
+        :param direction: Only consider transfers in this direction.
+        :type direction: string
+        :param since: Only consider transfers recorded at or after this time.
+        :type since: float
+
+        :returns: count, failures, size (total bytes), elapsed (total
+                  seconds), throughput (bytes per second while transferring),
+                  retransmits and timeouts, or None if there are no matching
+                  transfers.
+        :rtype: dictionary
+
+        """
+        records = self.get_records(peer, direction, since)
+        if not records:
+            return None
+
+        size = sum(x.size for x in records)
+        elapsed = sum(x.elapsed for x in records)
+        return {
+            "count": len(records),
+            "failures": len([x for x in records if x.error != None]),
+            "size": size,
+            "elapsed": elapsed,
+            "throughput": size / max(elapsed, 1e-6),
+            "retransmits": sum(x.retransmits for x in records),
+            "timeouts": sum(x.timeouts for x in records)
+        }
+
+    def get_peers(self):
+        """Get every (peer, direction) pair in the log.
+
+        :returns: Sorted (peer, direction) tuples.
+        :rtype: list
+
+        """
+        with self._lock:
+            return sorted(set((x.peer, x.direction) for x in self._records))
+
+    def clear(self):
+        """Remove every record."""
+        with self._lock:
+            self._records.clear()
+
+
+# End of file: ./tftp_metrics.py
@@ -0,0 +1,678 @@
+# Copyright (c) 2012-2013, Calxeda Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+# * Redistributions in binary form must reproduce the above copyright
+# notice, this list of conditions and the following disclaimer in the
+# documentation and/or other materials provided with the distribution.
+# * Neither the name of Calxeda Inc. nor the names of its contributors
+# may be used to endorse or promote products derived from this software
+# without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""Calxeda: tftp_server.py"""
+
+import os
+import time
+import errno
+import select
+import socket
+import struct
+from threading import Event
+
+from cxmanage_api.tftp_metrics import TransferLog, TransferStats
+
+
+# TFTP opcodes (RFC 1350, RFC 2347)
+RRQ, WRQ, DATA, ACK, ERROR, OACK = range(1, 7)
+
+# TFTP error codes
+ERR_UNDEFINED = 0
+ERR_FILE_NOT_FOUND = 1
+ERR_ACCESS_VIOLATION = 2
+ERR_ILLEGAL_OPERATION = 4
+
+DEFAULT_BLKSIZE = 512
+MIN_BLKSIZE = 8
+MAX_BLKSIZE = 65464
+MAX_WINDOWSIZE = 65535
+
+# Largest packet we ever expect to receive.
+MAX_PACKET_SIZE = MAX_BLKSIZE + 4
+
+# Socket buffers big enough to hold a few full windows.
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Errors that just mean the socket buffer is full for now.
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS)
+
+# How long to wait before sending more of a window after a full buffer.
+_BLOCKED_DELAY = 0.005
+
+
+class TftpServer(object):
+    """A TFTP server that handles many transfers at once from a single
+    thread, with per-session sockets and a select() loop.
+
+    Supports RFC 2347 option negotiation with the blksize (RFC 2348),
+    timeout and tsize (RFC 2349), and windowsize (RFC 7440) options.
+
+    >>> from cxmanage_api.tftp_server import TftpServer
+    >>> server = TftpServer('/srv/tftp')
+    >>> server.port
+    34507
+    >>> server.serve_forever()
+
+    :param root: Directory to serve files from, and write uploads to.
+    :type root: string
+    :param ip_address: Address to listen on. Defaults to all addresses.
+    :type ip_address: string
+    :param port: Port to listen on. Defaults to any free port.
+    :type port: integer
+    :param upload_callback: Called with the name of each finished upload.
+    :type upload_callback: function
+    :param timeout: Seconds to wait before retransmitting.
+    :type timeout: float
+    :param retries: Retransmissions before a session is abandoned.
+    :type retries: integer
+    :param max_blksize: Largest block size to agree to.
+    :type max_blksize: integer
+    :param max_windowsize: Largest window size to agree to.
+    :type max_windowsize: integer
+    :param open_upload: Called with the name and local path of each upload,
+                        to get a file object to write it to. Defaults to
+                        writing the file at that path.
+    :type open_upload: function
+    :param transfer_log: Where to record transfers. Defaults to
+                         TransferLog.default().
+    :type transfer_log: TransferLog
+
+    """
+
+    # pylint: disable=R0913
+    def __init__(self, root, ip_address="", port=0, upload_callback=None,
+                 timeout=1.0, retries=5, max_blksize=MAX_BLKSIZE,
+                 max_windowsize=64, open_upload=None, transfer_log=None):
+        self.root = os.path.abspath(root)
+        self.ip_address = ip_address
+        self.upload_callback = upload_callback
+        self.open_upload = open_upload
+        if (transfer_log == None):
+            transfer_log = TransferLog.default()
+        self.transfer_log = transfer_log
+        self.timeout = timeout
+        self.retries = retries
+        self.max_blksize = max_blksize
+        self.max_windowsize = max_windowsize
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((ip_address, port))
+        self.sock.setblocking(0)
+        self.port = self.sock.getsockname()[1]
+
+        self._sessions = {}
+        self._stopped = Event()
+
+    def serve_forever(self, poll_interval=0.5):
+        """Serve transfers until stop() is called.
+
+        :param poll_interval: Longest time to go without checking for stop().
+        :type poll_interval: float
+
+        """
+        while not self._stopped.is_set():
+            now = time.time()
+            timeout = poll_interval
+            for session in self._sessions.values():
+                timeout = min(timeout, max(0, session.deadline - now))
+
+            socks = [self.sock] + self._sessions.keys()
+            try:
+                readable = select.select(socks, [], [], timeout)[0]
+            except select.error as err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for sock in readable:
+                if sock is self.sock:
+                    self._handle_requests()
+                elif sock in self._sessions:
+                    self._sessions[sock].handle_readable()
+
+            now = time.time()
+            for session in self._sessions.values():
+                if not session.finished and now >= session.deadline:
+                    session.handle_timeout()
+
+            for sock, session in self._sessions.items():
+                if session.finished:
+                    session.close()
+                    del self._sessions[sock]
+
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+        self.sock.close()
+
+    def stop(self):
+        """Stop serving. serve_forever() returns shortly afterwards."""
+        self._stopped.set()
+
+    @property
+    def session_count(self):
+        """Number of transfers in progress."""
+        return len(self._sessions)
+
+    def _handle_requests(self):
+        """Start a session for each pending request on the main socket."""
+        while True:
+            try:
+                packet, address = self.sock.recvfrom(MAX_PACKET_SIZE)
+            except socket.error as err:
+                if err.args[0] in _WOULD_BLOCK:
+                    return
+                raise
+
+            try:
+                session = self._start_session(packet, address)
+            except (ValueError, struct.error):
+                _send_error(self.sock, ERR_ILLEGAL_OPERATION,
+                            "Malformed request", address)
+                continue
+            except _TftpError as err:
+                _send_error(self.sock, err.code, err.message, address)
+                continue
+
+            self._sessions[session.sock] = session
+
+    def _start_session(self, packet, address):
+        """Parse a request, negotiate options, and start the session."""
+        opcode = struct.unpack("!H", packet[:2])[0]
+        if opcode not in (RRQ, WRQ):
+            raise _TftpError(ERR_ILLEGAL_OPERATION, "Unexpected opcode")
+
+        filename, _, options = parse_request(packet)
+        path = self._get_path(filename)
+
+        if opcode == RRQ:
+            try:
+                fileobj = open(path, "rb")
+            except IOError as err:
+                if err.errno == errno.ENOENT:
+                    raise _TftpError(ERR_FILE_NOT_FOUND, "File not found")
+                raise _TftpError(ERR_ACCESS_VIOLATION, "Access violation")
+            filesize = os.fstat(fileobj.fileno()).st_size
+        else:
+            try:
+                if (self.open_upload != None):
+                    fileobj = self.open_upload(filename, path)
+                else:
+                    fileobj = create_file(path)
+            except IOError:
+                raise _TftpError(ERR_ACCESS_VIOLATION, "Access violation")
+            filesize = None
+
+        accepted, blksize, windowsize, timeout = negotiate_options(
+            options, filesize, self.max_blksize, self.max_windowsize,
+            self.timeout
+        )
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+            except socket.error:
+                pass
+        sock.bind((self.ip_address, 0))
+        sock.setblocking(0)
+
+        if opcode == RRQ:
+            return _ReadSession(self, sock, address, fileobj, filename,
+                                filesize, accepted, blksize, windowsize,
+                                timeout)
+        return _WriteSession(self, sock, address, fileobj, filename,
+                             accepted, blksize, windowsize, timeout)
+
+    def _get_path(self, filename):
+        """Map a requested filename into the root, refusing to leave it."""
+        path = os.path.normpath(os.path.join(self.root, filename.lstrip("/")))
+        if not path.startswith(self.root + os.sep):
+            raise _TftpError(ERR_ACCESS_VIOLATION, "Access violation")
+        return path
+
+
+def parse_request(packet):
+    """Parse a RRQ or WRQ packet.
+
+    >>> parse_request('\\x00\\x01file.bin\\x00octet\\x00blksize\\x001428\\x00')
+    ('file.bin', 'octet', {'blksize': '1428'})
+
+    :param packet: The request packet.
+    :type packet: string
+
+    :returns: The filename, the mode, and any options by lowercase name.
+    :rtype: tuple
+
+    :raises ValueError: If the request is malformed.
+
+    """
+    fields = packet[2:].split("\0")
+    if len(fields) < 3 or fields[-1] != "" or not fields[0]:
+        raise ValueError("Malformed request")
+
+    filename, mode = fields[0], fields[1].lower()
+    values = fields[2:-1]
+    options = dict(
+        (values[i].lower(), values[i + 1])
+        for i in xrange(0, len(values) - 1, 2)
+    )
+    return filename, mode, options
+
+# pylint: disable=R0913
+def negotiate_options(options, filesize, max_blksize=MAX_BLKSIZE,
+                      max_windowsize=MAX_WINDOWSIZE, timeout=1.0):
+    """Decide which of a client's options to accept.
+
+    >>> negotiate_options({'blksize': '1428', 'tsize': '0'}, 1000000)
+    ({'blksize': '1428', 'tsize': '1000000'}, 1428, 1, 1.0)
+
+    :param options: Requested options, by lowercase name.
+    :type options: dictionary
+    :param filesize: Size of the file being read, or None for a write.
+    :type filesize: integer
+    :param max_blksize: Largest block size to agree to.
+    :type max_blksize: integer
+    :param max_windowsize: Largest window size to agree to.
+    :type max_windowsize: integer
+    :param timeout: Retransmission timeout if the client doesn't pick one.
+    :type timeout: float
+
+    :returns: The options for the OACK, then the block size, window size and
+              timeout to use.
+    :rtype: tuple
+
+    """
+    accepted = {}
+    blksize = DEFAULT_BLKSIZE
+    windowsize = 1
+
+    for name, value in options.items():
+        try:
+            value = int(value)
+        except ValueError:
+            continue
+
+        if name == "blksize" and value >= MIN_BLKSIZE:
+            blksize = min(value, max_blksize, MAX_BLKSIZE)
+            accepted[name] = str(blksize)
+        elif name == "windowsize" and value >= 1:
+            windowsize = min(value, max_windowsize, MAX_WINDOWSIZE)
+            accepted[name] = str(windowsize)
+        elif name == "timeout" and 1 <= value <= 255:
+            timeout = float(value)
+            accepted[name] = str(value)
+        elif name == "tsize" and value >= 0:
+            if filesize != None:
+                value = filesize
+            accepted[name] = str(value)
+
+    return accepted, blksize, windowsize, timeout
+
+
+class _TftpError(Exception):
+    """An error to report to a client with an ERROR packet."""
+
+    def __init__(self, code, message):
+        super(_TftpError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+def create_file(path):
+    """Open a new, empty file for an upload. An existing file is unlinked
+    rather than truncated, since it may be a hard link to a file that's
+    shared with other names.
+
+    :param path: Path of the file to create.
+    :type path: string
+
+    :return: The file, open for writing.
+    :rtype: file
+
+    """
+    try:
+        os.unlink(path)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise IOError(err.errno, err.strerror, path)
+    return open(path, "wb")
+
+
+def _send_error(sock, code, message, address):
+    """Send an ERROR packet, ignoring any failure."""
+    packet = struct.pack("!HH", ERROR, code) + message + "\0"
+    try:
+        sock.sendto(packet, address)
+    except socket.error:
+        pass
+
+
+def _make_oack(options):
+    """Build an OACK packet."""
+    return struct.pack("!H", OACK) + "".join(
+        "%s\0%s\0" % (name, value) for name, value in sorted(options.items())
+    )
+
+
+class _Session(object):
+    """Common state for a single transfer, with its own socket.
+
+    The socket isn't connected to the client, since a client that talks to
+    one of several local addresses may hear back from another. We only check
+    that packets come from the client's port.
+
+    """
+    direction = None
+
+    # pylint: disable=R0913
+    def __init__(self, server, sock, address, fileobj, filename, blksize,
+                 windowsize, timeout):
+        self.server = server
+        self.sock = sock
+        self.address = address
+        self.fileobj = fileobj
+        self.filename = filename
+        self.blksize = blksize
+        self.windowsize = windowsize
+        self.timeout = timeout
+        self.deadline = time.time() + timeout
+        self.retries = 0
+        self.finished = False
+
+        self.start = time.time()
+        self.end = None
+        self.transferred = 0
+        self.retransmits = 0
+        self.timeouts = 0
+        self.error = None
+
+    def handle_readable(self):
+        """Handle every packet waiting on this session's socket."""
+        while not self.finished:
+            try:
+                packet, address = self.sock.recvfrom(MAX_PACKET_SIZE)
+            except socket.error as err:
+                if err.args[0] in _WOULD_BLOCK:
+                    return
+                self.finish(str(err))
+                return
+
+            if address[1] != self.address[1] or len(packet) < 4:
+                continue
+
+            opcode = struct.unpack("!H", packet[:2])[0]
+            if opcode == ERROR:
+                self.finish("Client error: %s" % packet[4:].rstrip("\0"))
+            else:
+                self.handle_packet(opcode, packet)
+
+    def handle_packet(self, opcode, packet):
+        """Handle a single packet from the client."""
+        raise NotImplementedError
+
+    def handle_timeout(self):
+        """Handle the deadline passing without progress."""
+        raise NotImplementedError
+
+    def send(self, packet):
+        """Send a packet. Returns False if the socket buffer is full."""
+        try:
+            self.sock.sendto(packet, self.address)
+            return True
+        except socket.error as err:
+            if err.args[0] in _WOULD_BLOCK:
+                return False
+            self.finish(str(err))
+            return False
+
+    def retry(self):
+        """Count a retransmission. Returns False if we should give up."""
+        self.retries += 1
+        self.timeouts += 1
+        if self.retries > self.server.retries:
+            self.finish("Timed out waiting for client")
+            return False
+        return True
+
+    def fail(self, code, message):
+        """Report an error to the client and end the session."""
+        _send_error(self.sock, code, message, self.address)
+        self.finish(message)
+
+    def finish(self, error=None):
+        """Mark this session as over, and why if it failed."""
+        if not self.finished:
+            self.finished = True
+            self.error = error
+            if (self.end == None):
+                self.end = time.time()
+
+    def close(self):
+        """Release the session's file and socket, and record it."""
+        self.fileobj.close()
+        self.sock.close()
+
+        self.finish("Server stopped")
+        self.server.transfer_log.record(TransferStats(
+            self.address[0], self.direction, self.filename, self.transferred,
+            self.end - self.start, self.blksize, self.windowsize,
+            self.retransmits, self.timeouts, self.error
+        ))
+
+
+class _ReadSession(_Session):
+    """Sends a file to a client, a window of blocks at a time."""
+    direction = "send"
+
+    # pylint: disable=R0913
+    def __init__(self, server, sock, address, fileobj, filename, filesize,
+                 options, blksize, windowsize, timeout):
+        super(_ReadSession, self).__init__(server, sock, address, fileobj,
+                                           filename, blksize, windowsize,
+                                           timeout)
+        self.filesize = filesize
+        self.last_block = filesize // blksize + 1
+        self.base = 1
+        self.next = 1
+        self.highest = 0
+        self.blocked = False
+        self._rewound = None
+
+        # With options, the client has to ACK the OACK before any data
+        if options:
+            self.oack = _make_oack(options)
+            self.send(self.oack)
+        else:
+            self.oack = None
+            self.send_window()
+
+    def send_window(self):
+        """Send as much of the current window as we can."""
+        self.blocked = False
+        limit = min(self.base + self.windowsize, self.last_block + 1)
+        while self.next < limit:
+            self.fileobj.seek((self.next - 1) * self.blksize)
+            packet = struct.pack("!HH", DATA, self.next & 0xFFFF) + \
+                    self.fileobj.read(self.blksize)
+            if not self.send(packet):
+                self.blocked = True
+                break
+            if self.next <= self.highest:
+                self.retransmits += 1
+            self.highest = max(self.highest, self.next)
+            self.next += 1
+
+        if self.blocked:
+            self.deadline = time.time() + _BLOCKED_DELAY
+        else:
+            self.deadline = time.time() + self.timeout
+
+    def handle_packet(self, opcode, packet):
+        if opcode != ACK:
+            self.fail(ERR_ILLEGAL_OPERATION, "Expected an ACK")
+            return
+        block = struct.unpack("!H", packet[2:4])[0]
+
+        if self.oack != None:
+            if block == 0:
+                self.oack = None
+                self.retries = 0
+                self.send_window()
+            return
+
+        # Map the 16-bit block number onto what we've sent
+        acked = self.base - 1 + ((block - (self.base - 1)) & 0xFFFF)
+        if acked >= self.next:
+            return
+
+        self.retries = 0
+        if acked >= self.base:
+            self.base = acked + 1
+            self.transferred = min(acked * self.blksize, self.filesize)
+        if self.base > self.last_block:
+            self.finish()
+            return
+
+        # An ACK short of what we've sent means the client missed a block.
+        # Go back to it, but only once for each gap.
+        if acked < self.next - 1 and self._rewound != self.base:
+            self.next = self.base
+            self._rewound = self.base
+        self.send_window()
+
+    def handle_timeout(self):
+        if self.blocked:
+            self.send_window()
+        elif self.retry():
+            if self.oack != None:
+                self.retransmits += 1
+                self.send(self.oack)
+                self.deadline = time.time() + self.timeout
+            else:
+                self.next = self.base
+                self._rewound = self.base
+                self.send_window()
+
+
+class _WriteSession(_Session):
+    """Receives a file from a client, ACKing once per window."""
+    direction = "receive"
+
+    # pylint: disable=R0913
+    def __init__(self, server, sock, address, fileobj, filename, options,
+                 blksize, windowsize, timeout):
+        super(_WriteSession, self).__init__(server, sock, address, fileobj,
+                                            filename, blksize, windowsize,
+                                            timeout)
+        self.expected = 1
+        self.received = 0
+        self.complete = False
+        self._gap_acked = False
+
+        # The OACK stands in for ACK 0
+        if options:
+            self.first_packet = _make_oack(options)
+        else:
+            self.first_packet = struct.pack("!HH", ACK, 0)
+        self.send(self.first_packet)
+
+    def ack(self, block):
+        """ACK a block, and wait for more."""
+        self.send(struct.pack("!HH", ACK, block & 0xFFFF))
+        self.deadline = time.time() + self.timeout
+
+    def handle_packet(self, opcode, packet):
+        if opcode != DATA:
+            self.fail(ERR_ILLEGAL_OPERATION, "Expected DATA")
+            return
+        block = struct.unpack("!H", packet[2:4])[0]
+
+        if self.complete:
+            # Our final ACK was lost
+            self.retransmits += 1
+            self.ack(self.expected - 1)
+            return
+
+        if block != self.expected & 0xFFFF:
+            # Out of order. ACK the last good block, once per gap, so the
+            # client starts again from there.
+            if not self._gap_acked:
+                self._gap_acked = True
+                self.received = 0
+                self.retransmits += 1
+                self.ack(self.expected - 1)
+            return
+
+        data = packet[4:]
+        try:
+            self.fileobj.write(data)
+        except (IOError, ValueError) as err:
+            # Out of space, or the upload was released under us
+            self.fail(ERR_UNDEFINED, "Write failed: %s" % err)
+            return
+        self.transferred += len(data)
+        self.expected += 1
+        self.received += 1
+        self.retries = 0
+        self._gap_acked = False
+
+        if len(data) < self.blksize:
+            # Flush, but don't close until the callback has seen the file,
+            # since it may not be on disk.
+            self.fileobj.flush()
+            self.complete = True
+            self.end = time.time()
+            self.ack(block)
+            if self.server.upload_callback != None:
+                self.server.upload_callback(self.filename)
+            self.fileobj.close()
+        elif self.received >= self.windowsize:
+            self.received = 0
+            self.ack(block)
+        else:
+            self.deadline = time.time() + self.timeout
+
+    def handle_timeout(self):
+        if self.complete:
+            # Done waiting to see if the final ACK arrived
+            self.finish()
+        elif self.retry():
+            self.received = 0
+            self.retransmits += 1
+            if self.expected == 1:
+                self.send(self.first_packet)
+                self.deadline = time.time() + self.timeout
+            else:
+                self.ack(self.expected - 1)
+
+
+# End of file: ./tftp_server.py